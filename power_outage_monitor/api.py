@@ -1,43 +1,226 @@
+import asyncio
+import math
 import secrets
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Security, status
+import anyio.to_thread
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, Security, status
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import APIKeyHeader
 from loguru import logger
 from prtg import PrtgApi
+from pydantic import BaseModel
 
+import cache_backend
 import check_all
+import check_outage
+import clients
+import cmdb_mirror
 import geocode
-from config import config
+import http_client
+import jobs
+import location_index
+import metrics
+import prtg_snapshot
+import ratelimit
+import serial_cache
+import sweep
+from config import config, start_watcher, stop_watcher
 from meraki import MerakiOrgApi
-from opsgenie import OpsgenieApi
+from opsgenie import OpsgenieApi, Outbox
 from snow import SnowApi
 
 TOKEN = config["web"]["token"]
-try:
-    PRTG_API = PrtgApi(config['prtg']['url'], config['prtg']['username'], config['prtg']['password'], is_passhash=config['prtg']['is_passhash'])
-except KeyError:
-    PRTG_API = PrtgApi(config['prtg']['url'], config['prtg']['username'], config['prtg']['password'])
-try:
-    OPSGENIE_API = OpsgenieApi(config['opsgenie']['api_key'], config['opsgenie']['identifier_type'])
-except KeyError:
-    OPSGENIE_API = OpsgenieApi(config['opsgenie']['api_key'])
-SNOW_API = SnowApi(config['snow']['instance'], config['snow']['username'], config['snow']['password'])
+
+# clients are built on first use or by the warm-up started with the app, see clients.LazyClient
+def make_prtg_api():
+    try:
+        return PrtgApi(config['prtg']['url'], config['prtg']['username'], config['prtg']['password'], is_passhash=config['prtg']['is_passhash'])
+    except KeyError:
+        return PrtgApi(config['prtg']['url'], config['prtg']['username'], config['prtg']['password'])
+
+def make_opsgenie_api():
+    try:
+        return OpsgenieApi(config['opsgenie']['api_key'], config['opsgenie']['identifier_type'], session=http_client.get_session(),
+                           url=config['opsgenie'].get('url', 'https://api.opsgenie.com'))
+    except KeyError:
+        return OpsgenieApi(config['opsgenie']['api_key'], session=http_client.get_session(),
+                           url=config['opsgenie'].get('url', 'https://api.opsgenie.com'))
+
+def make_meraki_api():
+    meraki_config = config['meraki']
+    meraki_api = MerakiOrgApi(org_id=meraki_config.get('org_id'), api_key=meraki_config.get('api_key'), base_url=meraki_config.get('url'))
+    snapshot_config = meraki_config.get('snapshot') or {}
+    if snapshot_config.get('enabled'):
+        meraki_api.start_snapshot(refresh_interval=snapshot_config.get('refreshInterval', 60),
+                                  max_staleness=snapshot_config.get('maxStaleness', 300),
+                                  max_backoff=snapshot_config.get('maxBackoff', 600))
+    return meraki_api
+
+PRTG_API = clients.LazyClient('prtg', make_prtg_api)
+# timed here rather than where check_all calls it, so only real requests, e.g. those sent by the outbox, count
+OPSGENIE_API = clients.LazyClient('opsgenie', make_opsgenie_api, timed=True)
+OUTBOX_CONFIG = config['opsgenie'].get('outbox') or {}
+if OUTBOX_CONFIG.get('enabled'):
+    OPSGENIE_OUTBOX = Outbox(OPSGENIE_API, OUTBOX_CONFIG.get('path', 'opsgenie_outbox.db'),
+                             poll_interval=OUTBOX_CONFIG.get('pollInterval', 1),
+                             coalesce_delay=OUTBOX_CONFIG.get('coalesceDelay', 0.5),
+                             max_backoff=OUTBOX_CONFIG.get('maxBackoff', 300),
+                             max_attempts=OUTBOX_CONFIG.get('maxAttempts', 10),
+                             leader=lambda: cache_backend.hold_lease('opsgenie-outbox', 60))
+else:
+    OPSGENIE_OUTBOX = None
+SNOW_API = clients.LazyClient('snow', lambda: SnowApi(config['snow'].get('instance'), config['snow']['username'], config['snow']['password'],
+                                                       host=config['snow'].get('host'), use_ssl=config['snow'].get('useSsl', True)))
 SNOW_FILTER = config['snow']['filter']
-# MERAKI_API = MerakiOrgApi(org_id=config['meraki']['org_id'], api_key=config['meraki']['api_key'])
+# checks go on without Meraki until it is reachable, so it does not hold up readiness
+MERAKI_API = clients.LazyClient('meraki', make_meraki_api, required=False) if (config.get('meraki') or {}).get('enabled') else None
+CLIENTS = [client for client in (SNOW_API, PRTG_API, OPSGENIE_API, MERAKI_API) if client is not None]
+
+def get_meraki_api():
+    """get the Meraki client if it is enabled and built, otherwise None"""
+    return MERAKI_API.get_if_ready() if MERAKI_API is not None else None
 
 app = FastAPI()
 
 api_key = APIKeyHeader(name='X-API-Key')
 
+@app.on_event("startup")
+def start_snapshots():
+    start_watcher()
+    clients.start_warm_up(CLIENTS)
+    check_outage.start_snapshots()
+    cmdb_mirror.start_mirror(SNOW_API, SNOW_FILTER)
+    location_index.start_index(SNOW_API)
+    prtg_snapshot.start_snapshot(PRTG_API)
+    if MERAKI_API is not None:
+        serial_cache.start_write_back(SNOW_API)
+    if OPSGENIE_OUTBOX is not None:
+        OPSGENIE_OUTBOX.start()
+    sweep.start_sweep(lambda site: check_all.get_shared_site_statuses(site, PRTG_API, get_meraki_api(), SNOW_API, SNOW_FILTER))
+
+@app.on_event("shutdown")
+def stop_warm_up():
+    clients.stop_warm_up()
+    stop_watcher()
+
 def authorize(key: str = Security(api_key)):
     if not secrets.compare_digest(key, TOKEN):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail='Invalid token')
 
-@app.get("/checkSite", dependencies=[Depends(authorize)])
-def check_site(siteName: str, alertId: str, actionName: str):
-    site = SNOW_API.get_site_by_name(siteName)
+@app.exception_handler(clients.ClientUnavailable)
+def client_unavailable(request: Request, err: clients.ClientUnavailable):
+    logger.error(str(err))
+    return JSONResponse(status_code=503, content={"detail": str(err)})
+
+def retry_after(seconds):
+    return {'Retry-After': str(math.ceil(seconds))}
+
+@app.exception_handler(ratelimit.RateLimited)
+def rate_limited(request: Request, err: ratelimit.RateLimited):
+    logger.warning(str(err))
+    return JSONResponse(status_code=503, content={"detail": str(err)}, headers=retry_after(err.retry_after))
+
+@app.exception_handler(jobs.QueueFull)
+def queue_full(request: Request, err: jobs.QueueFull):
+    logger.warning(f"Rejected check: {err}")
+    return JSONResponse(status_code=503, content={"detail": "Too many checks are queued"},
+                        headers=retry_after(err.retry_after or QUEUE_CONFIG.get('retryAfter', 30)))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        # label by route template, so ids in paths do not create new series
+        route = request.scope.get('route')
+        metrics.REQUEST_SECONDS.labels(request.method, route.path if route is not None else 'unmatched',
+                                       status_code).observe(time.perf_counter() - started)
+
+@app.get("/metrics")
+def get_metrics():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/healthz")
+def get_health():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def get_readiness():
+    """ready once every required client is built. Snapshots are reported but not required,
+    since lookups fall back to the upstreams until they load"""
+    dependencies = {client.name: client.status() for client in CLIENTS}
+    snapshots = {'gis_snapshot': check_outage.get_gis_snapshot(), 'cmdb_mirror': cmdb_mirror.get_mirror(fresh=False),
+                 'location_index': location_index.get_index(fresh=False), 'prtg_snapshot': prtg_snapshot.get_snapshot(fresh=False)}
+    for name, snapshot in snapshots.items():
+        if snapshot is not None:
+            dependencies[name] = dict(snapshot.status(), required=False)
+    ready = all(dependency['ready'] for dependency in dependencies.values() if dependency['required'])
+    return JSONResponse(status_code=200 if ready else 503,
+                        content={"status": "ready" if ready else "not ready", "dependencies": dependencies})
+
+# checks of new alerts are let in before checks of alerts seen within 'check.queue.retryWindow'
+NEW_ALERT, RETRIED_ALERT = 0, 1
+QUEUE_CONFIG = (config.get('check') or {}).get('queue') or {}
+# threads running sync endpoints, and admitted checks of /checkSite
+THREADPOOL_SIZE = config['web'].get('threadpoolSize', 40)
+if QUEUE_CONFIG.get('maxActive') and QUEUE_CONFIG['maxActive'] >= THREADPOOL_SIZE:
+    # waiting checks do not hold threads, but running ones must leave some to /healthz, /readyz and /metrics
+    raise ValueError(f"'check.queue.maxActive' ({QUEUE_CONFIG['maxActive']}) must be below "
+                     f"'web.threadpoolSize' ({THREADPOOL_SIZE}).")
+CHECK_GATE = jobs.PriorityGate(QUEUE_CONFIG['maxActive'],
+                               max_queued=QUEUE_CONFIG.get('maxQueued', 100),
+                               max_wait=QUEUE_CONFIG.get('maxWait', 60),
+                               retry_after=QUEUE_CONFIG.get('retryAfter', 30)) if QUEUE_CONFIG.get('maxActive') else None
+
+# event loop of the app, on which jobs of POST /checks wait for CHECK_GATE like calls of /checkSite
+EVENT_LOOP = None
+
+@app.on_event("startup")
+async def set_threadpool_size():
+    global EVENT_LOOP
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    EVENT_LOOP = asyncio.get_running_loop()
+
+def get_priority(alertId):
+    if cache_backend.get_cache().add(f'alert:{alertId}', True, ttl=QUEUE_CONFIG.get('retryWindow', 3600)):
+        return NEW_ALERT
+    return RETRIED_ALERT
+
+@asynccontextmanager
+async def admit_check(alertId):
+    """wait for the check of an alert to be let in by the priority queue, if 'check.queue' enables it"""
+    if CHECK_GATE is None:
+        yield
+        return
+    priority = await run_in_threadpool(get_priority, alertId)
+    try:
+        async with CHECK_GATE.admit(priority):
+            yield
+    except jobs.QueueFull:
+        metrics.CHECKS_REJECTED.labels('new' if priority == NEW_ALERT else 'retry').inc()
+        raise
+
+def run_check(siteName, alertId, actionName):
+    locations = location_index.get_index()
+    site = locations.get_site_by_name(siteName) if locations is not None else None
+    metrics.cache_lookup('location_index', bool(site))
+    if not site:
+        # sites added to ServiceNow since the index last synced are only found there
+        with metrics.span('snow', 'get_site_by_name'):
+            site = SNOW_API.get_site_by_name(siteName)
     if not site:
         logger.info("Could not find site '" + siteName + "'")
         raise HTTPException(status_code=404, detail="Could not find site '" + siteName + "'")
@@ -46,6 +229,119 @@ def check_site(siteName: str, alertId: str, actionName: str):
         address = ', '.join((site['street'], site['city'], site['state']))
         address = ' '.join((address, site['zip']))
         long, lat = geocode.get_long_lat(address)
-        site = SNOW_API.set_long_lat(site['sys_id'], long, lat)
+        with metrics.span('snow', 'set_long_lat'):
+            site = SNOW_API.set_long_lat(site['sys_id'], long, lat)
+        if locations is not None:
+            locations.update(site['sys_id'], {'longitude': long, 'latitude': lat})
     logger.info("Found site '" + siteName + ".' Getting power status...")
-    return check_all.check(site, alertId, actionName, PRTG_API, OPSGENIE_API, None, SNOW_API, SNOW_FILTER)
+    opsgenie_api = OPSGENIE_OUTBOX if OPSGENIE_OUTBOX is not None else OPSGENIE_API
+    return check_all.check(site, alertId, actionName, PRTG_API, opsgenie_api, get_meraki_api(), SNOW_API, SNOW_FILTER)
+
+async def run_admitted_check(siteName, alertId, actionName):
+    async with admit_check(alertId):
+        return await run_in_threadpool(run_check, siteName, alertId, actionName)
+
+def run_job(siteName, alertId, actionName):
+    """run the check of a POST /checks job once the priority queue lets it in, as for /checkSite"""
+    if CHECK_GATE is None:
+        return run_check(siteName, alertId, actionName)
+    return asyncio.run_coroutine_threadsafe(run_admitted_check(siteName, alertId, actionName), EVENT_LOOP).result()
+
+def run_timed_check(siteName, alertId, actionName):
+    with metrics.request_timings() as request_timings:
+        details = run_check(siteName, alertId, actionName)
+    return details, request_timings
+
+@app.get("/checkSite", dependencies=[Depends(authorize)])
+async def check_site(siteName: str, alertId: str, actionName: str, response: Response, timings: bool = False):
+    # wait for a turn on the event loop, so only admitted checks take a thread
+    async with admit_check(alertId):
+        details, request_timings = await run_in_threadpool(run_timed_check, siteName, alertId, actionName)
+    server_timing = request_timings.server_timing()
+    if server_timing:
+        response.headers['Server-Timing'] = server_timing
+    if timings:
+        return dict(details, timings=request_timings.to_dict())
+    return details
+
+JOBS_CONFIG = config.get('jobs') or {}
+CHECK_JOBS = jobs.JobQueue(run_job,
+                           max_workers=JOBS_CONFIG.get('maxWorkers', 8),
+                           max_queued=JOBS_CONFIG.get('maxQueued', 100),
+                           ttl=JOBS_CONFIG.get('ttl', 3600),
+                           cache=cache_backend.get_cache())
+
+class CheckRequest(BaseModel):
+    siteName: str
+    alertId: str
+    actionName: str
+
+class CheckJob(BaseModel):
+    id: str
+    status: str
+    created: float
+    finished: Optional[float]
+    details: Optional[dict]
+    error: Optional[str]
+
+# jobs are returned as JSONResponse, since response_model_exclude_none would also drop the null values
+# inside details, which /checkSite returns
+@app.post("/checks", status_code=status.HTTP_202_ACCEPTED, response_model=CheckJob, dependencies=[Depends(authorize)])
+def create_check(check: CheckRequest):
+    try:
+        job, _ = CHECK_JOBS.submit(check.alertId, check.siteName, check.alertId, check.actionName)
+    except jobs.QueueFull as err:
+        logger.warning(f"Rejected check for alert {check.alertId}: {err}")
+        raise HTTPException(status_code=503, detail="Too many checks are queued",
+                            headers=retry_after(QUEUE_CONFIG.get('retryAfter', 30)))
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=job.to_dict(),
+                        headers={'Location': app.url_path_for('get_check', id=job.id)})
+
+@app.get("/checks/{id}", response_model=CheckJob, dependencies=[Depends(authorize)])
+def get_check(id: str):
+    job = CHECK_JOBS.describe(id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Could not find check '" + id + "'")
+    return JSONResponse(content=job)
+
+@app.post("/reloadSites", dependencies=[Depends(authorize)])
+def reload_sites():
+    locations = location_index.get_index(fresh=False)
+    if locations is None:
+        raise HTTPException(status_code=404, detail="Location index is not enabled")
+    if not locations.reload():
+        raise HTTPException(status_code=502, detail="Could not reload sites from ServiceNow")
+    return {"sites": len(locations.rows)}
+
+@app.get("/alerts/{alertId}/delivery", dependencies=[Depends(authorize)])
+def get_alert_delivery(alertId: str):
+    if OPSGENIE_OUTBOX is None:
+        raise HTTPException(status_code=404, detail="Opsgenie outbox is not enabled")
+    delivery = OPSGENIE_OUTBOX.status(alertId)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="No updates were queued for alert '" + alertId + "'")
+    return delivery
+
+@app.get("/sweep", dependencies=[Depends(authorize)])
+def get_sweep():
+    summary = sweep.get_summary()
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Outage sweep is not enabled")
+    return summary
+
+@app.get("/outages", dependencies=[Depends(authorize)])
+def get_outages():
+    locations = location_index.get_index()
+    if locations is None:
+        raise HTTPException(status_code=503, detail="Location index is not available")
+    sites = []
+    points = []
+    for site in locations.get_sites():
+        point = location_index.site_point(site)
+        if point is not None:
+            sites.append(site)
+            points.append(point)
+    statuses = check_outage.get_gis_power_statuses([point[0] for point in points], [point[1] for point in points])
+    if statuses is None:
+        raise HTTPException(status_code=503, detail="Outage snapshot is not available")
+    return {site['name']: site_status for site, site_status in zip(sites, statuses) if site_status is not None}
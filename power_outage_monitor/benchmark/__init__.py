@@ -0,0 +1,2 @@
+from .load import run_load
+from .upstreams import Dataset, FakeUpstreams, Profile
\ No newline at end of file
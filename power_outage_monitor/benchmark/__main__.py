@@ -0,0 +1,207 @@
+"""Offline load benchmark of check_all.check and the API against local fake upstreams.
+
+Run from the power_outage_monitor directory, e.g.
+
+    python -m benchmark --sites 5000 --cmdb-rows 10000 --pge-regions 5000 --requests 1000 --concurrency 32
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import requests
+import uvicorn
+from loguru import logger
+
+import config
+from benchmark.load import run_load
+from benchmark.upstreams import Dataset, FakeUpstreams, Profile
+
+UPSTREAMS = ('arcgis', 'pge', 'opsgenie', 'snow', 'prtg', 'meraki')
+
+def parse_overrides(values, option):
+    """parse repeated NAME=VALUE options into a dict of floats"""
+    overrides = {}
+    for value in values or ():
+        name, _, number = value.partition('=')
+        if name not in UPSTREAMS or not number:
+            raise SystemExit(f"{option} expects one of {', '.join(UPSTREAMS)}=NUMBER, got '{value}'")
+        overrides[name] = float(number)
+    return overrides
+
+def get_profiles(args):
+    latencies = parse_overrides(args.upstream_latency, '--upstream-latency')
+    error_rates = parse_overrides(args.upstream_error_rate, '--upstream-error-rate')
+    return {name: Profile(latency=latencies.get(name, args.latency), jitter=args.jitter,
+                          error_rate=error_rates.get(name, args.error_rate)) for name in UPSTREAMS}
+
+def get_config(upstreams, args):
+    """config of the service under test, pointing at the fake upstreams"""
+    bench_config = upstreams.config()
+    bench_config.update({
+        'web': {'token': 'benchmark', 'host': '127.0.0.1', 'port': 0, 'log_level': 'warning', 'proxy': ''},
+        'logger': {},
+        'date-time': {'timezone': 'America/Los_Angeles', 'timeFormat': '%Y-%m-%d %H:%M:%S %Z'},
+        'check': {'cacheTtl': args.cache_ttl},
+        'cache': {'backend': 'memory'},
+    })
+    bench_config['geocode']['cache'] = {'path': None}
+    bench_config['meraki']['serialCache'] = {'path': None}
+    if args.snapshots:
+        bench_config['gis-api']['snapshot'] = {'enabled': True}
+        bench_config['snow']['mirror'] = {'enabled': True}
+        bench_config['snow']['locations'] = {'enabled': True}
+        bench_config['prtg']['snapshot'] = {'enabled': True}
+    return bench_config
+
+def wait_for_snapshots(timeout=120):
+    """wait until every enabled snapshot has loaded, so they are measured warm"""
+    import check_outage
+    import cmdb_mirror
+    import location_index
+    import prtg_snapshot
+
+    snapshots = [check_outage.get_gis_snapshot(), cmdb_mirror.get_mirror(fresh=False), location_index.get_index(fresh=False),
+                 prtg_snapshot.get_snapshot(fresh=False)]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(snapshot is None or snapshot.is_fresh() for snapshot in snapshots):
+            return
+        time.sleep(0.1)
+    logger.warning("Snapshots did not load before the benchmark started.")
+
+def bench_check(dataset, args):
+    """load check_all.check directly with clients pointed at the fake upstreams"""
+    from prtg import PrtgApi
+
+    import check_all
+    import check_outage
+    import cmdb_mirror
+    import http_client
+    import location_index
+    import prtg_snapshot
+    from meraki import MerakiOrgApi
+    from opsgenie import OpsgenieApi
+    from snow import SnowApi
+
+    prtg_config = config.config['prtg']
+    snow_config = config.config['snow']
+    meraki_config = config.config['meraki']
+    prtg_api = PrtgApi(prtg_config['url'], prtg_config['username'], prtg_config['password'])
+    opsgenie_api = OpsgenieApi(config.config['opsgenie']['api_key'], session=http_client.get_session(),
+                               url=config.config['opsgenie']['url'])
+    snow_api = SnowApi(None, snow_config['username'], snow_config['password'], host=snow_config['host'], use_ssl=False)
+    meraki_api = MerakiOrgApi(org_id=meraki_config['org_id'], api_key=meraki_config['api_key'], base_url=meraki_config['url'])
+
+    if args.snapshots:
+        check_outage.start_snapshots()
+        cmdb_mirror.start_mirror(snow_api, snow_config['filter'])
+        location_index.start_index(snow_api)
+        prtg_snapshot.start_snapshot(prtg_api)
+        wait_for_snapshots()
+
+    def check(i):
+        site = dataset.sites[i]
+        return check_all.check(site, f'alert-{i}', 'Benchmark', prtg_api, opsgenie_api, meraki_api,
+                               snow_api, snow_config['filter'])
+
+    return run_load('check_all.check', check, pick_sites(dataset, args), args.concurrency, args.warmup)
+
+def bench_app(dataset, args):
+    """load the API's /checkSite endpoint over HTTP, served by uvicorn in this process"""
+    import api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=args.port, log_level='warning'))
+    thread = threading.Thread(target=server.run, name='uvicorn', daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("The API failed to start.")
+        time.sleep(0.05)
+    # clients are built in the background, measure them connected like the snapshots
+    deadline = time.monotonic() + 60
+    while not all(client.is_ready() for client in api.CLIENTS) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if args.snapshots:
+        wait_for_snapshots()
+    url = f"http://127.0.0.1:{server.servers[0].sockets[0].getsockname()[1]}/checkSite"
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+    headers = {'X-API-Key': config.config['web']['token']}
+
+    def check_site(i):
+        response = session.get(url, headers=headers, params={
+            'siteName': dataset.sites[i]['name'], 'alertId': f'alert-{i}', 'actionName': 'Benchmark'})
+        response.raise_for_status()
+
+    try:
+        return run_load('GET /checkSite', check_site, pick_sites(dataset, args), args.concurrency, args.warmup)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+def pick_sites(dataset, args):
+    rng = random.Random(args.seed)
+    return [rng.randrange(len(dataset.sites)) for _ in range(args.warmup + args.requests)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('check', 'app', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per target')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests before timing')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--sites', type=int, default=1000)
+    parser.add_argument('--cmdb-rows', type=int, default=10000)
+    parser.add_argument('--pge-regions', type=int, default=5000)
+    parser.add_argument('--gis-features', type=int, default=1000)
+    parser.add_argument('--outage-rate', type=float, default=0.1, help='fraction of sites in an outage')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added by every upstream')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream requests failing with 503')
+    parser.add_argument('--upstream-latency', action='append', metavar='NAME=SECONDS',
+                        help=f"latency of one upstream, one of {', '.join(UPSTREAMS)}")
+    parser.add_argument('--upstream-error-rate', action='append', metavar='NAME=RATE')
+    parser.add_argument('--snapshots', action='store_true', help='enable the GIS, CMDB, location and PRTG snapshots')
+    parser.add_argument('--cache-ttl', type=float, default=0, help="'check.cacheTtl', 0 to measure every check")
+    parser.add_argument('--port', type=int, default=0, help='port of the API, any free port if 0')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='ERROR')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level.upper())
+
+    started = time.monotonic()
+    dataset = Dataset(sites=args.sites, cmdb_rows=args.cmdb_rows, pge_regions=args.pge_regions,
+                      gis_features=args.gis_features, outage_rate=args.outage_rate, seed=args.seed)
+    print(f"Generated {len(dataset.sites)} sites, {len(dataset.cis)} CIs, {len(dataset.regions)} PG&E regions "
+          f"and {len(dataset.features)} outages in {time.monotonic() - started:.1f}s.")
+    upstreams = FakeUpstreams(dataset, get_profiles(args))
+    upstreams.start()
+    config.config.update(get_config(upstreams, args))
+
+    results = []
+    try:
+        if args.target in ('check', 'both'):
+            results.append(bench_check(dataset, args))
+            print(results[-1].summary())
+        if args.target in ('app', 'both'):
+            results.append(bench_app(dataset, args))
+            print(results[-1].summary())
+    finally:
+        upstreams.stop()
+
+    upstream_counts = {name: {'requests': upstream.requests, 'errors': upstream.errors}
+                       for name, upstream in upstreams.upstreams.items()}
+    print("Upstream requests: " + ", ".join(f"{name} {counts['requests']}" for name, counts in upstream_counts.items()))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'args': vars(args), 'results': [result.to_dict() for result in results],
+                       'upstreams': upstream_counts}, fp, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def percentile(values, fraction):
+    """nearest-rank percentile of sorted values, or None if there are none"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(fraction * len(values)))
+    return values[rank - 1]
+
+class LoadResult:
+    """Latencies and errors of a load run."""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = 0
+        self.error_types = {}
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=None):
+        with self._lock:
+            self.latencies.append(latency)
+            if error is not None:
+                self.errors += 1
+                name = type(error).__name__
+                self.error_types[name] = self.error_types.get(name, 0) + 1
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            'name': self.name,
+            'concurrency': self.concurrency,
+            'requests': len(latencies),
+            'errors': self.errors,
+            'errorTypes': dict(self.error_types),
+            'duration': self.duration,
+            'throughput': len(latencies) / self.duration if self.duration else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        }
+
+    def summary(self):
+        result = self.to_dict()
+        if not result['requests']:
+            return f"{self.name}: no requests"
+        return (f"{self.name}: {result['requests']} requests, {result['errors']} errors, "
+                f"{result['throughput']:.1f} req/s at concurrency {self.concurrency} | "
+                f"p50 {result['p50'] * 1000:.1f}ms p95 {result['p95'] * 1000:.1f}ms "
+                f"p99 {result['p99'] * 1000:.1f}ms max {result['max'] * 1000:.1f}ms")
+
+def run_load(name, func, args, concurrency=8, warmup=0):
+    """call func with each item of args from concurrency threads, timing every call
+
+    Parameters
+    ----------
+    name : str
+    func : callable
+        Called with one item of args. Exceptions count as errors.
+    args : list
+    concurrency : int
+    warmup : int
+        Number of leading items called before timing starts, e.g. to fill caches.
+
+    Returns
+    -------
+    LoadResult
+    """
+
+    result = LoadResult(name, concurrency)
+
+    def call(arg, timed=True):
+        started = time.perf_counter()
+        error = None
+        try:
+            func(arg)
+        except Exception as err:
+            error = err
+        if timed:
+            result.record(time.perf_counter() - started, error)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load') as executor:
+        list(executor.map(lambda arg: call(arg, timed=False), args[:warmup]))
+        started = time.perf_counter()
+        list(executor.map(call, args[warmup:]))
+        result.duration = time.perf_counter() - started
+    return result
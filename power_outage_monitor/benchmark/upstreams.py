@@ -0,0 +1,483 @@
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# bounding box of California, where generated sites and outages are placed
+LONGITUDE_RANGE = (-124.0, -114.5)
+LATITUDE_RANGE = (32.6, 41.9)
+CITIES = ("Sacramento", "Fresno", "Oakland", "San Jose", "Bakersfield", "Stockton", "Modesto", "Redding")
+
+class Profile:
+    """Simulated behaviour of an upstream.
+
+    Parameters
+    ----------
+    latency : float
+        Mean seconds added to every response.
+    jitter : float
+        Maximum seconds added to or removed from latency.
+    error_rate : float
+        Fraction of requests answered with 503.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.01, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+class Dataset:
+    """Generated inventory and upstream payloads, deterministic for a seed.
+
+    Parameters
+    ----------
+    sites : int
+        Number of cmn_location rows.
+    cmdb_rows : int
+        Number of cmdb_ci rows, of which one Meraki device per site.
+    pge_regions : int
+        Number of regions in the PG&E payload.
+    gis_features : int
+        Number of outage polygons in the CalOES layer.
+    outage_rate : float
+        Fraction of sites placed inside an outage polygon.
+    seed : int
+    """
+
+    def __init__(self, sites=1000, cmdb_rows=10000, pge_regions=5000, gis_features=1000, outage_rate=0.1, seed=0):
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        epoch_ms = int(time.time() * 1000)
+
+        self.sites = []
+        for i in range(sites):
+            self.sites.append({
+                'sys_id': f'loc{i:06d}',
+                'name': f'Site {i:06d}',
+                'street': f'{rng.randint(1, 9999)} Main St',
+                'city': rng.choice(CITIES),
+                'state': 'CA',
+                'zip': f'{rng.randint(90001, 96162)}',
+                'longitude': f'{rng.uniform(*LONGITUDE_RANGE):.6f}',
+                'latitude': f'{rng.uniform(*LATITUDE_RANGE):.6f}',
+                'sys_updated_on': now,
+            })
+
+        self.cis = []
+        self.devices = []
+        for i, site in enumerate(self.sites):
+            serial = f'Q2AA-{i:04X}-{rng.randint(0, 0xFFFF):04X}'
+            mac = ':'.join(f'{rng.randint(0, 255):02x}' for _ in range(6))
+            # a share of CIs have no serial, so the service resolves it through Meraki
+            self.cis.append({
+                'sys_id': f'ci{i:07d}',
+                'name': f'Meraki MX {site["name"]}',
+                'serial_number': serial if rng.random() < 0.8 else '',
+                'mac_address': mac,
+                'location': {'value': site['sys_id']},
+                'install_status': '1',
+                'sys_updated_on': now,
+            })
+            self.devices.append({'serial': serial, 'mac': mac, 'name': f'Meraki MX {site["name"]}',
+                                 'status': rng.choice(('online', 'online', 'online', 'offline'))})
+        for i in range(len(self.cis), cmdb_rows):
+            site = rng.choice(self.sites) if self.sites else {'sys_id': ''}
+            self.cis.append({
+                'sys_id': f'ci{i:07d}',
+                'name': f'Switch {i}',
+                'serial_number': f'SW{i:08d}',
+                'mac_address': '',
+                'location': {'value': site['sys_id']},
+                'install_status': '1',
+                'sys_updated_on': now,
+            })
+
+        self.sensors = []
+        for i, site in enumerate(self.sites):
+            status = rng.choice(('Up', 'Up', 'Up', 'Down', 'Paused by User'))
+            self.sensors.append({'objid': 2 * i, 'probe': 'Probe', 'group': 'PI - LTE', 'device': site['name'],
+                                 'status': status, 'priority': 3, 'active': True, 'name': 'Ping'})
+            self.sensors.append({'objid': 2 * i + 1, 'probe': 'Probe', 'group': site['name'], 'device': 'Probe Device',
+                                 'status': status, 'priority': 3, 'active': True, 'name': 'Probe Health'})
+
+        # squares of 0.01 to 0.05 degrees, some centred on sites so they are in an outage
+        self.features = []
+        for i in range(gis_features):
+            if self.sites and rng.random() < outage_rate * len(self.sites) / max(gis_features, 1):
+                site = rng.choice(self.sites)
+                x, y = float(site['longitude']), float(site['latitude'])
+            else:
+                x, y = rng.uniform(*LONGITUDE_RANGE), rng.uniform(*LATITUDE_RANGE)
+            half = rng.uniform(0.005, 0.025)
+            # clockwise exterior ring, as ArcGIS returns
+            ring = [[x - half, y - half], [x - half, y + half], [x + half, y + half], [x + half, y - half], [x - half, y - half]]
+            self.features.append({
+                'attributes': {
+                    'OBJECTID': i + 1,
+                    'OutageStatus': 'Active',
+                    'OutageType': rng.choice(('Planned', 'Unplanned')),
+                    'Utility': rng.choice(('PG&E', 'SCE', 'SDG&E')),
+                    'StartDate': epoch_ms - rng.randint(0, 86400000),
+                    'EstimatedRestoreDate': epoch_ms + rng.randint(0, 86400000),
+                    'ImpactedCustomers': rng.randint(1, 5000),
+                    'EditDate': epoch_ms,
+                },
+                'geometry': {'rings': [ring]},
+            })
+
+        self.regions = []
+        for i in range(pge_regions):
+            city = CITIES[i] if i < len(CITIES) else f'Region {i}'
+            outages = []
+            for _ in range(rng.randint(1, 4)):
+                outages.append({
+                    'outageStatus': 'ACTIVE',
+                    'longitude': f'{rng.uniform(*LONGITUDE_RANGE):.6f}',
+                    'latitude': f'{rng.uniform(*LATITUDE_RANGE):.6f}',
+                    'outageStartTime': str(epoch_ms // 1000 - rng.randint(0, 86400)),
+                    'lastUpdateTime': str(epoch_ms // 1000),
+                    'currentEtor': str(epoch_ms // 1000 + rng.randint(0, 86400)),
+                    'cause': 'Under investigation',
+                    'estCustAffected': str(rng.randint(1, 5000)),
+                })
+            self.regions.append({'regionName': city, 'outages': outages})
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Routes requests to the fake upstream serving them, applying its profile."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        upstream = self.server.upstream
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if body and 'application/x-www-form-urlencoded' in (self.headers.get('Content-Type') or ''):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode(), keep_blank_values=True).items()})
+        elif body:
+            try:
+                params['_json'] = json.loads(body)
+            except ValueError:
+                pass
+
+        time.sleep(upstream.profile.delay())
+        upstream.requests += 1
+        if random.random() < upstream.profile.error_rate:
+            upstream.errors += 1
+            self._send(503, {'error': 'injected failure'})
+            return
+        try:
+            status, payload = upstream.route(method, url.path, params)
+        except Exception as err:
+            status, payload = 500, {'error': str(err)}
+        self._send(status, payload)
+
+    def _send(self, status, payload):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+class FakeUpstream:
+    """Base class of a local HTTP server standing in for an upstream API.
+
+    Subclasses implement route(method, path, params), returning (status, JSON payload).
+
+    Parameters
+    ----------
+    dataset : Dataset
+    profile : Profile
+    """
+
+    def __init__(self, dataset, profile=None):
+        self.dataset = dataset
+        self.profile = profile or Profile()
+        self.requests = 0
+        self.errors = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), FakeHandler)
+        self._server.daemon_threads = True
+        self._server.upstream = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def route(self, method, path, params):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f'fake-{type(self).__name__}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class FakeArcGis(FakeUpstream):
+    """CalOES outage layer (query and layer metadata) and the World geocoder."""
+
+    LAYER_PATH = '/arcgis/rest/services/Power_Outages/FeatureServer/0'
+    GEOCODE_PATH = '/arcgis/rest/services/World/GeocodeServer'
+
+    def route(self, method, path, params):
+        if path == self.LAYER_PATH:
+            return 200, {'objectIdField': 'OBJECTID', 'editFieldsInfo': {'editDateField': 'EditDate'},
+                         'maxRecordCount': 2000}
+        if path == self.LAYER_PATH + '/query':
+            return 200, self.query(params)
+        if path == self.GEOCODE_PATH + '/findAddressCandidates':
+            return 200, {'candidates': [self.geocode(params.get('SingleLine', ''))]}
+        if path == self.GEOCODE_PATH + '/geocodeAddresses':
+            records = json.loads(params['addresses'])['records']
+            locations = []
+            for record in records:
+                location = self.geocode(record['attributes']['SingleLine'])
+                location['attributes'] = {'ResultID': record['attributes']['OBJECTID']}
+                locations.append(location)
+            return 200, {'locations': locations}
+        return 404, {'error': f'Unknown path {path}'}
+
+    @staticmethod
+    def geocode(address):
+        rng = random.Random(address)
+        return {'address': address, 'score': 100,
+                'location': {'x': rng.uniform(*LONGITUDE_RANGE), 'y': rng.uniform(*LATITUDE_RANGE)}}
+
+    def query(self, params):
+        features = self.dataset.features
+        edited = re.search(r"EditDate > TIMESTAMP '([^']+)'", params.get('where', ''))
+        if edited:
+            after = datetime.strptime(edited.group(1), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp() * 1000
+            features = [f for f in features if f['attributes']['EditDate'] > after]
+        if params.get('objectIds'):
+            object_ids = {int(object_id) for object_id in params['objectIds'].split(',')}
+            features = [f for f in features if f['attributes']['OBJECTID'] in object_ids]
+        if params.get('geometry'):
+            x, y = map(float, params['geometry'].split(','))
+            features = [f for f in features if self._contains(f['geometry']['rings'][0], x, y)]
+        if params.get('returnIdsOnly') == 'true':
+            return {'objectIdFieldName': 'OBJECTID', 'objectIds': [f['attributes']['OBJECTID'] for f in features]}
+
+        offset = int(params.get('resultOffset') or 0)
+        count = int(params.get('resultRecordCount') or 2000)
+        page = features[offset:offset + count]
+        if params.get('returnGeometry') == 'false':
+            page = [{'attributes': f['attributes']} for f in page]
+        return {'features': page, 'exceededTransferLimit': offset + count < len(features)}
+
+    @staticmethod
+    def _contains(ring, x, y):
+        xs = [point[0] for point in ring]
+        ys = [point[1] for point in ring]
+        return min(xs) <= x <= max(xs) and min(ys) <= y <= max(ys)
+
+class FakePge(FakeUpstream):
+    """PG&E statewide outage regions."""
+
+    PATH = '/cocoutage/outages/getOutagesRegions'
+
+    def route(self, method, path, params):
+        if path == self.PATH:
+            return 200, {'outagesRegions': self.dataset.regions}
+        return 404, {'error': f'Unknown path {path}'}
+
+class FakeOpsgenie(FakeUpstream):
+    """Opsgenie alert tags and details."""
+
+    def route(self, method, path, params):
+        if method == 'POST' and re.fullmatch(r'/v2/alerts/[^/]+/(tags|details|close)', path):
+            return 202, {'result': 'Request will be processed', 'took': 0.01, 'requestId': str(self.requests)}
+        return 404, {'message': f'Unknown path {path}'}
+
+class FakeServiceNow(FakeUpstream):
+    """ServiceNow table API for cmn_location and cmdb_ci, with the encoded queries pysnow builds."""
+
+    def __init__(self, dataset, profile=None):
+        super().__init__(dataset, profile)
+        self.tables = {
+            'cmn_location': {row['sys_id']: row for row in dataset.sites},
+            'cmdb_ci': {row['sys_id']: row for row in dataset.cis},
+        }
+
+    @property
+    def host(self):
+        return self.url[len('http://'):]
+
+    def route(self, method, path, params):
+        match = re.fullmatch(r'/api/now/table/(\w+)(?:/(\w+))?', path)
+        if not match or match.group(1) not in self.tables:
+            return 404, {'error': {'message': f'Unknown path {path}'}}
+        table = self.tables[match.group(1)]
+        if match.group(2):
+            row = table.get(match.group(2))
+            if row is None:
+                return 404, {'error': {'message': 'No Record found'}}
+            if method in ('PUT', 'PATCH'):
+                row.update(params.get('_json') or {})
+            return 200, {'result': row}
+        rows = [row for row in table.values() if self._matches(row, params.get('sysparm_query', ''))]
+        offset = int(params.get('sysparm_offset') or 0)
+        limit = int(params.get('sysparm_limit') or 10000)
+        return 200, {'result': rows[offset:offset + limit]}
+
+    @staticmethod
+    def _value(row, field):
+        value = row.get(field)
+        return value.get('value') if isinstance(value, dict) else value
+
+    def _matches(self, row, query):
+        """evaluate the subset of encoded queries built by SnowApi: '=' and 'ISEMPTY' joined by '^' and '^OR'"""
+        if not query:
+            return True
+        groups = []
+        for term in query.split('^'):
+            if term.startswith('OR') and groups:
+                groups[-1].append(term[2:])
+            elif term and term != 'EQ':
+                groups.append([term])
+        for group in groups:
+            if not any(self._term(row, term) for term in group):
+                return False
+        return True
+
+    def _term(self, row, term):
+        if term.endswith('ISEMPTY'):
+            return not self._value(row, term[:-len('ISEMPTY')])
+        if '>' in term:
+            # incremental syncs, every row is reported as updated
+            return True
+        field, _, value = term.partition('=')
+        return str(self._value(row, field)) == value
+
+class FakePrtg(FakeUpstream):
+    """PRTG table API with the name, device and '@sub()' group filters."""
+
+    def route(self, method, path, params):
+        if path == '/api/healthstatus.json':
+            return 200, {}
+        if path == '/api/setobjectproperty.htm':
+            return 200, {}
+        if path != '/api/table.json':
+            return 404, {'error': f'Unknown path {path}'}
+        sensors = self.dataset.sensors
+        for field in ('name', 'device', 'group'):
+            value = params.get(f'filter_{field}')
+            if not value:
+                continue
+            sub = re.fullmatch(r'@sub\((.*)\)', value)
+            if sub:
+                sensors = [s for s in sensors if sub.group(1).lower() in s[field].lower()]
+            else:
+                sensors = [s for s in sensors if s[field] == value]
+        return 200, {'treesize': len(sensors), 'sensors': sensors}
+
+class FakeMeraki(FakeUpstream):
+    """Meraki dashboard organization, device and device status endpoints."""
+
+    ORG_ID = '1000'
+
+    def route(self, method, path, params):
+        org = {'id': self.ORG_ID, 'name': 'Benchmark', 'url': self.url}
+        if path == '/api/v1/organizations':
+            return 200, [org]
+        if path == f'/api/v1/organizations/{self.ORG_ID}':
+            return 200, org
+        if path == f'/api/v1/organizations/{self.ORG_ID}/devices':
+            devices = self.dataset.devices
+            if params.get('mac'):
+                devices = [d for d in devices if d['mac'] == params['mac'].lower()]
+            if params.get('name'):
+                devices = [d for d in devices if d['name'] == params['name']]
+            return 200, devices
+        if path == f'/api/v1/organizations/{self.ORG_ID}/devices/statuses':
+            serials = params.get('serials[]') or params.get('serials')
+            devices = self.dataset.devices
+            if serials:
+                devices = [d for d in devices if d['serial'] == serials]
+            return 200, devices
+        return 404, {'errors': [f'Unknown path {path}']}
+
+class FakeUpstreams:
+    """Every fake upstream over one dataset.
+
+    Parameters
+    ----------
+    dataset : Dataset
+    profiles : dict
+        Profile of each upstream by name ('arcgis', 'pge', 'opsgenie', 'snow', 'prtg', 'meraki').
+        Upstreams without one use the default Profile.
+    """
+
+    def __init__(self, dataset, profiles=None):
+        profiles = profiles or {}
+        self.dataset = dataset
+        self.upstreams = {
+            'arcgis': FakeArcGis(dataset, profiles.get('arcgis')),
+            'pge': FakePge(dataset, profiles.get('pge')),
+            'opsgenie': FakeOpsgenie(dataset, profiles.get('opsgenie')),
+            'snow': FakeServiceNow(dataset, profiles.get('snow')),
+            'prtg': FakePrtg(dataset, profiles.get('prtg')),
+            'meraki': FakeMeraki(dataset, profiles.get('meraki')),
+        }
+
+    def __getitem__(self, name):
+        return self.upstreams[name]
+
+    def start(self):
+        for upstream in self.upstreams.values():
+            upstream.start()
+
+    def stop(self):
+        for upstream in self.upstreams.values():
+            upstream.stop()
+
+    def config(self):
+        """config entries pointing the service at the fake upstreams"""
+        arcgis = self['arcgis'].url
+        return {
+            'gis-api': {
+                'url': arcgis + FakeArcGis.LAYER_PATH + '/query',
+                'headers': {},
+                'params': {'where': '1=1', 'outFields': '*', 'returnGeometry': 'false', 'spatialRel': 'esriSpatialRelIntersects', 'f': 'json'},
+            },
+            'pge-api': {'url': self['pge'].url + FakePge.PATH, 'headers': {}, 'params': {}},
+            'geocode': {
+                'url': arcgis + FakeArcGis.GEOCODE_PATH + '/findAddressCandidates',
+                'batchUrl': arcgis + FakeArcGis.GEOCODE_PATH + '/geocodeAddresses',
+                'headers': {},
+                'params': {'f': 'json', 'maxLocations': 1},
+                'minScore': 90,
+            },
+            'opsgenie': {'api_key': 'benchmark', 'url': self['opsgenie'].url},
+            'snow': {'host': self['snow'].host, 'useSsl': False, 'username': 'benchmark', 'password': 'benchmark',
+                     'filter': {'install_status': ['1']}},
+            'prtg': {'url': self['prtg'].url, 'username': 'benchmark', 'password': 'benchmark'},
+            'meraki': {'enabled': True, 'api_key': 'benchmark', 'org_id': FakeMeraki.ORG_ID, 'url': self['meraki'].url + '/api/v1'},
+        }
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import config
+
+class MemoryCache:
+    """Cache of values with optional expiry, local to this process.
+
+    Values are stored as is, so callers must not modify them.
+    """
+
+    # values are not visible to other worker processes
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _expire(self):
+        now = time.time()
+        for key in [key for key, (_, expires) in self._values.items() if expires is not None and expires <= now]:
+            del self._values[key]
+
+    def get(self, key):
+        """get a value, or None if not set or expired"""
+        with self._lock:
+            value, expires = self._values.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._expire()
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """set a value unless one is already set
+
+        Returns
+        -------
+        bool
+            True if the value was set
+        """
+
+        with self._lock:
+            self._expire()
+            if key in self._values:
+                return False
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+class SqliteCache:
+    """Cache of JSON-serializable values with optional expiry, shared by every process using the
+    same SQLite database in WAL mode.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._writes = 0
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    def get(self, key):
+        """get a value, or None if not set or expired"""
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                               (key, json.dumps(value), time.time() + ttl if ttl else None))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    def add(self, key, value, ttl=None):
+        """set a value unless one is already set, atomically across processes
+
+        Returns
+        -------
+        bool
+            True if the value was set
+        """
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE key = ? AND expires <= ?", (key, time.time()))
+            cursor = self._conn.execute("INSERT OR IGNORE INTO cache VALUES (?, ?, ?)",
+                                        (key, json.dumps(value), time.time() + ttl if ttl else None))
+            return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def cache_path(path):
+    """resolve the path of a local cache database against 'cache.dir', creating the directory if needed"""
+    path = os.path.join((config.get('cache') or {}).get('dir') or '.', path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return path
+
+def get_cache():
+    """get the cache backend selected by 'cache.backend', either 'memory' (default) or 'sqlite'
+    at 'cache.path' under 'cache.dir'"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            cache_config = config.get('cache') or {}
+            backend = cache_config.get('backend', 'memory')
+            if backend == 'sqlite':
+                _cache = SqliteCache(cache_path(cache_config.get('path', 'cache.db')))
+            elif backend == 'memory':
+                _cache = MemoryCache()
+            else:
+                raise ValueError(f"Unknown cache backend '{backend}'.")
+        return _cache
+
+def hold_lease(name, ttl):
+    """take or renew a lease that at most one worker process holds at a time
+
+    Returns
+    -------
+    bool
+        True if this process holds the lease for the next ttl seconds
+    """
+
+    cache = get_cache()
+    key = f"lease:{name}"
+    owner = os.getpid()
+    if cache.add(key, owner, ttl):
+        return True
+    if cache.get(key) == owner:
+        cache.set(key, owner, ttl)
+        return True
+    return False
+
+def release_lease(name):
+    """release a lease if this process holds it"""
+    cache = get_cache()
+    key = f"lease:{name}"
+    if cache.get(key) == os.getpid():
+        cache.delete(key)
@@ -1,19 +1,44 @@
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from loguru import logger
 
+import cache_backend
 import check_outage
+import cmdb_mirror
+import metrics
+import prtg_snapshot
+import serial_cache
+from config import config
 from meraki.exceptions import ObjectNotFound
+from singleflight import SingleFlight
 
 MERAKI_RE = re.compile('meraki', re.I)
 
-def check(site, alert_id, action_name,
-            prtg_api, opsgenie_api, meraki_api, 
-            snow_api, snow_filter):
-    # payload to post for alert extra properties
-    details = {"SiteName": site['name']}
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """lazily create the shared thread pool used to fan out upstream lookups"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = (config.get('check') or {}).get('maxWorkers', 32)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='check')
+        return _executor
 
-    # get gis outage status
+def get_provider_details(site):
+    """get outage status from the power provider
+
+    Returns
+    -------
+    dict
+        Prefixed outage details to merge into alert details
+    """
+
+    details = {}
     gis_response = check_outage.get_site_status(site)
     if gis_response:
         if "PowerStatus" in gis_response:
@@ -36,9 +61,27 @@ def check(site, alert_id, action_name,
     else:
         logger.error("Unable to retrieve outage status.")
         details["Power_ProviderStatus"] = ""
+    return details
+
+def _get_sensors(prtg_api, name, group, device):
+    """get sensors from the PRTG snapshot or API, as a dict of 'sensors' like PRTG's table API"""
+    response = prtg_snapshot.get_sensors_by_name(prtg_api, name, group, device)
+    # pyprtg-api returns the sensor list itself
+    if isinstance(response, list):
+        return {"sensors": response}
+    return response
 
-    # get pi status
-    pi_response = prtg_api.get_sensors_by_name('Ping', 'PI - LTE', site['name'])
+def get_pi_details(prtg_api, site):
+    """get status of the site's LTE pi from PRTG
+
+    Returns
+    -------
+    2-tuple
+        (details, pi_is_up) where pi_is_up is None if paused or unknown
+    """
+
+    details = {}
+    pi_response = _get_sensors(prtg_api, 'Ping', 'PI - LTE', site['name'])
     pi_is_up = None
     if "sensors" in pi_response:
         if len(pi_response["sensors"]) == 1:
@@ -61,9 +104,19 @@ def check(site, alert_id, action_name,
     else:
         logger.error("Cannot parse pi sensors in payload.")
         details["PRTG_PiStatus"] = ''
+    return details, pi_is_up
+
+def get_probe_details(prtg_api, site):
+    """get status of the site's probe device from PRTG
 
-    # get probe status
-    probe_response = prtg_api.get_sensors_by_name('Probe Health', site['name'], 'Probe Device')
+    Returns
+    -------
+    2-tuple
+        (details, probe_is_up) where probe_is_up is None if paused or unknown
+    """
+
+    details = {}
+    probe_response = _get_sensors(prtg_api, 'Probe Health', site['name'], 'Probe Device')
     probe_is_up = None
     if "sensors" in probe_response:
         if len(probe_response["sensors"]) == 1:
@@ -86,44 +139,162 @@ def check(site, alert_id, action_name,
     else:
         logger.error("Cannot parse probe devices in payload.")
         details["PRTG_ProbeStatus"] = ''
+    return details, probe_is_up
+
+def get_meraki_details(meraki_api, snow_api, snow_filter, site):
+    """get status of the site's meraki device, found through the site's CIs in the CMDB
+    or its local mirror
 
-    # get meraki device and status
+    Returns
+    -------
+    2-tuple
+        (details, meraki_is_up) where meraki_is_up is None if device could not be found
+    """
+
+    if meraki_api is None:
+        # Meraki is disabled or not reachable yet
+        return {'Cisco_MerakiStatus': ''}, None
+
+    details = {}
     meraki_is_up = None
-    cis = snow_api.get_cis_filtered_by(snow_filter)
+    mirror = cmdb_mirror.get_mirror()
+    metrics.cache_lookup('cmdb_mirror', mirror is not None)
+    if mirror is not None:
+        cis = mirror.get_cis(site['sys_id'], 'meraki')
+    elif snow_filter.get('location') and site['sys_id'] not in snow_filter['location']:
+        # the configured filter excludes the site's location
+        cis = []
+    else:
+        with metrics.span('snow', 'get_cis_filtered_by'):
+            cis = snow_api.get_cis_filtered_by(dict(snow_filter, location=[site['sys_id']]))
     try:
         ap = next(ci for ci in cis if MERAKI_RE.search(ci['name']))
     except StopIteration:
         logger.error('Cannot find meraki device')
         details['Cisco_MerakiStatus'] = ''
     else:
+        serials = None
+        cached = False
         try:
             if not ap['serial_number']:
-                try:
-                    device = meraki_api.get_device_by_mac(ap['mac_address'])
-                except ObjectNotFound:
-                    device = meraki_api.get_device_by_name(ap['name'])
-                ap['serial_number'] = device['serial']
-            meraki_is_up = meraki_api.get_device_status(ap['serial_number'])
+                serials = serial_cache.get_cache()
+                serial = serials.get(ap['sys_id']) if serials is not None else None
+                cached = bool(serial)
+                metrics.cache_lookup('meraki_serials', cached)
+                if not serial:
+                    try:
+                        with metrics.span('meraki', 'get_device_by_mac'):
+                            device = meraki_api.get_device_by_mac(ap['mac_address'])
+                    except ObjectNotFound:
+                        with metrics.span('meraki', 'get_device_by_name'):
+                            device = meraki_api.get_device_by_name(ap['name'])
+                    serial = device['serial']
+                    if serials is not None:
+                        serials.set(ap['sys_id'], serial)
+                ap['serial_number'] = serial
+            with metrics.span('meraki', 'get_device_status'):
+                meraki_is_up = meraki_api.get_device_status(ap['serial_number'])
             if meraki_is_up:
                 details['Cisco_MerakiStatus'] = 'Up'
             else:
                 details['Cisco_MerakiStatus'] = 'Down'
         except ObjectNotFound:
+            if cached:
+                # the device was probably replaced, resolve its serial again on the next check
+                logger.warning(f"Cannot find cached meraki serial {ap['serial_number']}, forgetting it")
+                serials.delete(ap['sys_id'])
             details['Cisco_MerakiStatus'] = ''
+    return details, meraki_is_up
+
+def _result(future, started, timeout, name, default):
+    """wait on an upstream lookup, falling back to its unavailable result on timeout"""
+    remaining = None if timeout is None else max(0, timeout - (time.monotonic() - started))
+    try:
+        return future.result(timeout=remaining)
+    except TimeoutError:
+        logger.error(f"Timed out after {timeout}s waiting on {name}.")
+        return default
+
+def get_site_statuses(site, prtg_api, meraki_api, snow_api, snow_filter):
+    """collect the statuses of a site from every upstream and work out the site's power
+
+    Returns
+    -------
+    dict
+        Alert details without the user input validity check
+    """
+
+    details = {"SiteName": site['name']}
+
+    check_config = config.get('check') or {}
+    if check_config.get('concurrent', True):
+        # upstreams are independent, so run them all at once and merge in the original order
+        timeouts = check_config.get('timeouts') or {}
+        executor = _get_executor()
+        started = time.monotonic()
+        provider_future = metrics.submit(executor, get_provider_details, site)
+        pi_future = metrics.submit(executor, get_pi_details, prtg_api, site)
+        probe_future = metrics.submit(executor, get_probe_details, prtg_api, site)
+        meraki_future = metrics.submit(executor, get_meraki_details, meraki_api, snow_api, snow_filter, site)
+
+        provider_details = _result(provider_future, started, timeouts.get('provider'), 'power provider',
+                                   {"Power_ProviderStatus": ""})
+        pi_details, pi_is_up = _result(pi_future, started, timeouts.get('prtg'), 'PRTG pi sensor',
+                                       ({"PRTG_PiStatus": ''}, None))
+        probe_details, probe_is_up = _result(probe_future, started, timeouts.get('prtg'), 'PRTG probe device',
+                                             ({"PRTG_ProbeStatus": ''}, None))
+        meraki_details, meraki_is_up = _result(meraki_future, started, timeouts.get('meraki'), 'meraki device',
+                                               ({'Cisco_MerakiStatus': ''}, None))
+    else:
+        provider_details = get_provider_details(site)
+        pi_details, pi_is_up = get_pi_details(prtg_api, site)
+        probe_details, probe_is_up = get_probe_details(prtg_api, site)
+        meraki_details, meraki_is_up = get_meraki_details(meraki_api, snow_api, snow_filter, site)
+
+    details.update(provider_details)
+    details.update(pi_details)
+    details.update(probe_details)
+    details.update(meraki_details)
 
     # Site power output
     if any((meraki_is_up, pi_is_up, probe_is_up)):
         details['Power_SitePower'] = 'Up'
     elif details['Power_ProviderStatus'] == 'Up':
-        if all(status is None for status in (meraki_api, pi_is_up, probe_is_up)):
+        if all(status is None for status in (meraki_is_up, pi_is_up, probe_is_up)):
             details['Power_SitePower'] = 'Likely Up'
         else:
             details['Power_SitePower'] = 'Likely Down'
     else:
         details['Power_SitePower'] = 'Down'
+    return details
+
+_site_statuses = None
+_site_statuses_lock = threading.Lock()
+
+def _get_site_statuses_flight():
+    """lazily create the single-flight group shared by checks of the same site"""
+    global _site_statuses
+    with _site_statuses_lock:
+        if _site_statuses is None:
+            _site_statuses = SingleFlight(ttl=(config.get('check') or {}).get('cacheTtl', 30),
+                                          cache=cache_backend.get_cache(), namespace='site_statuses:')
+        return _site_statuses
+
+def get_shared_site_statuses(site, prtg_api, meraki_api, snow_api, snow_filter):
+    """get_site_statuses, shared by concurrent calls for the same site and reused for a short while"""
+    return _get_site_statuses_flight().do(site['sys_id'], get_site_statuses,
+                                          site, prtg_api, meraki_api, snow_api, snow_filter)
+
+def check(site, alert_id, action_name,
+            prtg_api, opsgenie_api, meraki_api,
+            snow_api, snow_filter):
+    # payload to post for alert extra properties
+    details = get_shared_site_statuses(site, prtg_api, meraki_api, snow_api, snow_filter)
+
+    if details['Power_SitePower'] == 'Down':
         # add tag for site down
         add_tag_status_code = opsgenie_api.add_alert_tags(alert_id, ["SitePowerDown"], note=f"Automated action {action_name} detected site power is down with high confidence. Tag has been added.")
-        if add_tag_status_code == 202:
+        if add_tag_status_code in (200, 202):
             logger.info(f"Successfully added tags to alert {alert_id}.")
         else:
             logger.error(f"Could not add tags to alert {alert_id}")
@@ -135,7 +306,7 @@ def check(site, alert_id, action_name,
     note = f"Automated action {action_name} completed. Details of collected statuses have been added as extra properties."
 
     post_details_status_code = opsgenie_api.add_alert_details(alert_id, details, note=note)
-    if post_details_status_code == 202:
+    if post_details_status_code in (200, 202):
         logger.info(f"Successfully posted details to alert {alert_id}.")
     else:
         logger.error(f"Could not post details to alert {alert_id}")
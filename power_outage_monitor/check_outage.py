@@ -1,12 +1,52 @@
 import json
-from copy import deepcopy
-from datetime import datetime
 
-import pytz
-import requests
 from loguru import logger
 
-from config import config
+import http_client
+import metrics
+import providers
+from config import RequestTemplate, compiled, config, get_date_time
+from gis_snapshot import GisSnapshot
+from pge_snapshot import PgeSnapshot
+
+GIS_URL = "https://services.arcgis.com/BLN4oKB0N1YSgvY8/arcgis/rest/services/Power_Outages_(View)/FeatureServer/0/query"
+PGE_URL = "https://apim.cloud.pge.com/cocoutage/outages/getOutagesRegions"
+PGE_TIME_FIELDS = ("autoEtor", "crewEta", "currentEtor", "lastUpdateTime", "outageStartTime")
+
+_gis_snapshot = None
+_pge_snapshot = None
+
+def start_snapshots():
+    """start background outage snapshots that are enabled in config"""
+    global _gis_snapshot
+    gis_snapshot_config = config["gis-api"].get("snapshot") or {}
+    if gis_snapshot_config.get("enabled") and _gis_snapshot is None:
+        _gis_snapshot = GisSnapshot(config["gis-api"].get("url", GIS_URL), config["gis-api"]["headers"], config["gis-api"]["params"],
+                                    refresh_interval=gis_snapshot_config.get("refreshInterval", 300),
+                                    max_staleness=gis_snapshot_config.get("maxStaleness", 900),
+                                    page_size=gis_snapshot_config.get("pageSize", 1000),
+                                    incremental=gis_snapshot_config.get("incremental", True),
+                                    edit_date_field=gis_snapshot_config.get("editDateField"),
+                                    full_sync_interval=gis_snapshot_config.get("fullSyncInterval", 3600),
+                                    overlap=gis_snapshot_config.get("overlap", 60))
+        _gis_snapshot.start()
+
+def get_gis_snapshot():
+    """get the GIS layer snapshot if it is enabled, otherwise None"""
+    return _gis_snapshot
+
+def _get_pge_snapshot():
+    """get the shared PG&E outage cache, or None if it is disabled in config"""
+    global _pge_snapshot
+    pge_cache_config = config["pge-api"].get("cache") or {}
+    ttl = pge_cache_config.get("ttl", 60)
+    if not ttl:
+        return None
+    if _pge_snapshot is None:
+        _pge_snapshot = PgeSnapshot(config["pge-api"].get("url", PGE_URL), config["pge-api"]["headers"], config["pge-api"]["params"], format_pge_outage,
+                                    ttl=ttl, tolerance=pge_cache_config.get("tolerance", 0),
+                                    max_staleness=pge_cache_config.get("maxStaleness", 600))
+    return _pge_snapshot
 
 def convert_epoch_to_datetime(epoch):
     """convert epoch to datetime with config-specified timezone
@@ -23,15 +63,25 @@ def convert_epoch_to_datetime(epoch):
         If it is not specified, timezone defaults to local.
     """
 
-    converted_datetime = datetime.fromtimestamp(epoch, datetime.now().astimezone().tzinfo)
-    if config["date-time"]["timezone"]:
-        return converted_datetime.astimezone(pytz.timezone(config["date-time"]["timezone"]))
-    return converted_datetime
+    return get_date_time().from_epoch(epoch)
+
+@compiled
+def get_gis_request():
+    """get the request template of CalOES's Power Outage Incident API, compiled from 'gis-api'"""
+    return RequestTemplate.from_config(config["gis-api"], GIS_URL)
+
+@compiled
+def get_pge_request():
+    """get the request template of PG&E's API, compiled from 'pge-api'"""
+    return RequestTemplate.from_config(config["pge-api"], PGE_URL)
 
 def get_gis_power_status(site):
     """checks the power status of a site using CalOES's Power Outage Incident API.
     (more at: https://gis.data.ca.gov/datasets/CalEMA::power-outage-incidents/about)
 
+    If the layer snapshot is enabled and fresh, the site is checked locally against it
+    instead of querying the API.
+
     Parameters
     ----------
     site : SiteData
@@ -57,25 +107,27 @@ def get_gis_power_status(site):
     except KeyError as err:
         logger.exception("Argument is missing required key: " + err.args[0])
         return None
-        
-    url = "https://services.arcgis.com/BLN4oKB0N1YSgvY8/arcgis/rest/services/Power_Outages_(View)/FeatureServer/0/query"
-    headers = deepcopy(config["gis-api"]["headers"])
-    params = deepcopy(config["gis-api"]["params"])
 
-    params["geometry"] = str(site["longitude"]) + "," + str(site["latitude"])
-    params["inSR"] = "4326"
-    params["geometryType"] = "esriGeometryPoint"
+    use_snapshot = _gis_snapshot is not None and _gis_snapshot.is_fresh()
+    metrics.cache_lookup("gis_snapshot", use_snapshot)
+    if use_snapshot:
+        statuses = _gis_snapshot.query(site["longitude"], site["latitude"])
+    else:
+        request = get_gis_request()
+        params = request.with_params(geometry=str(site["longitude"]) + "," + str(site["latitude"]),
+                                     inSR="4326", geometryType="esriGeometryPoint")
 
-    response = requests.get(url, headers=headers, params=params)
+        with metrics.span("gis", "query"):
+            response = http_client.get_session().get(request.url, headers=request.headers, params=params)
 
-    response_content = json.loads(response.content)
+        response_content = json.loads(response.content)
 
-    # get list of outages
-    try:
-        statuses = response_content['features']
-    except KeyError:
-        logger.error(response_content)
-        return None
+        # get list of outages
+        try:
+            statuses = response_content['features']
+        except KeyError:
+            logger.error(response_content)
+            return None
 
     if not statuses:
         return {"PowerStatus": "Active"}
@@ -84,21 +136,49 @@ def get_gis_power_status(site):
         for outage in statuses:
             logger.info(json.dumps(outage, indent=4, sort_keys=True))
 
-    site_status = statuses[0]["attributes"]
-    
+    return format_gis_outage(statuses[0]["attributes"])
+
+def format_gis_outage(site_status):
+    """format the attributes of a CalOES outage feature as a site status"""
+
     # convert epoch to formatted datetime
+    date_time = get_date_time()
     if "StartDate" in site_status:
         if site_status["StartDate"]:
-            site_status["StartDate"] = convert_epoch_to_datetime(site_status["StartDate"]//(10**3)).strftime(config["date-time"]["timeFormat"])
+            site_status["StartDate"] = date_time.format_epoch(site_status["StartDate"]//(10**3))
     if "EstimatedRestoreDate" in site_status:
         if site_status["EstimatedRestoreDate"]:
-            site_status["EstimatedRestoreDate"] = convert_epoch_to_datetime(site_status["EstimatedRestoreDate"]//(10**3)).strftime(config["date-time"]["timeFormat"])
+            site_status["EstimatedRestoreDate"] = date_time.format_epoch(site_status["EstimatedRestoreDate"]//(10**3))
 
-    del site_status["OutageStatus"]
+    site_status.pop("OutageStatus", None)
     site_status["PowerStatus"] = "Inactive"
     return site_status
         
 
+def get_gis_power_statuses(longitudes, latitudes):
+    """checks the power status of many sites at once against the CalOES layer snapshot
+
+    Parameters
+    ----------
+    longitudes : array_like
+    latitudes : array_like
+
+    Returns
+    -------
+    list
+        For each site, the same outage information get_gis_power_status returns if it
+        is in an outage, otherwise None
+
+    None
+        If the layer snapshot is not enabled or not fresh.
+    """
+
+    if _gis_snapshot is None or not _gis_snapshot.is_fresh():
+        return None
+    return [format_gis_outage(outage["attributes"]) if outage else None
+            for outage in _gis_snapshot.join(longitudes, latitudes)]
+
+
 def get_pge_power_status(site):
     """checks the power status of a site using PG&E's API
 
@@ -114,6 +194,9 @@ def get_pge_power_status(site):
 
     None
         If missing keys, missing key values, or incorrect longitude and latitude values.
+
+    The statewide payload is cached for 'pge-api.cache.ttl' seconds and indexed by
+    region and coordinates, so most calls are a dictionary lookup.
     """
 
     # check argument
@@ -131,11 +214,18 @@ def get_pge_power_status(site):
         logger.exception("Argument is missing required key: " + err.args[0])
         return None
 
-    url = "https://apim.cloud.pge.com/cocoutage/outages/getOutagesRegions"
-    headers = deepcopy(config["pge-api"]["headers"])
-    params = deepcopy(config["pge-api"]["params"])
+    pge_snapshot = _get_pge_snapshot()
+    if pge_snapshot is not None:
+        metrics.cache_lookup("pge_snapshot", not pge_snapshot.is_due())
+        outage = pge_snapshot.lookup(site['city'], site['longitude'], site['latitude'])
+        if outage:
+            return outage
+        return {"PowerStatus": "Active"}
+
+    request = get_pge_request()
 
-    response = requests.get(url, headers=headers, params=params)
+    with metrics.span("pge", "get_outages_regions"):
+        response = http_client.get_session().get(request.url, headers=request.headers, params=request.params)
 
     response_content = json.loads(response.content)
 
@@ -149,32 +239,42 @@ def get_pge_power_status(site):
                 # parse for matching longitude and latitude
                 # note that PG&E uses (longitude, latitude) vs. Google Map's (latitude, longitude)
                 if site['longitude'] == outage['longitude'] and site['latitude'] == outage['latitude']:
-                    # convert epoch to formatted datetime
-                    if "autoEtor" in outage:
-                        if outage["autoEtor"]:
-                            outage["autoEtor"] = convert_epoch_to_datetime(int(outage["autoEtor"])).strftime(config["date-time"]["timeFormat"])
-                    if "crewEta" in outage:
-                        if outage["crewEta"]:
-                            outage["crewEta"] = convert_epoch_to_datetime(int(outage["crewEta"])).strftime(config["date-time"]["timeFormat"])
-                    if "currentEtor" in outage:
-                        if outage["currentEtor"]:
-                            outage["currentEtor"] = convert_epoch_to_datetime(int(outage["currentEtor"])).strftime(config["date-time"]["timeFormat"])
-                    if "lastUpdateTime" in outage:
-                        if outage["lastUpdateTime"]:
-                            outage["lastUpdateTime"] = convert_epoch_to_datetime(int(outage["lastUpdateTime"])).strftime(config["date-time"]["timeFormat"])
-                    if "outageStartTime" in outage:
-                        if outage["outageStartTime"]:
-                            outage["outageStartTime"] = convert_epoch_to_datetime(int(outage["outageStartTime"])).strftime(config["date-time"]["timeFormat"])
-                    del outage["outageStatus"]
-                    outage["PowerStatus"] = "Inactive"
-                    return outage
+                    return format_pge_outage(outage)
     return {"PowerStatus": "Active"}
 
+def format_pge_outage(outage):
+    """convert a PG&E outage to the returned format, i.e. with formatted datetimes and PowerStatus
+
+    Parameters
+    ----------
+    outage : dict
+        An outage from PG&E's outage regions. It is modified in place.
+
+    Returns
+    -------
+    dict
+        The outage
+    """
+
+    # convert epoch to formatted datetime
+    date_time = get_date_time()
+    for field in PGE_TIME_FIELDS:
+        if field in outage:
+            if outage[field]:
+                outage[field] = date_time.format_epoch(int(outage[field]))
+    outage.pop("outageStatus", None)
+    outage["PowerStatus"] = "Inactive"
+    return outage
+
 
 #TODO functions for other APIs, get list of specific power providers
 
 #function to redirect which function API to call
 def get_site_status(site, provider=None):
+    """get the status of a site from a provider, or if provider is None from the providers
+    that serve the site (see providers.get_site_status)"""
+    if not provider:
+        return providers.get_site_status(site)
     address = ", ".join((site["street"], site["city"], site["state"]))
     payload = {
         "SiteName": site["name"],
@@ -182,22 +282,15 @@ def get_site_status(site, provider=None):
         "Longitude": site["longitude"],
         "Latitude": site["latitude"]
     }
-    if provider:
-        if provider.lower() == "pge":
-            logger.info("PGE API USED")
-            payload.update(get_pge_power_status(site))
-            payload["Time"] = datetime.now(pytz.timezone(config["date-time"]["timezone"])).strftime(config["date-time"]["timeFormat"])
-            logger.info(json.dumps(payload, indent=4, sort_keys=True))
-            return payload
-        if provider.lower() == "gis":
-            logger.info("GIS API USED")
-            payload.update(get_gis_power_status(site))
-            payload["Time"] = datetime.now(pytz.timezone(config["date-time"]["timezone"])).strftime(config["date-time"]["timeFormat"])
-            logger.info(json.dumps(payload, indent=4, sort_keys=True))
-            return payload
-    else:
+    if provider.lower() == "pge":
+        logger.info("PGE API USED")
+        payload.update(get_pge_power_status(site))
+        payload["Time"] = get_date_time().format_now()
+        logger.info(json.dumps(payload, indent=4, sort_keys=True))
+        return payload
+    if provider.lower() == "gis":
         logger.info("GIS API USED")
         payload.update(get_gis_power_status(site))
-        payload["Time"] = datetime.now(pytz.timezone(config["date-time"]["timezone"])).strftime(config["date-time"]["timeFormat"])
+        payload["Time"] = get_date_time().format_now()
         logger.info(json.dumps(payload, indent=4, sort_keys=True))
         return payload
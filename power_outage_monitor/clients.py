@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from loguru import logger
+
+import metrics
+from config import config
+
+class ClientUnavailable(Exception):
+    """Raised when an upstream client could not be built recently."""
+
+class LazyClient:
+    """Upstream client that is built on first use or by warm_up(), so a slow or unreachable
+    upstream does not hold up startup.
+
+    Attributes are forwarded to the built client, so a LazyClient can be passed wherever the
+    client itself is expected. After a failed build, uses raise ClientUnavailable for
+    retry_interval seconds instead of waiting on the upstream again.
+
+    Parameters
+    ----------
+    name : str
+        Name of the upstream, reported by /readyz.
+    factory : callable
+        Builds the client, e.g. lambda: SnowApi(...).
+    required : bool
+        Whether the service is not ready to serve checks until the client is built.
+    retry_interval : float
+        Seconds after a failed build before the next use builds again.
+    timed : bool
+        Whether calls of the client's public methods are timed and rate limited as calls of the
+        upstream, see metrics.span.
+    """
+
+    def __init__(self, name, factory, required=True, retry_interval=5, timed=False):
+        self.name = name
+        self.required = required
+        self.timed = timed
+        self.retry_interval = retry_interval
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._client = None
+        self._error = None
+        self._failed = None
+
+    def get(self):
+        """get the client, building it if needed
+
+        Raises
+        ------
+        ClientUnavailable
+            If the client could not be built, now or less than retry_interval seconds ago
+        """
+
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            if self._failed is not None and time.monotonic() - self._failed < self.retry_interval:
+                raise ClientUnavailable(f"{self.name} client is unavailable: {self._error}")
+            started = time.monotonic()
+            try:
+                with metrics.span(self.name, 'connect'):
+                    self._client = self._factory()
+            except Exception as err:
+                self._error = str(err) or type(err).__name__
+                self._failed = time.monotonic()
+                raise ClientUnavailable(f"{self.name} client is unavailable: {self._error}") from err
+            self._error = None
+            self._failed = None
+            logger.info(f"Connected {self.name} client in {time.monotonic() - started:.2f}s.")
+            return self._client
+
+    def get_if_ready(self):
+        """get the client if it has been built, otherwise None"""
+        return self._client
+
+    def is_ready(self):
+        return self._client is not None
+
+    def status(self):
+        """readiness of the client, as reported by /readyz"""
+        status = {'ready': self.is_ready(), 'required': self.required}
+        if self._error is not None:
+            status['error'] = self._error
+        return status
+
+    def __getattr__(self, name):
+        # only called for attributes not set in __init__
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attr = getattr(self.get(), name)
+        if self.timed and callable(attr) and not name.startswith('_'):
+            return self._timed(name, attr)
+        return attr
+
+    def _timed(self, operation, method):
+        @wraps(method)
+        def call(*args, **kwargs):
+            with metrics.span(self.name, operation):
+                return method(*args, **kwargs)
+        return call
+
+def _warm_up(client, retry_interval, max_retry_interval, stop):
+    wait = retry_interval
+    while not stop.is_set():
+        try:
+            client.get()
+            return
+        except ClientUnavailable as err:
+            logger.warning(f"{err}, retrying in {wait:.0f}s.")
+        if stop.wait(wait):
+            return
+        wait = min(wait * 2, max_retry_interval)
+
+_stop = threading.Event()
+_executor = None
+_executor_lock = threading.Lock()
+
+def start_warm_up(clients):
+    """build clients concurrently in background threads, retrying failed builds with backoff
+    ('warmUp.{retryInterval,maxRetryInterval}')"""
+    global _executor
+    warm_up_config = config.get('warmUp') or {}
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, len(clients)), thread_name_prefix='warm-up')
+            for client in clients:
+                _executor.submit(_warm_up, client, warm_up_config.get('retryInterval', 5),
+                                 warm_up_config.get('maxRetryInterval', 300), _stop)
+
+def stop_warm_up():
+    _stop.set()
@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from abc import abstractmethod
+from datetime import datetime, timedelta
+
+import pytz
+from loguru import logger
+
+from config import config
+from snapshot import Snapshot
+
+# classes of CIs that are indexed, by name
+NAME_CLASSES = {
+    'meraki': re.compile('meraki', re.I),
+}
+SNOW_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def reference_value(field):
+    """get the sys_id of a reference field, which is either a link object or a plain value"""
+    if isinstance(field, dict):
+        return field.get('value', '')
+    return field or ''
+
+class SnowTableMirror(Snapshot):
+    """Base class for local copies of ServiceNow tables that are synced incrementally.
+
+    After a full sync, refreshes only request rows updated since the newest 'sys_updated_on'
+    seen. A full sync runs every full_sync_interval seconds to drop deleted rows and rows
+    that no longer match the filter.
+
+    Subclasses implement fetch(), which gets rows updated after a datetime (or all rows if None),
+    and index(), which builds lookups over the rows by sys_id and swaps them in.
+
+    Parameters
+    ----------
+    name : str
+    refresh_interval : float
+    max_staleness : float
+    full_sync_interval : float
+    overlap : float
+        Seconds subtracted from the watermark to tolerate clock skew and rows committed late.
+    """
+
+    def __init__(self, name, refresh_interval=300, max_staleness=900, full_sync_interval=3600, overlap=60):
+        super().__init__(name, refresh_interval, max_staleness)
+        self.full_sync_interval = full_sync_interval
+        self.overlap = overlap
+        self.rows = {}
+        self.last_sync = None
+        self.last_full_sync = None
+
+    @abstractmethod
+    def fetch(self, updated_after):
+        """get the rows updated after a datetime, or every row if None"""
+
+    @abstractmethod
+    def index(self, rows):
+        """build lookups over rows, a dict of rows by sys_id, and swap them in"""
+
+    def load(self):
+        full_sync = self.last_sync is None or time.monotonic() - self.last_full_sync > self.full_sync_interval
+        if full_sync:
+            synced = time.monotonic()
+            fetched = list(self.fetch(None))
+            rows = {}
+        else:
+            fetched = list(self.fetch(self.last_sync - timedelta(seconds=self.overlap)))
+            rows = dict(self.rows)
+        for row in fetched:
+            rows[row['sys_id']] = row
+
+        last_sync = self.last_sync
+        for row in fetched:
+            try:
+                updated = pytz.utc.localize(datetime.strptime(row['sys_updated_on'], SNOW_TIME_FORMAT))
+            except (KeyError, ValueError):
+                continue
+            if last_sync is None or updated > last_sync:
+                last_sync = updated
+
+        self.index(rows)
+        self.rows = rows
+        self.last_sync = last_sync
+        if full_sync:
+            self.last_full_sync = synced
+        logger.info(f"Synced {len(fetched)} {self.name} rows ({'full' if full_sync else 'incremental'}), {len(rows)} mirrored.")
+
+    def dump(self):
+        return {'rows': self.rows,
+                'lastSync': self.last_sync.isoformat() if self.last_sync is not None else None,
+                'lastFullSync': time.time() - (time.monotonic() - self.last_full_sync)}
+
+    def restore(self, state):
+        rows = state['rows']
+        self.index(rows)
+        self.rows = rows
+        self.last_sync = datetime.fromisoformat(state['lastSync']) if state['lastSync'] else None
+        self.last_full_sync = time.monotonic() - (time.time() - state['lastFullSync'])
+
+    def reload(self):
+        """force a full sync now
+
+        Returns
+        -------
+        bool
+            True if sync succeeded
+        """
+
+        self.last_sync = None
+        return self.refresh(reuse=False)
+
+class CmdbMirror(SnowTableMirror):
+    """Local copy of the cmdb_ci rows matching a filter, indexed by location and name class.
+
+    Parameters
+    ----------
+    snow_api : SnowApi
+    filters : dict
+        Filter of the mirrored rows, as passed to SnowApi.get_cis_filtered_by.
+    refresh_interval : float
+    max_staleness : float
+    full_sync_interval : float
+    """
+
+    def __init__(self, snow_api, filters, refresh_interval=300, max_staleness=900, full_sync_interval=3600):
+        super().__init__("cmdb", refresh_interval, max_staleness, full_sync_interval)
+        self.snow_api = snow_api
+        self.filters = filters
+        self.by_location = {}
+
+    def fetch(self, updated_after):
+        return self.snow_api.get_cis_filtered_by(self.filters, updated_after=updated_after)
+
+    def index(self, rows):
+        by_location = {}
+        for ci in rows.values():
+            classes = by_location.setdefault(reference_value(ci.get('location')), {})
+            for name_class, regex in NAME_CLASSES.items():
+                if regex.search(ci.get('name') or ''):
+                    classes.setdefault(name_class, []).append(ci)
+        self.by_location = by_location
+
+    def get_cis(self, location, name_class):
+        """get copies of a location's CIs of a name class, e.g. 'meraki'"""
+        return [dict(ci) for ci in self.by_location.get(location, {}).get(name_class, ())]
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+def start_mirror(snow_api, filters):
+    """start the CMDB mirror if enabled by 'snow.mirror.enabled'"""
+    global _mirror
+    mirror_config = config['snow'].get('mirror') or {}
+    with _mirror_lock:
+        if mirror_config.get('enabled') and _mirror is None:
+            _mirror = CmdbMirror(snow_api, filters,
+                                 refresh_interval=mirror_config.get('refreshInterval', 300),
+                                 max_staleness=mirror_config.get('maxStaleness', 900),
+                                 full_sync_interval=mirror_config.get('fullSyncInterval', 3600))
+            _mirror.start()
+
+def get_mirror(fresh=True):
+    """get the CMDB mirror if it is running and, unless fresh is False, fresh. Otherwise None"""
+    if _mirror is not None and (not fresh or _mirror.is_fresh()):
+        return _mirror
+    return None
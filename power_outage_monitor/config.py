@@ -1,7 +1,219 @@
+import logging.handlers
+import os
+import sys
+import threading
+from collections import namedtuple
+from collections.abc import Mapping
+from datetime import datetime
+from functools import wraps
+from types import MappingProxyType
+
+import pytz
 import yaml
+from loguru import logger
 
-config = {}
+# path of the config file, passed to uvicorn worker processes which import api without main.py
+CONFIG_PATH_VARIABLE = 'POWER_OUTAGE_MONITOR_CONFIG'
 
-def set_config(file):
+class Config(Mapping):
+    """Settings loaded from the config file.
+
+    Loading or reloading replaces the whole dict in one assignment, so a lookup never sees a
+    reload half applied. version is incremented on every swap, so values built by compiled()
+    functions are rebuilt after a reload.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self.version = 0
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def swap(self, data):
+        """replace every setting with data"""
+        self._data = data
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        """replace some top-level sections, keeping the others"""
+        data = dict(self._data)
+        data.update(*args, **kwargs)
+        self.swap(data)
+
+config = Config()
+
+def compiled(build):
+    """decorate a function that builds a value from config, such as a request template, so it is
+    built once per config version instead of on every call
+
+    The value is shared by every caller and must not be modified.
+    """
+
+    lock = threading.Lock()
+    # (config version, value), replaced as a whole so it is read consistently without the lock
+    current = [(None, None)]
+
+    @wraps(build)
+    def get():
+        version, value = current[0]
+        if version != config.version:
+            with lock:
+                version, value = current[0]
+                if version != config.version:
+                    version = config.version
+                    value = build()
+                    current[0] = version, value
+        return value
+    return get
+
+def freeze(mapping):
+    """get a read-only copy of a mapping"""
+    return MappingProxyType(dict(mapping or {}))
+
+class RequestTemplate(namedtuple('RequestTemplate', ('url', 'headers', 'params'))):
+    """URL, headers and query parameters of an upstream request, compiled from a config section
+    with read-only headers and params."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, section, default_url, url_key='url'):
+        return cls(section.get(url_key, default_url), freeze(section.get('headers')), freeze(section.get('params')))
+
+    def with_params(self, **params):
+        """get the query parameters with some added or replaced, as a new dict"""
+        return dict(self.params, **params)
+
+class DateTimeFormat:
+    """Timezone and format of the datetimes in site statuses.
+
+    Parameters
+    ----------
+    timezone : str
+        Name of a timezone, e.g. 'America/Los_Angeles'. Local time is used if empty.
+    time_format : str
+        strftime format of datetimes.
+    """
+
+    def __init__(self, timezone, time_format):
+        self.timezone = pytz.timezone(timezone) if timezone else None
+        self.time_format = time_format
+
+    def from_epoch(self, epoch):
+        """convert seconds since the epoch to a datetime in the timezone"""
+        if self.timezone is None:
+            return datetime.fromtimestamp(epoch).astimezone()
+        return datetime.fromtimestamp(epoch, self.timezone)
+
+    def format_epoch(self, epoch):
+        return self.from_epoch(epoch).strftime(self.time_format)
+
+    def format_now(self):
+        now = datetime.now(self.timezone) if self.timezone is not None else datetime.now().astimezone()
+        return now.strftime(self.time_format)
+
+@compiled
+def get_date_time():
+    """get the 'date-time' settings, compiled"""
+    return DateTimeFormat(config['date-time'].get('timezone'), config['date-time']['timeFormat'])
+
+def load_config(file):
     with open(file) as fp:
-        config.update(yaml.safe_load(fp))
+        data = yaml.safe_load(fp)
+    if not isinstance(data, dict):
+        raise ValueError(f"Config file '{file}' is not a mapping.")
+    return data
+
+def set_config(file):
+    config.swap(load_config(file))
+    os.environ[CONFIG_PATH_VARIABLE] = str(file)
+
+def configure_logging():
+    logger.remove() # remove default handler
+    if 'console' in config['logger']:
+        logger.add(sys.stderr, level=config['logger']['console']['log_level'].upper())
+    if 'file' in config['logger']:
+        logger.add(config['logger']['file']['name'], level=config['logger']['file']['log_level'].upper())
+    if 'syslog' in config['logger']:
+        handler = logging.handlers.SysLogHandler(
+            address=(config["logger"]["syslog"]["host"], config["logger"]["syslog"]["port"]))
+        logger.add(handler, level=config['logger']['syslog']['log_level'].upper())
+
+def reload_config():
+    """load the config file again and swap it in, keeping the current config if it cannot be loaded
+
+    Returns
+    -------
+    bool
+        True if the config was reloaded
+    """
+
+    file = os.environ[CONFIG_PATH_VARIABLE]
+    try:
+        data = load_config(file)
+    except Exception:
+        logger.exception(f"Failed to reload config file '{file}', keeping the current config.")
+        return False
+    logger_changed = data.get('logger') != config.get('logger')
+    config.swap(data)
+    if logger_changed:
+        configure_logging()
+    logger.info(f"Reloaded config file '{file}'.")
+    return True
+
+def _file_signature(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _watch(interval, stop):
+    file = os.environ[CONFIG_PATH_VARIABLE]
+    signature = _file_signature(file)
+    while not stop.wait(interval):
+        current = _file_signature(file)
+        if current is not None and current != signature:
+            signature = current
+            reload_config()
+
+_watcher = None
+_watcher_stop = threading.Event()
+_watcher_lock = threading.Lock()
+
+def start_watcher():
+    """reload the config file whenever it changes if enabled by 'configReload.enabled', checking every
+    'configReload.interval' seconds
+
+    Settings read on every call, such as request templates, date-time and check settings, take
+    effect on reload. Settings read at startup, such as web, clients and snapshots, need a restart.
+    """
+
+    global _watcher
+    reload_settings = config.get('configReload') or {}
+    with _watcher_lock:
+        if reload_settings.get('enabled') and os.environ.get(CONFIG_PATH_VARIABLE) and _watcher is None:
+            _watcher_stop.clear()
+            _watcher = threading.Thread(target=_watch, args=(reload_settings.get('interval', 10), _watcher_stop),
+                                        name='config-watcher', daemon=True)
+            _watcher.start()
+
+def stop_watcher():
+    _watcher_stop.set()
+
+if os.environ.get(CONFIG_PATH_VARIABLE):
+    set_config(os.environ[CONFIG_PATH_VARIABLE])
+    configure_logging()
@@ -1,16 +1,97 @@
 import json
-from copy import deepcopy
+import re
+import sqlite3
+import threading
+import time
 
-import requests
 from loguru import logger
 
-from config import config
+import cache_backend
+import http_client
+import metrics
+from config import RequestTemplate, compiled, config, freeze
+
+URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"
+BATCH_URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses"
+
+class GeocodeCache:
+    """Persistent cache of geocoded addresses, keyed by normalized address.
+
+    Addresses that could not be geocoded are also cached, but only for negative_ttl seconds.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database.
+    negative_ttl : float
+        Seconds to remember an address that could not be found.
+    """
+
+    def __init__(self, path, negative_ttl=86400):
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS geocode ("
+                               "address TEXT PRIMARY KEY, longitude REAL, latitude REAL, updated REAL)")
+
+    def get(self, address):
+        """get a cached result
+
+        Returns
+        -------
+        2-tuple
+            (longitude, latitude), which are both None if the address is a cached miss.
+
+        None
+            If address is not cached or its miss has expired.
+        """
+
+        with self._lock:
+            row = self._conn.execute("SELECT longitude, latitude, updated FROM geocode WHERE address = ?",
+                                     (normalize_address(address),)).fetchone()
+        if row is None:
+            return None
+        long, lat, updated = row
+        if long is None and time.time() - updated > self.negative_ttl:
+            return None
+        return long, lat
+
+    def set(self, address, long, lat):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+                               (normalize_address(address), long, lat, time.time()))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    """get the persistent geocode cache at 'geocode.cache.path' under 'cache.dir', or None if it is disabled in config"""
+    global _cache
+    cache_config = config["geocode"].get("cache") or {}
+    path = cache_config.get("path", "geocode_cache.db")
+    if not path:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeocodeCache(cache_backend.cache_path(path), cache_config.get("negativeTtl", 86400))
+        return _cache
+
+def normalize_address(address):
+    """normalize an address for use as a cache key, i.e. uppercase with single spaces
+    and no punctuation other than commas"""
+    address = re.sub(r"[^\w\s,#-]", "", address.upper())
+    address = re.sub(r"\s*,\s*", ", ", address)
+    return re.sub(r"\s+", " ", address).strip(" ,")
 
 def get_long_lat(address):
     """Uses ArcGIS's REST API 'findAddressCandidates' to find the longitude and latitude of a given address.
     If API returns multiple results, return the most accurate and acceptable, i.e. above minScore, address.
     (more at: https://developers.arcgis.com/rest/geocode/api-reference/geocoding-find-address-candidates.htm)
-    
+
+    Results, including addresses that could not be found, are kept in the geocode cache if enabled.
+
     Parameters
     ----------
     address : str
@@ -25,13 +106,37 @@ def get_long_lat(address):
         if address could not be found or score is below acceptable.
     """
 
-    url = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"
-    headers = deepcopy(config["geocode"]["headers"])
-    params = deepcopy(config["geocode"]["params"])
+    cache = _get_cache()
+    if cache is not None:
+        cached = cache.get(address)
+        metrics.cache_lookup("geocode", cached is not None)
+        if cached is not None:
+            logger.info("Address '" + address + "' found in geocode cache.")
+            return cached
+
+    long, lat = _find_address_candidates(address)
+    if cache is not None:
+        cache.set(address, long, lat)
+    return long, lat
 
-    params["SingleLine"] = address
+@compiled
+def get_find_request():
+    """get the request template of 'findAddressCandidates', compiled from 'geocode'"""
+    return RequestTemplate.from_config(config["geocode"], URL)
 
-    response = requests.get(url, headers=headers, params=params)
+@compiled
+def get_batch_request():
+    """get the request template of 'geocodeAddresses', compiled from 'geocode'"""
+    request = RequestTemplate.from_config(config["geocode"], BATCH_URL, url_key="batchUrl")
+    params = {key: value for key, value in request.params.items() if key != "SingleLine"}
+    params["f"] = "json"
+    return request._replace(params=freeze(params))
+
+@metrics.timed("geocode")
+def _find_address_candidates(address):
+    request = get_find_request()
+
+    response = http_client.get_session().get(request.url, headers=request.headers, params=request.with_params(SingleLine=address))
 
     jsonResponse = json.loads(response.content)
 
@@ -49,3 +154,64 @@ def get_long_lat(address):
         logger.info("Address found: " + jsonResponse["candidates"][0]["address"] + " | Score: " + str(jsonResponse["candidates"][0]["score"]))
         point = jsonResponse["candidates"][0]["location"]
         return point["x"], point["y"]
+
+def get_long_lats(addresses):
+    """Uses ArcGIS's REST API 'geocodeAddresses' to find the longitude and latitude of many addresses
+    in as few requests as possible. Cached addresses are not requested and duplicates are requested once.
+    (more at: https://developers.arcgis.com/rest/geocode/api-reference/geocoding-geocode-addresses.htm)
+
+    Parameters
+    ----------
+    addresses : list
+        The addresses to search.
+
+    Returns
+    -------
+    list
+        (longitude, latitude) for each address, in order. Both values are None if the address
+        could not be found or its score is below minScore.
+    """
+
+    cache = _get_cache()
+    results = {}
+    missing = []
+    for address in addresses:
+        key = normalize_address(address)
+        if key in results:
+            continue
+        cached = cache.get(address) if cache is not None else None
+        if cached is not None:
+            results[key] = cached
+        else:
+            results[key] = (None, None)
+            missing.append(address)
+
+    batch_size = config["geocode"].get("batchSize", 1000)
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        for address, (long, lat) in zip(batch, _geocode_addresses(batch)):
+            results[normalize_address(address)] = long, lat
+            if cache is not None:
+                cache.set(address, long, lat)
+    return [results[normalize_address(address)] for address in addresses]
+
+@metrics.timed("geocode")
+def _geocode_addresses(addresses):
+    request = get_batch_request()
+
+    records = [{"attributes": {"OBJECTID": i, "SingleLine": address}} for i, address in enumerate(addresses)]
+    params = request.with_params(addresses=json.dumps({"records": records}))
+
+    response = http_client.get_session().post(request.url, headers=request.headers, data=params)
+
+    jsonResponse = json.loads(response.content)
+
+    points = [(None, None)] * len(addresses)
+    for location in jsonResponse["locations"]:
+        i = location["attributes"]["ResultID"]
+        if location["score"] >= config["geocode"]["minScore"] and location.get("location"):
+            logger.info("Address found: " + location["address"] + " | Score: " + str(location["score"]))
+            points[i] = location["location"]["x"], location["location"]["y"]
+        else:
+            logger.error("Could not find address '" + addresses[i] + "'.")
+    return points
@@ -0,0 +1,345 @@
+import json
+import math
+import time
+from datetime import datetime, timezone
+
+import shapely
+from loguru import logger
+from shapely import affinity
+from shapely.geometry import Point, Polygon
+from shapely.ops import nearest_points
+
+import http_client
+from outage_join import OutageIndex, search_margins
+from snapshot import Snapshot
+
+# conversion of ArcGIS linear units to meters
+UNIT_METERS = {
+    "esriSRUnit_Meter": 1,
+    "esriSRUnit_Kilometer": 1000,
+    "esriSRUnit_Foot": 0.3048,
+    "esriSRUnit_StatuteMile": 1609.344,
+    "esriSRUnit_NauticalMile": 1852,
+}
+EARTH_RADIUS_METERS = 6371008.8
+
+# point query parameters that do not apply to a whole-layer download
+POINT_QUERY_PARAMS = ("geometry", "geometryType", "inSR", "spatialRel", "distance", "units", "unit")
+
+def haversine(long1, lat1, long2, lat2):
+    """great-circle distance in meters between two (longitude, latitude) points"""
+    long1, lat1, long2, lat2 = map(math.radians, (long1, lat1, long2, lat2))
+    a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2)**2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+def esri_to_shape(geometry):
+    """convert an ArcGIS JSON point or polygon geometry to a shapely geometry
+
+    ArcGIS polygons are a flat list of rings where exterior rings are clockwise
+    and holes are counter-clockwise.
+
+    Returns
+    -------
+    shapely.Geometry
+
+    None
+        If geometry is missing or of an unsupported type.
+    """
+
+    if not geometry:
+        return None
+    if "x" in geometry and "y" in geometry:
+        if geometry["x"] is None or geometry["y"] is None:
+            return None
+        return Point(geometry["x"], geometry["y"])
+    if "rings" not in geometry:
+        return None
+
+    shells = []
+    holes = []
+    for ring in geometry["rings"]:
+        if len(ring) < 4:
+            continue
+        polygon = Polygon(ring)
+        if polygon.exterior.is_ccw:
+            holes.append(polygon)
+        else:
+            shells.append(polygon)
+    if not shells:
+        # ring orientation is not reliable, treat everything as exterior rings
+        shells, holes = holes, []
+
+    polygons = []
+    for shell in shells:
+        interiors = [hole.exterior.coords for hole in holes if shell.contains(hole.representative_point())]
+        polygons.append(Polygon(shell.exterior.coords, interiors))
+    shape = shapely.union_all(polygons) if len(polygons) > 1 else polygons[0] if polygons else None
+    if shape is not None and not shape.is_valid:
+        shape = shapely.make_valid(shape)
+    return shape
+
+class GisSnapshot(Snapshot):
+    """In-memory copy of the CalOES Power_Outages layer with an STR-tree spatial index.
+
+    Parameters
+    ----------
+    url : str
+        The layer query URL.
+    headers : dict
+        Request headers, from config.
+    params : dict
+        Request parameters used for point queries, from config. Point query specific
+        parameters are dropped, while 'distance' and 'units' are applied locally.
+    refresh_interval : float
+    max_staleness : float
+    page_size : int
+        Number of features requested per page.
+    incremental : bool
+        Refresh by downloading only features edited since the last sync, plus the current
+        object IDs to drop deleted features. Otherwise every refresh downloads the whole layer.
+    edit_date_field : str
+        Field holding each feature's last edit time. Read from the layer's editFieldsInfo if
+        not given. Without one, only new and deleted features are synced incrementally, and
+        edited features are picked up by the next full sync.
+    full_sync_interval : float
+        Seconds between full downloads when syncing incrementally.
+    overlap : float
+        Seconds subtracted from the edit date watermark to tolerate features committed late.
+    """
+
+    def __init__(self, url, headers, params, refresh_interval=300, max_staleness=900, page_size=1000,
+                 incremental=True, edit_date_field=None, full_sync_interval=3600, overlap=60):
+        super().__init__("gis", refresh_interval, max_staleness)
+        self.url = url
+        self.headers = dict(headers or {})
+        self.params = {k: v for k, v in (params or {}).items() if k not in POINT_QUERY_PARAMS}
+        self.params.setdefault("where", "1=1")
+        self.params["returnGeometry"] = "true"
+        self.params["outSR"] = "4326"
+        self.params["f"] = "json"
+        # stable order is required to paginate
+        self.params.setdefault("orderByFields", "OBJECTID")
+        self.page_size = page_size
+
+        params = params or {}
+        distance = float(params.get("distance") or 0)
+        unit = params.get("units", params.get("unit")) or "esriSRUnit_Meter"
+        self.distance = distance * UNIT_METERS.get(unit, 1)
+
+        self.incremental = incremental
+        self.edit_date_field = edit_date_field
+        self.object_id_field = "OBJECTID"
+        self.full_sync_interval = full_sync_interval
+        self.overlap = overlap
+        self._layer_info = None
+        # object ID to (feature, shape), the local feature store that deltas are applied to
+        self.store = {}
+        self.watermark = None
+        self.last_full_sync = None
+
+        self.features = []
+        self.shapes = []
+        self.tree = None
+        self._join_index = None
+
+    def download(self, params=None):
+        """download every feature matching the snapshot query, paginating over resultOffset
+
+        Returns
+        -------
+        list
+            The features, in the order returned by the layer.
+        """
+
+        features = []
+        offset = 0
+        while True:
+            page_params = dict(self.params, **(params or {}))
+            page_params["resultOffset"] = offset
+            page_params["resultRecordCount"] = self.page_size
+            response = http_client.get_session().get(self.url, headers=self.headers, params=page_params)
+            response.raise_for_status()
+            response_content = json.loads(response.content)
+            if "features" not in response_content:
+                raise ValueError(f"Unexpected GIS response: {response_content}")
+            features.extend(response_content["features"])
+            if not response_content.get("exceededTransferLimit") or not response_content["features"]:
+                return features
+            offset += len(response_content["features"])
+
+    def _get(self, params):
+        response = http_client.get_session().get(self.url, headers=self.headers, params=params)
+        response.raise_for_status()
+        return json.loads(response.content)
+
+    def layer_info(self):
+        """read the object ID and edit date fields from the layer's metadata, once"""
+        if self._layer_info is None:
+            try:
+                response = http_client.get_session().get(self.url.rsplit("/query", 1)[0], headers=self.headers,
+                                                         params={"f": "json"})
+                response.raise_for_status()
+                self._layer_info = json.loads(response.content)
+            except Exception:
+                logger.exception(f"Failed to read {self.name} layer metadata, using defaults.")
+                self._layer_info = {}
+            self.object_id_field = self._layer_info.get("objectIdField") or self.object_id_field
+            if self.edit_date_field is None:
+                self.edit_date_field = (self._layer_info.get("editFieldsInfo") or {}).get("editDateField")
+        return self._layer_info
+
+    def download_ids(self):
+        """get the object IDs of every feature matching the snapshot query"""
+        response_content = self._get({"where": self.params["where"], "returnIdsOnly": "true", "f": "json"})
+        if "objectIds" not in response_content:
+            raise ValueError(f"Unexpected GIS response: {response_content}")
+        return set(response_content["objectIds"] or [])
+
+    def download_by_ids(self, object_ids):
+        """download the features with the given object IDs, a page at a time"""
+        object_ids = sorted(object_ids)
+        features = []
+        for start in range(0, len(object_ids), self.page_size):
+            page_ids = object_ids[start:start + self.page_size]
+            params = dict(self.params, objectIds=",".join(map(str, page_ids)))
+            for key in ("where", "orderByFields"):
+                params.pop(key, None)
+            response_content = self._get(params)
+            if "features" not in response_content:
+                raise ValueError(f"Unexpected GIS response: {response_content}")
+            features.extend(response_content["features"])
+        return features
+
+    def _edited_since(self, watermark):
+        """where clause of the snapshot query limited to features edited after watermark (epoch ms)"""
+        edited = datetime.fromtimestamp(watermark / 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        return f"({self.params['where']}) AND {self.edit_date_field} > TIMESTAMP '{edited}'"
+
+    def index(self, features):
+        """build the spatial index over features and swap it in"""
+        self.swap({feature["attributes"].get(self.object_id_field, i): (feature, esri_to_shape(feature.get("geometry")))
+                   for i, feature in enumerate(features)})
+
+    def swap(self, store):
+        """build the spatial index over a feature store and swap it in"""
+        indexed = []
+        shapes = []
+        for _, (feature, shape) in sorted(store.items()):
+            if shape is None:
+                continue
+            indexed.append(feature)
+            shapes.append(shape)
+        tree = shapely.STRtree(shapes)
+        # swap all at once so concurrent queries never see a partial index
+        self.store = store
+        self.features, self.shapes, self.tree = indexed, shapes, tree
+
+    def _update_watermark(self, features):
+        if not self.edit_date_field:
+            return
+        for feature in features:
+            edited = feature["attributes"].get(self.edit_date_field)
+            if isinstance(edited, (int, float)) and (self.watermark is None or edited > self.watermark):
+                self.watermark = edited
+
+    def load(self):
+        if not self.incremental:
+            self.index(self.download())
+            return
+        self.layer_info()
+
+        full_sync = self.last_full_sync is None or time.monotonic() - self.last_full_sync > self.full_sync_interval
+        if full_sync:
+            synced = time.monotonic()
+            features = self.download()
+            self.watermark = None
+            self._update_watermark(features)
+            self.index(features)
+            self.last_full_sync = synced
+            logger.info(f"Synced {len(features)} {self.name} features (full).")
+            return
+
+        # query edits before IDs, so a feature added in between is still fetched below
+        edited = []
+        if self.edit_date_field and self.watermark is not None:
+            edited = self.download({"where": self._edited_since(self.watermark - self.overlap * 1000)})
+        object_ids = self.download_ids()
+
+        store = {object_id: value for object_id, value in self.store.items() if object_id in object_ids}
+        deleted = len(self.store) - len(store)
+        for feature in edited:
+            object_id = feature["attributes"].get(self.object_id_field)
+            if object_id in object_ids:
+                store[object_id] = (feature, esri_to_shape(feature.get("geometry")))
+        added = self.download_by_ids(object_ids - store.keys())
+        for feature in added:
+            store[feature["attributes"][self.object_id_field]] = (feature, esri_to_shape(feature.get("geometry")))
+
+        self._update_watermark(edited)
+        self._update_watermark(added)
+        self.swap(store)
+        logger.info(f"Synced {self.name} features (incremental): {len(edited)} edited, {len(added)} added, "
+                    f"{deleted} deleted, {len(store)} stored.")
+
+    def dump(self):
+        state = {"features": [feature for feature, _ in self.store.values()], "watermark": self.watermark}
+        if self.last_full_sync is not None:
+            state["lastFullSync"] = time.time() - (time.monotonic() - self.last_full_sync)
+        return state
+
+    def restore(self, state):
+        if self.incremental:
+            self.layer_info()
+        self.index(state["features"])
+        self.watermark = state["watermark"]
+        if "lastFullSync" in state:
+            self.last_full_sync = time.monotonic() - (time.time() - state["lastFullSync"])
+
+    def query(self, longitude, latitude):
+        """find outages at a point, applying the configured search distance
+
+        Returns
+        -------
+        list
+            Features in the same shape as the layer's query response, i.e. dicts with
+            a copy of the 'attributes', in layer order.
+        """
+
+        features, shapes, tree = self.features, self.shapes, self.tree
+        if tree is None:
+            return []
+        longitude, latitude = float(longitude), float(latitude)
+        point = Point(longitude, latitude)
+        if self.distance:
+            # search a degree radius that is conservative in longitude, then measure exactly
+            candidates = sorted(tree.query(point, predicate="dwithin", distance=max(search_margins(self.distance, latitude))))
+            matches = []
+            # nearest point in a local equirectangular projection around the point, as OutageIndex.join
+            scale_x = math.cos(math.radians(latitude))
+            projected_point = Point(longitude * scale_x, latitude)
+            for i in candidates:
+                projected_shape = affinity.scale(shapes[i], xfact=scale_x, yfact=1, origin=(0, 0))
+                nearest = nearest_points(projected_shape, projected_point)[0]
+                if haversine(longitude, latitude, nearest.x / scale_x, nearest.y) <= self.distance:
+                    matches.append(i)
+        else:
+            matches = sorted(tree.query(point, predicate="intersects"))
+        return [{"attributes": dict(features[i]["attributes"])} for i in matches]
+
+    def join(self, longitudes, latitudes):
+        """find the first outage at each of many points in one vectorized pass,
+        applying the configured search distance
+
+        Returns
+        -------
+        list
+            For each point, a feature in the same shape as query() returns, or None.
+        """
+
+        features, shapes = self.features, self.shapes
+        join_index = self._join_index
+        if join_index is None or join_index.shapes is not shapes:
+            # built on first use after each refresh
+            join_index = self._join_index = OutageIndex(shapes)
+        matches = join_index.join(longitudes, latitudes, self.distance)
+        return [{"attributes": dict(features[i]["attributes"])} if i >= 0 else None for i in matches.tolist()]
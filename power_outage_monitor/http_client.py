@@ -0,0 +1,71 @@
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import config
+
+# POSTs are not retried after they were sent: each Opsgenie tags or details POST adds a note, and the
+# Opsgenie outbox retries on its own. Connection errors are retried for every method.
+RETRY_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class JitteredRetry(Retry):
+    """Retry with 'full jitter', i.e. a random backoff between zero and the exponential backoff,
+    so retries from concurrent requests do not arrive in lockstep."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return 0
+        return random.uniform(0, backoff)
+
+class HttpClient(requests.Session):
+    """Session with keep-alive connection pools per host, default timeouts, and bounded retries.
+
+    Parameters
+    ----------
+    connect_timeout : float
+    read_timeout : float
+    retries : int
+        Maximum retries on connection errors and retryable statuses.
+    backoff_factor : float
+        Base of the exponential backoff between retries, in seconds.
+    pool_connections : int
+        Number of hosts to keep connection pools for.
+    pool_maxsize : int
+        Maximum connections kept alive per host.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=30, retries=3, backoff_factor=0.5,
+                 pool_connections=10, pool_maxsize=32):
+        super().__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        retry = JitteredRetry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                              allowed_methods=RETRY_METHODS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """get the HTTP client shared by all upstream requests, configured by the 'http' config section"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            http_config = config.get("http") or {}
+            _session = HttpClient(connect_timeout=http_config.get("connectTimeout", 5),
+                                  read_timeout=http_config.get("readTimeout", 30),
+                                  retries=http_config.get("retries", 3),
+                                  backoff_factor=http_config.get("backoffFactor", 0.5),
+                                  pool_connections=http_config.get("poolConnections", 10),
+                                  pool_maxsize=http_config.get("poolMaxsize", 32))
+        return _session
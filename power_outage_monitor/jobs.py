@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from loguru import logger
+
+class QueueFull(Exception):
+    """Raised when a job or call is rejected because too many are waiting.
+
+    Parameters
+    ----------
+    message : str
+    retry_after : float
+        Seconds the client should wait before retrying, if known.
+    """
+
+    def __init__(self, message='', retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Job:
+    def __init__(self, key, args):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.args = args
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        """get the job as returned by the API, without the fields that are not set yet"""
+        job = {'id': self.id, 'status': self.status, 'created': self.created}
+        if self.finished is not None:
+            job['finished'] = self.finished
+        if self.status == 'done':
+            job['details'] = self.result
+        elif self.status == 'failed':
+            job['error'] = self.error
+        return job
+
+class JobQueue:
+    """Runs jobs on a bounded pool of workers, rejecting new jobs once too many are waiting.
+
+    Jobs are idempotent on their key: submitting a key that already has a pending, running
+    or done job returns that job until it expires. A failed job stays readable by id, but
+    submitting its key again queues a new job.
+
+    Parameters
+    ----------
+    func : callable
+        Called with a job's args. Its return value is the job's result.
+    max_workers : int
+        Number of jobs run at once.
+    max_queued : int
+        Number of jobs allowed to wait for a worker.
+    ttl : float
+        Seconds a finished job is kept.
+    cache : MemoryCache or SqliteCache
+        If given, jobs are published to it so describe() finds jobs of other worker processes.
+    """
+
+    def __init__(self, func, max_workers=8, max_queued=100, ttl=3600, cache=None):
+        self.func = func
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_key = {}
+        self.queued = 0
+
+    def _expire(self):
+        now = time.time()
+        for job in [job for job in self._jobs.values() if job.finished and now - job.finished > self.ttl]:
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    def submit(self, key, *args):
+        """queue a job, or get the existing job for key
+
+        Returns
+        -------
+        2-tuple
+            (job, created) where created is False if an existing job was returned
+
+        Raises
+        ------
+        QueueFull
+            If max_queued jobs are already waiting
+        """
+
+        with self._lock:
+            self._expire()
+            job = self._by_key.get(key)
+            if job is not None:
+                return job, False
+            if self.queued >= self.max_queued:
+                raise QueueFull(f'{self.queued} jobs are already queued.')
+            job = Job(key, args)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self.queued += 1
+        self._publish(job)
+        self._executor.submit(self._run, job)
+        return job, True
+
+    def _run(self, job):
+        with self._lock:
+            self.queued -= 1
+        job.status = 'running'
+        self._publish(job)
+        try:
+            job.result = self.func(*job.args)
+        except Exception as err:
+            logger.exception(f'Job {job.id} failed.')
+            job.error = getattr(err, 'detail', None) or str(err)
+            job.status = 'failed'
+            with self._lock:
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+        else:
+            job.status = 'done'
+        job.finished = time.time()
+        self._publish(job)
+
+    def _publish(self, job):
+        if self.cache is not None:
+            try:
+                self.cache.set(f'job:{job.id}', job.to_dict(), ttl=self.ttl)
+            except Exception:
+                logger.exception(f'Failed to publish job {job.id}.')
+
+    def get(self, job_id):
+        """get a job by id, or None if not found or expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def describe(self, job_id):
+        """get a job as a dict, including jobs published by other worker processes,
+        or None if not found or expired"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.cache is not None:
+            return self.cache.get(f'job:{job_id}')
+        return None
+
+class PriorityGate:
+    """Lets at most max_active calls of an event loop run at once. Other calls wait without holding
+    a thread and are let in by priority, lowest first, then in arrival order.
+
+    When max_queued calls are waiting, a new call takes the place of the latest waiting call of
+    a lower priority, which is rejected, or is rejected itself.
+
+    Parameters
+    ----------
+    max_active : int
+        Number of calls run at once.
+    max_queued : int
+        Number of calls allowed to wait.
+    max_wait : float
+        Seconds a call may wait before it is rejected, or None to wait as long as needed.
+    retry_after : float
+        Seconds rejected callers are told to wait before retrying.
+    """
+
+    def __init__(self, max_active, max_queued=100, max_wait=None, retry_after=30):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        # heap of [priority, arrival, event, state], state is 'waiting', 'admitted', 'shed' or 'expired'.
+        # Only used from the event loop, so no lock is needed.
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self.active = 0
+        self.queued = 0
+
+    @asynccontextmanager
+    async def admit(self, priority=0):
+        """wait for a turn to run
+
+        Raises
+        ------
+        QueueFull
+            If the call was rejected or waited longer than max_wait
+        """
+
+        await self._enter(priority)
+        try:
+            yield
+        finally:
+            self._leave()
+
+    def _shed(self, priority):
+        """reject the latest waiting call of a lower priority than priority, if any"""
+        waiting = [entry for entry in self._waiting if entry[3] == 'waiting']
+        if not waiting:
+            return False
+        entry = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if entry[0] <= priority:
+            return False
+        entry[3] = 'shed'
+        self.queued -= 1
+        entry[2].set()
+        return True
+
+    async def _enter(self, priority):
+        if self.active < self.max_active and not self.queued:
+            self.active += 1
+            return
+        if self.queued >= self.max_queued and not self._shed(priority):
+            raise QueueFull(f'{self.queued} calls are already queued.', retry_after=self.retry_after)
+        entry = [priority, next(self._arrivals), asyncio.Event(), 'waiting']
+        heapq.heappush(self._waiting, entry)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(entry[2].wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # cancelled, e.g. by the client disconnecting
+            if entry[3] == 'admitted':
+                self._leave()
+            elif entry[3] == 'waiting':
+                entry[3] = 'expired'
+                self.queued -= 1
+            raise
+        if entry[3] == 'waiting':
+            entry[3] = 'expired'
+            self.queued -= 1
+        if entry[3] == 'admitted':
+            return
+        if entry[3] == 'shed':
+            raise QueueFull('Rejected in favor of a call of a higher priority.', retry_after=self.retry_after)
+        raise QueueFull(f'Waited {self.max_wait}s without being admitted.', retry_after=self.retry_after)
+
+    def _leave(self):
+        while self._waiting:
+            entry = heapq.heappop(self._waiting)
+            if entry[3] == 'waiting':
+                # hand this call's slot over
+                entry[3] = 'admitted'
+                self.queued -= 1
+                entry[2].set()
+                return
+        self.active -= 1
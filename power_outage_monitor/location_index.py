@@ -0,0 +1,90 @@
+import threading
+
+from loguru import logger
+
+from cmdb_mirror import SnowTableMirror
+from config import config
+
+def site_point(site):
+    """get (longitude, latitude) of a site, or None if it has no valid coordinates"""
+    try:
+        return float(site['longitude']), float(site['latitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class LocationIndex(SnowTableMirror):
+    """Local copy of cmn_location indexed by case-insensitive name and by sys_id.
+
+    Parameters
+    ----------
+    snow_api : SnowApi
+    refresh_interval : float
+    max_staleness : float
+    full_sync_interval : float
+    """
+
+    def __init__(self, snow_api, refresh_interval=300, max_staleness=900, full_sync_interval=3600):
+        super().__init__("cmn_location", refresh_interval, max_staleness, full_sync_interval)
+        self.snow_api = snow_api
+        self.by_name = {}
+        self._update_lock = threading.Lock()
+
+    def fetch(self, updated_after):
+        return self.snow_api.get_sites(updated_after=updated_after)
+
+    def index(self, rows):
+        by_name = {}
+        for site in rows.values():
+            key = (site.get('name') or '').lower()
+            if key in by_name:
+                logger.warning(f"More than one location is named '{site['name']}'.")
+                continue
+            by_name[key] = site
+        self.by_name = by_name
+
+    def get_site_by_name(self, name):
+        """get a copy of a site by name, ignoring case, or None if not found"""
+        site = self.by_name.get(name.lower())
+        return dict(site) if site is not None else None
+
+    def get_site(self, sys_id):
+        """get a copy of a site by sys_id, or None if not found"""
+        site = self.rows.get(sys_id)
+        return dict(site) if site is not None else None
+
+    def get_sites(self):
+        """get copies of every site"""
+        return [dict(site) for site in self.rows.values()]
+
+    def update(self, sys_id, values):
+        """update fields of a site in place, e.g. after writing them back to ServiceNow"""
+        with self._update_lock:
+            site = self.rows.get(sys_id)
+            if site is None:
+                return
+            site = dict(site, **values)
+            self.rows[sys_id] = site
+            if self.by_name.get((site.get('name') or '').lower(), {}).get('sys_id') == sys_id:
+                self.by_name[site['name'].lower()] = site
+            self.version += 1
+
+_index = None
+_index_lock = threading.Lock()
+
+def start_index(snow_api):
+    """start the location index if enabled by 'snow.locations.enabled'"""
+    global _index
+    index_config = config['snow'].get('locations') or {}
+    with _index_lock:
+        if index_config.get('enabled') and _index is None:
+            _index = LocationIndex(snow_api,
+                                   refresh_interval=index_config.get('refreshInterval', 300),
+                                   max_staleness=index_config.get('maxStaleness', 900),
+                                   full_sync_interval=index_config.get('fullSyncInterval', 3600))
+            _index.start()
+
+def get_index(fresh=True):
+    """get the location index if it is running and, unless fresh is False, fresh. Otherwise None"""
+    if _index is not None and (not fresh or _index.is_fresh()):
+        return _index
+    return None
@@ -1,7 +1,6 @@
-import logging.handlers
 import os
+import shutil
 import subprocess
-import sys
 from pathlib import Path
 
 import requests
@@ -26,32 +25,44 @@ if __name__ == '__main__':
                 'role': 'sops',
                 'jwt': jwt
             }
-            response = requests.post(url, json=body)
+            response = requests.post(url, json=body, timeout=30)
             response.raise_for_status()
 
             # set token
             os.putenv('VAULT_TOKEN', response.json()['auth']['client_token']) 
 
             # decrypt config file
-            subprocess.run(['sops', '-d', f'{VAULT_ADDR}/v1/sops/keys/first-key', 'encrypted.yaml', '>', 'config.yaml'], check=True)
+            try:
+                with open(config_path, 'w') as fp:
+                    subprocess.run(['sops', '-d', f'{VAULT_ADDR}/v1/sops/keys/first-key', str(config_path.with_name('encrypted.yaml'))],
+                                   stdout=fp, check=True)
+            except Exception:
+                # do not leave a partial config.yaml behind for the next start to use
+                config_path.unlink(missing_ok=True)
+                raise
         config.set_config(config_path)
 
         HOST = config.config['web']['host']
         PORT = config.config['web']['port']
         LOG_LEVEL = config.config['web']['log_level']
         PROXY = config.config['web']['proxy']
+        # worker processes load the config from CONFIG_PATH_VARIABLE and share caches through 'cache.backend'
+        WORKERS = config.config['web'].get('workers', 1)
 
         # configure logging
-        logger.remove() # remove default handler
-        if 'console' in config.config['logger']:
-            logger.add(sys.stderr, level=config.config['logger']['console']['log_level'].upper())
-        if 'file' in config.config['logger']:
-            logger.add(config.config['logger']['file']['name'], level=config.config['logger']['file']['log_level'].upper())
-        if 'syslog' in config.config['logger']:
-            handler = logging.handlers.SysLogHandler(
-                address=(config.config["logger"]["syslog"]["host"], config.config["logger"]["syslog"]["port"]))
-            logger.add(handler, level=config.config['logger']['syslog']['log_level'].upper())
+        config.configure_logging()
+
+        if WORKERS > 1 and (config.config.get('cache') or {}).get('backend', 'memory') != 'sqlite':
+            # leases are only exclusive across processes with a shared backend. Without one, every worker
+            # would run the Opsgenie outbox, the serial write-back and the sweep.
+            raise ValueError("web.workers > 1 requires cache.backend: sqlite.")
+        if WORKERS > 1:
+            # aggregate /metrics across workers, the directory must be emptied before they start
+            metrics_dir = Path(os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                                     (config.config.get('metrics') or {}).get('multiprocessDir', 'prometheus_multiproc')))
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+            metrics_dir.mkdir(parents=True)
 
         # start api
         logger.info('Starting Power Outage Check API.')
-        uvicorn.run('api:app', host=HOST, port=PORT, root_path=PROXY, log_level=LOG_LEVEL)
+        uvicorn.run('api:app', host=HOST, port=PORT, root_path=PROXY, log_level=LOG_LEVEL, workers=WORKERS)
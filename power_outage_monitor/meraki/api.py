@@ -1,10 +1,15 @@
+import threading
+import time
+
 import meraki
+from loguru import logger
 
 from .exceptions import ObjectNotFound
 
 class MerakiOrgApi:
-    def __init__(self, org_name=None, org_id=None, api_key=None):
-        self.db = meraki.DashboardAPI(suppress_logging=True) if not api_key else meraki.DashboardAPI(api_key, suppress_logging=True)
+    def __init__(self, org_name=None, org_id=None, api_key=None, base_url=None):
+        kwargs = {'base_url': base_url} if base_url else {}
+        self.db = meraki.DashboardAPI(suppress_logging=True, **kwargs) if not api_key else meraki.DashboardAPI(api_key, suppress_logging=True, **kwargs)
         if org_id:
             org = self.db.organizations.getOrganization(org_id)
             try:
@@ -27,7 +32,67 @@ class MerakiOrgApi:
         self.name = org['name']
         self.url = org['url']
 
+        # org-wide device status snapshot, see start_snapshot()
+        self.by_serial = {}
+        self.by_mac = {}
+        self.by_name = {}
+        self.snapshot_updated = None
+        self.max_staleness = None
+        self._snapshot_thread = None
+        self._snapshot_stop = threading.Event()
+
+    def refresh_snapshot(self):
+        """page through the statuses of every device in the organization and index them
+        by serial, MAC and name"""
+        statuses = self.db.organizations.getOrganizationDevicesStatuses(self.id, total_pages='all', perPage=1000)
+        by_serial, by_mac, by_name = {}, {}, {}
+        for device in statuses:
+            by_serial[device['serial']] = device
+            if device.get('mac'):
+                by_mac.setdefault(device['mac'].lower(), device)
+            if device.get('name'):
+                by_name.setdefault(device['name'], device)
+        self.by_serial, self.by_mac, self.by_name = by_serial, by_mac, by_name
+        self.snapshot_updated = time.monotonic()
+
+    def _run_snapshot(self, refresh_interval, max_backoff):
+        wait = 0
+        failures = 0
+        while not self._snapshot_stop.wait(wait):
+            try:
+                self.refresh_snapshot()
+            except meraki.APIError as err:
+                # back off further on every failure, e.g. when rate limited by other API consumers
+                failures += 1
+                wait = min(refresh_interval * 2**failures, max_backoff)
+                logger.error(f'Failed to refresh Meraki device statuses ({err.status}), retrying in {wait}s.')
+            except Exception:
+                failures += 1
+                wait = min(refresh_interval * 2**failures, max_backoff)
+                logger.exception(f'Failed to refresh Meraki device statuses, retrying in {wait}s.')
+            else:
+                failures = 0
+                wait = refresh_interval
+
+    def start_snapshot(self, refresh_interval=60, max_staleness=300, max_backoff=600):
+        """serve device lookups from an org-wide status snapshot refreshed every refresh_interval
+        seconds, falling back to the API on a miss or once the snapshot is older than max_staleness"""
+        self.max_staleness = max_staleness
+        if self._snapshot_thread is None or not self._snapshot_thread.is_alive():
+            self._snapshot_stop.clear()
+            self._snapshot_thread = threading.Thread(target=self._run_snapshot, args=(refresh_interval, max_backoff),
+                                                     name='meraki-snapshot', daemon=True)
+            self._snapshot_thread.start()
+
+    def stop_snapshot(self):
+        self._snapshot_stop.set()
+
+    def _snapshot_is_fresh(self):
+        return self.snapshot_updated is not None and time.monotonic() - self.snapshot_updated <= self.max_staleness
+
     def get_device_by_name(self, name):
+        if self._snapshot_is_fresh() and name in self.by_name:
+            return self.by_name[name]
         response = self.db.organizations.getOrganizationDevices(self.id, name=name)
         try:
             return response[0]
@@ -35,6 +100,8 @@ class MerakiOrgApi:
             raise ObjectNotFound(f"Cannot get device status with name: {name}")
 
     def get_device_by_mac(self, mac):
+        if self._snapshot_is_fresh() and mac and mac.lower() in self.by_mac:
+            return self.by_mac[mac.lower()]
         response = self.db.organizations.getOrganizationDevices(self.id, mac=mac)
         try:
             return response[0]
@@ -42,7 +109,10 @@ class MerakiOrgApi:
             raise ObjectNotFound(f"Cannot get device status with mac: {mac}")
 
     def get_device_status(self, serial):
-        response = self.db.organizations.getOrganizationDevicesStatuses(self.id, serials=serial)
+        if self._snapshot_is_fresh() and serial in self.by_serial:
+            response = [self.by_serial[serial]]
+        else:
+            response = self.db.organizations.getOrganizationDevicesStatuses(self.id, serials=serial)
         try:
             if response[0]['status'] == 'offline' or response[0]['status'] == 'dormant':
                 return False
@@ -0,0 +1,124 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+import ratelimit
+
+# upstream calls range from cache-warm lookups to read timeouts
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+UPSTREAM_SECONDS = Histogram('power_outage_upstream_seconds', 'Latency of upstream calls.',
+                             ['upstream', 'operation', 'outcome'], buckets=BUCKETS)
+UPSTREAM_IN_FLIGHT = Gauge('power_outage_upstream_in_flight', 'Upstream calls in progress.',
+                           ['upstream', 'operation'], multiprocess_mode='livesum')
+CACHE_LOOKUPS = Counter('power_outage_cache_lookups_total', 'Lookups of local caches and snapshots.',
+                        ['cache', 'result'])
+REQUEST_SECONDS = Histogram('power_outage_request_seconds', 'Latency of API requests.',
+                            ['method', 'route', 'status'], buckets=BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge('power_outage_requests_in_flight', 'API requests in progress.',
+                           multiprocess_mode='livesum')
+RATE_LIMIT_SECONDS = Histogram('power_outage_rate_limit_seconds', 'Time upstream calls waited on rate limits.',
+                               ['upstream'], buckets=BUCKETS)
+RATE_LIMITED = Counter('power_outage_rate_limited_total', 'Upstream calls rejected by rate limits.', ['upstream'])
+CHECKS_REJECTED = Counter('power_outage_checks_rejected_total', 'Checks rejected because the queue was full.',
+                          ['priority'])
+
+_timings = contextvars.ContextVar('timings', default=None)
+
+class Timings:
+    """Time spent per upstream operation during one request, shared by the threads it fans out to."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {'count': 0, 'seconds': 0.0})
+            span['count'] += 1
+            span['seconds'] += seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {name: dict(span) for name, span in self.spans.items()}
+
+    def server_timing(self):
+        """format as a Server-Timing header value, durations in milliseconds"""
+        return ', '.join(f"{name.replace('.', '_')};dur={span['seconds'] * 1000:.1f}"
+                         for name, span in self.to_dict().items())
+
+@contextmanager
+def request_timings():
+    """collect the upstream timings of the calls made in this context, including threads started
+    with submit()"""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def submit(executor, func, *args):
+    """submit func to an executor in a copy of the current context, so its spans count towards
+    the current request"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+@contextmanager
+def span(upstream, operation):
+    """time an upstream call, after waiting for the upstream's rate limit"""
+    try:
+        waited = ratelimit.acquire(upstream)
+    except ratelimit.RateLimited:
+        RATE_LIMITED.labels(upstream).inc()
+        raise
+    if waited:
+        RATE_LIMIT_SECONDS.labels(upstream).observe(waited)
+    in_flight = UPSTREAM_IN_FLIGHT.labels(upstream, operation)
+    in_flight.inc()
+    outcome = 'ok'
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        in_flight.dec()
+        UPSTREAM_SECONDS.labels(upstream, operation, outcome).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(f'{upstream}.{operation}', elapsed)
+
+def timed(upstream, operation=None):
+    """decorate a function to time every call as an upstream call, named after the function by default"""
+    def decorator(func):
+        name = operation or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(upstream, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def cache_lookup(cache, hit):
+    """count a lookup of a local cache or snapshot"""
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def render():
+    """get every metric in the Prometheus text format, with its content type
+
+    With several worker processes, metrics are aggregated from PROMETHEUS_MULTIPROC_DIR.
+    """
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
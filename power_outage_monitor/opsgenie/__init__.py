@@ -1 +1,2 @@
-from .api import OpsgenieApi
\ No newline at end of file
+from .api import OpsgenieApi
+from .outbox import Outbox
\ No newline at end of file
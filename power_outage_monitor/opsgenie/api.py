@@ -2,7 +2,9 @@ import requests
 from loguru import logger
 
 class OpsgenieApi:
-    def __init__(self, key, id_type = 'id'):
+    def __init__(self, key, id_type = 'id', session=None, url='https://api.opsgenie.com'):
+        self.url = url.rstrip('/')
+        self.session = session if session is not None else requests.Session()
         self.auth = {
             'Authorization': f'GenieKey {key}'
         }
@@ -13,7 +15,7 @@ class OpsgenieApi:
         }
 
     def add_alert_details(self, id, details, user=None, source=None, note=None):
-        url = 'https://api.opsgenie.com/v2/alerts/' + id + '/details'
+        url = self.url + '/v2/alerts/' + id + '/details'
         payload = {
             'details': details,
             'user': user,
@@ -22,12 +24,13 @@ class OpsgenieApi:
         }
 
         logger.info('POSTing alert api to update details')
-        request = requests.post(url, json=payload, headers=self.auth, params=self.params)
+        request = self.session.post(url, json=payload, headers=self.auth, params=self.params)
 
         request.raise_for_status()
+        return request.status_code
 
     def add_alert_tags(self, id, tags, user=None, source=None, note=None):
-        url = 'https://api.opsgenie.com/v2/alerts/' + id + '/tags'
+        url = self.url + '/v2/alerts/' + id + '/tags'
         payload = {
             'tags': tags,
             'user': user,
@@ -36,12 +39,13 @@ class OpsgenieApi:
         }
 
         logger.info('POSTing alert api to add tags')
-        request = requests.post(url, json=payload, headers=self.auth, params=self.params)
+        request = self.session.post(url, json=payload, headers=self.auth, params=self.params)
 
         request.raise_for_status()
+        return request.status_code
 
     def close_alert(self, id, user=None, source=None, note=None):
-        url = 'https://api.opsgenie.com/v2/alerts/' + id + '/close'
+        url = self.url + '/v2/alerts/' + id + '/close'
         payload = {
             'user': user,
             'source': source,
@@ -49,6 +53,7 @@ class OpsgenieApi:
         }
 
         logger.info('POSTing alert api to close alert')
-        request = requests.post(url, json=payload, headers=self.auth, params=self.params)
+        request = self.session.post(url, json=payload, headers=self.auth, params=self.params)
 
         request.raise_for_status()
+        return request.status_code
@@ -0,0 +1,204 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class Outbox:
+    """Durable queue of alert updates delivered to Opsgenie by a background thread.
+
+    It has the same add_alert_tags and add_alert_details methods as OpsgenieApi, which
+    queue the update and return 202 Accepted. Pending updates of the same alert are sent
+    together: tags are combined and details merged, later values winning. Deliveries that
+    fail are retried with jittered exponential backoff up to max_attempts times, except
+    those rejected with a 4xx status other than 429.
+
+    Parameters
+    ----------
+    opsgenie_api : OpsgenieApi
+    path : str
+        Path of the SQLite database.
+    poll_interval : float
+        Seconds between checks for updates that are ready to send.
+    coalesce_delay : float
+        Seconds a new update waits for other updates of the same alert before it is sent.
+    max_backoff : float
+        Maximum seconds between retries.
+    max_attempts : int
+        Attempts before an alert's updates are dropped.
+    leader : callable
+        When several worker processes share the database, returns True in the one process
+        that delivers updates. Every process delivers if not given.
+    """
+
+    def __init__(self, opsgenie_api, path, poll_interval=1, coalesce_delay=0.5, max_backoff=300, max_attempts=10,
+                 leader=None):
+        self.opsgenie_api = opsgenie_api
+        self.leader = leader
+        self.poll_interval = poll_interval
+        self.coalesce_delay = coalesce_delay
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS outbox ("
+                               "id INTEGER PRIMARY KEY AUTOINCREMENT, alert_id TEXT, kind TEXT, payload TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS delivery ("
+                               "alert_id TEXT PRIMARY KEY, status TEXT, attempts INTEGER, "
+                               "next_attempt REAL, last_error TEXT, updated REAL)")
+
+    def _enqueue(self, alert_id, kind, payload):
+        now = time.time()
+        send_at = now + self.coalesce_delay
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO outbox (alert_id, kind, payload) VALUES (?, ?, ?)",
+                               (alert_id, kind, json.dumps(payload)))
+            # a new update is sent after coalesce_delay, even if earlier ones are backing off. Attempts
+            # are counted again once the earlier updates were delivered or dropped.
+            self._conn.execute("INSERT INTO delivery VALUES (?, 'pending', 0, ?, NULL, ?) "
+                               "ON CONFLICT(alert_id) DO UPDATE SET status = 'pending', next_attempt = ?, updated = ?, "
+                               "attempts = CASE WHEN status IN ('delivered', 'failed') THEN 0 ELSE attempts END",
+                               (alert_id, send_at, now, send_at, now))
+        self._wake.set()
+        return 202
+
+    def add_alert_details(self, id, details, user=None, source=None, note=None):
+        return self._enqueue(id, 'details', {'details': details, 'user': user, 'source': source, 'note': note})
+
+    def add_alert_tags(self, id, tags, user=None, source=None, note=None):
+        return self._enqueue(id, 'tags', {'tags': tags, 'user': user, 'source': source, 'note': note})
+
+    def status(self, alert_id):
+        """get the delivery status of an alert's updates
+
+        Returns
+        -------
+        dict
+            'status' is one of pending, retrying, delivered or failed
+
+        None
+            If no updates were queued for the alert
+        """
+
+        with self._lock:
+            row = self._conn.execute("SELECT status, attempts, last_error, updated FROM delivery WHERE alert_id = ?",
+                                     (alert_id,)).fetchone()
+        if row is None:
+            return None
+        status, attempts, last_error, updated = row
+        return {'alertId': alert_id, 'status': status, 'attempts': attempts, 'lastError': last_error, 'updated': updated}
+
+    def _ready(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT alert_id FROM delivery WHERE status IN ('pending', 'retrying') AND next_attempt <= ?",
+                (time.time(),))]
+
+    def _set_status(self, alert_id, status, attempts, next_attempt=0, error=None):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE delivery SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, updated = ? "
+                               "WHERE alert_id = ?", (status, attempts, next_attempt, error, time.time(), alert_id))
+
+    @staticmethod
+    def coalesce(rows):
+        """merge queued updates of one alert into at most one tags and one details payload"""
+        tags = None
+        details = None
+        for kind, payload in rows:
+            if kind == 'tags':
+                if tags is None:
+                    tags = dict(payload, tags=[])
+                tags['tags'].extend(tag for tag in payload['tags'] if tag not in tags['tags'])
+                tags.update({key: val for key, val in payload.items() if key != 'tags' and val is not None})
+            else:
+                if details is None:
+                    details = dict(payload, details={})
+                details['details'].update(payload['details'])
+                details.update({key: val for key, val in payload.items() if key != 'details' and val is not None})
+        return tags, details
+
+    def deliver(self, alert_id):
+        """send all queued updates of an alert"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, kind, payload FROM outbox WHERE alert_id = ? ORDER BY id",
+                                      (alert_id,)).fetchall()
+            attempts = self._conn.execute("SELECT attempts FROM delivery WHERE alert_id = ?", (alert_id,)).fetchone()[0]
+        if not rows:
+            self._set_status(alert_id, 'delivered', attempts)
+            return
+        attempts += 1
+        tags_sent = False
+        try:
+            tags, details = self.coalesce((kind, json.loads(payload)) for _, kind, payload in rows)
+            # tags first, as check_all sends them before details
+            if tags is not None:
+                self.opsgenie_api.add_alert_tags(alert_id, **tags)
+                tags_sent = True
+            if details is not None:
+                self.opsgenie_api.add_alert_details(alert_id, **details)
+        except Exception as err:
+            # any error counts as an attempt, so updates that can never be sent end up failed
+            response = getattr(err, 'response', None)
+            status_code = response.status_code if response is not None else None
+            if tags_sent:
+                # tags were delivered, so do not send them again
+                self._delete(row_id for row_id, kind, _ in rows if kind == 'tags')
+            if (status_code is None or status_code in RETRY_STATUSES) and attempts < self.max_attempts:
+                backoff = min(self.max_backoff, self.poll_interval * 2**attempts)
+                retry_after = response.headers.get('Retry-After') if response is not None else None
+                if retry_after and retry_after.isdigit():
+                    backoff = max(backoff, int(retry_after))
+                backoff = random.uniform(backoff / 2, backoff)
+                logger.warning(f"Could not deliver updates to alert {alert_id}, retrying in {backoff:.0f}s: {err}")
+                self._set_status(alert_id, 'retrying', attempts, time.time() + backoff, str(err))
+            else:
+                logger.error(f"Could not deliver updates to alert {alert_id}: {err}")
+                self._delete(row_id for row_id, _, _ in rows)
+                self._set_status(alert_id, 'failed', attempts, error=str(err))
+                self._requeue_remaining(alert_id)
+            return
+        self._delete(row_id for row_id, _, _ in rows)
+        logger.info(f"Delivered {len(rows)} updates to alert {alert_id}.")
+        self._set_status(alert_id, 'delivered', attempts)
+        self._requeue_remaining(alert_id)
+
+    def _requeue_remaining(self, alert_id):
+        """mark an alert pending again if updates were queued while its earlier ones were sent"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE delivery SET status = 'pending', attempts = 0, next_attempt = ? "
+                               "WHERE alert_id = ? AND EXISTS (SELECT 1 FROM outbox WHERE alert_id = ?)",
+                               (time.time(), alert_id, alert_id))
+
+    def _delete(self, row_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", ((row_id,) for row_id in row_ids))
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready = self._ready() if self.leader is None or self.leader() else []
+            for alert_id in ready:
+                try:
+                    self.deliver(alert_id)
+                except Exception:
+                    logger.exception(f"Failed to deliver updates to alert {alert_id}.")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='opsgenie-outbox', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,150 @@
+import math
+
+import numpy as np
+import shapely
+
+# same earth radius as the GIS snapshot's haversine
+EARTH_RADIUS_METERS = 6371008.8
+# widens search margins, as great circles bend away from parallels and meridians converge
+SEARCH_SLACK = 1.01
+# maximum number of point-edge pairs tested at once, bounds the size of intermediate arrays
+CHUNK_SIZE = 1 << 18
+
+def haversine(long1, lat1, long2, lat2):
+    """great-circle distance in meters between (longitude, latitude) points, element-wise"""
+    long1, lat1, long2, lat2 = map(np.radians, (long1, lat1, long2, lat2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2)**2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+def search_margins(distance, latitude):
+    """get (longitude, latitude) degrees around a point at latitude that hold every point within
+    distance meters of it"""
+    margin_y = SEARCH_SLACK * math.degrees(distance / EARTH_RADIUS_METERS)
+    margin_x = margin_y / max(math.cos(math.radians(min(abs(latitude) + margin_y, 90))), 0.01)
+    return margin_x, margin_y
+
+def shape_parts(shape):
+    """yield (coordinates, is_ring) for each ring, line and point making up shape"""
+    geom_type = shape.geom_type
+    if geom_type == "Polygon":
+        if shape.is_empty:
+            return
+        yield np.asarray(shape.exterior.coords)[:, :2], True
+        for interior in shape.interiors:
+            yield np.asarray(interior.coords)[:, :2], True
+    elif geom_type in ("MultiPolygon", "MultiLineString", "MultiPoint", "GeometryCollection"):
+        for geom in shape.geoms:
+            yield from shape_parts(geom)
+    elif not shape.is_empty:
+        yield np.asarray(shape.coords)[:, :2], False
+
+class OutageIndex:
+    """Edge table of outage shapes for testing many points against all of them in vectorized passes.
+
+    Every shape's edges are stored contiguously as (x1, y1, x2, y2) rows. Points are matched to
+    shapes with a bounding box prefilter over points sorted by longitude, then an even-odd ray
+    casting test over the shape's ring edges and, if a search distance is given, the great-circle
+    distance to the shape's nearest point in a local equirectangular projection around the point,
+    as GisSnapshot.query measures it.
+
+    Parameters
+    ----------
+    shapes : list
+        shapely geometries in (longitude, latitude).
+    """
+
+    def __init__(self, shapes):
+        self.shapes = shapes
+        edges = []
+        rings = []
+        self.starts = np.zeros(len(shapes) + 1, dtype=np.int64)
+        for i, shape in enumerate(shapes):
+            count = 0
+            for coords, is_ring in shape_parts(shape):
+                if len(coords) > 1:
+                    part = np.hstack((coords[:-1], coords[1:]))
+                else:
+                    # a point is a zero length edge
+                    part = np.hstack((coords, coords))
+                edges.append(part)
+                rings.append(np.full(len(part), is_ring))
+                count += len(part)
+            self.starts[i + 1] = self.starts[i] + count
+        self.edges = np.vstack(edges) if edges else np.zeros((0, 4))
+        self.rings = np.concatenate(rings) if rings else np.zeros(0, dtype=bool)
+        self.bounds = shapely.bounds(np.asarray(shapes, dtype=object)) if shapes else np.zeros((0, 4))
+
+    def _matches(self, i, longitudes, latitudes, distance):
+        """test points against shape i, returning a boolean array"""
+        edges = self.edges[self.starts[i]:self.starts[i + 1]]
+        rings = self.rings[self.starts[i]:self.starts[i + 1]]
+        if not len(edges):
+            return np.zeros(len(longitudes), dtype=bool)
+        x1, y1, x2, y2 = edges.T
+        matched = []
+        step = max(1, CHUNK_SIZE // len(edges))
+        for start in range(0, len(longitudes), step):
+            px = longitudes[start:start + step, None]
+            py = latitudes[start:start + step, None]
+
+            # count ring edges crossed by a ray from each point towards +x
+            straddles = rings & ((y1 > py) != (y2 > py))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            inside = np.count_nonzero(straddles & (px < x_cross), axis=1) % 2 == 1
+
+            if distance:
+                # nearest point of the shape in a local equirectangular projection around each point
+                scale_x = np.cos(np.radians(py))
+                ax, ay = (x1 - px) * scale_x, y1 - py
+                dx, dy = (x2 - px) * scale_x - ax, y2 - py - ay
+                length2 = dx * dx + dy * dy
+                t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+                nearest = ((ax + t * dx)**2 + (ay + t * dy)**2).argmin(axis=1)
+                t = t[np.arange(len(nearest)), nearest]
+                nearest_x = x1[nearest] + t * (x2[nearest] - x1[nearest])
+                nearest_y = y1[nearest] + t * (y2[nearest] - y1[nearest])
+                inside |= haversine(px[:, 0], py[:, 0], nearest_x, nearest_y) <= distance
+            matched.append(inside)
+        return np.concatenate(matched)
+
+    def join(self, longitudes, latitudes, distance=0):
+        """find the first shape matching each point
+
+        Parameters
+        ----------
+        longitudes : array_like
+        latitudes : array_like
+        distance : float
+            Meters a point may be from a shape and still match it.
+
+        Returns
+        -------
+        numpy.ndarray
+            Index of the first matching shape of each point, or -1 if none match.
+        """
+
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        count = len(self.shapes)
+        first = np.full(len(longitudes), count, dtype=np.int64)
+        order = np.argsort(longitudes)
+        sorted_longitudes = longitudes[order]
+
+        # shapes in ascending order, so the first match of a point is its lowest shape index
+        for i, (min_x, min_y, max_x, max_y) in enumerate(self.bounds):
+            if math.isnan(min_x):
+                continue
+            margin_x, margin_y = search_margins(distance, max(abs(min_y), abs(max_y)))
+            lo = np.searchsorted(sorted_longitudes, min_x - margin_x, side="left")
+            hi = np.searchsorted(sorted_longitudes, max_x + margin_x, side="right")
+            candidates = order[lo:hi]
+            candidate_latitudes = latitudes[candidates]
+            candidates = candidates[(candidate_latitudes >= min_y - margin_y) & (candidate_latitudes <= max_y + margin_y)
+                                    & (first[candidates] == count)]
+            if not len(candidates):
+                continue
+            matched = self._matches(i, longitudes[candidates], latitudes[candidates], distance)
+            first[candidates[matched]] = i
+        first[first == count] = -1
+        return first
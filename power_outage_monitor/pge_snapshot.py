@@ -0,0 +1,113 @@
+import json
+
+from loguru import logger
+
+import http_client
+import metrics
+from snapshot import Snapshot
+
+class PgeSnapshot(Snapshot):
+    """Cached copy of PG&E's statewide outage regions, indexed by region and coordinates.
+
+    The payload is downloaded on demand once it is older than the TTL, and every outage is
+    transformed once per download instead of once per lookup. If the download fails, the
+    previous payload is still used until it is max_staleness seconds old.
+
+    Parameters
+    ----------
+    url : str
+    headers : dict
+    params : dict
+    transform : callable
+        Converts a raw outage into the dict returned to callers.
+    ttl : float
+        Seconds a download is reused for.
+    tolerance : float
+        If set, coordinates within this many degrees of an outage also match it.
+    max_staleness : float
+        Seconds a download may still be used for when downloading again fails, at least ttl.
+    """
+
+    def __init__(self, url, headers, params, transform, ttl=60, tolerance=0, max_staleness=None):
+        super().__init__("pge", ttl, max(ttl, max_staleness or 0))
+        self.url = url
+        self.headers = dict(headers or {})
+        self.params = dict(params or {})
+        self.transform = transform
+        self.tolerance = tolerance
+        self.regions = []
+        self.exact = {}
+        self.grid = {}
+
+    def _cell(self, longitude, latitude):
+        return round(float(longitude) / self.tolerance), round(float(latitude) / self.tolerance)
+
+    def load(self):
+        with metrics.span("pge", "get_outages_regions"):
+            response = http_client.get_session().get(self.url, headers=self.headers, params=self.params)
+        response.raise_for_status()
+        self.index(json.loads(response.content)['outagesRegions'])
+
+    def index(self, outage_regions, transform=True):
+        """index outage regions, transforming their outages unless they already are"""
+        exact = {}
+        grid = {}
+        regions = []
+        for outage_region in outage_regions:
+            outages = [self.transform(outage) for outage in outage_region['outages']] if transform \
+                else outage_region['outages']
+            regions.append({'regionName': outage_region['regionName'], 'outages': outages})
+            for outage in outages:
+                # first outage wins, as with a linear scan
+                exact.setdefault((outage_region['regionName'], outage['longitude'], outage['latitude']), outage)
+                if self.tolerance:
+                    try:
+                        cell = self._cell(outage['longitude'], outage['latitude'])
+                    except (TypeError, ValueError):
+                        continue
+                    grid.setdefault((outage_region['regionName'],) + cell, []).append(outage)
+        self.exact, self.grid = exact, grid
+        self.regions = regions
+
+    def dump(self):
+        return self.regions
+
+    def restore(self, state):
+        self.index(state, transform=False)
+
+    def lookup(self, region, longitude, latitude):
+        """find the outage at a site's region and coordinates, refreshing the cache if expired
+
+        Returns
+        -------
+        dict
+            A copy of the transformed outage
+
+        None
+            If no outage matches
+
+        Raises
+        ------
+        RuntimeError
+            If the cache could not be refreshed and is older than max_staleness
+        """
+
+        if self.is_due() and not self.refresh(if_due=True):
+            if not self.is_fresh():
+                raise RuntimeError("PG&E outage snapshot is unavailable.")
+            logger.warning(f"Using PG&E outages from {self.age():.0f}s ago, refreshing them failed.")
+        outage = self.exact.get((region, longitude, latitude))
+        if outage is None and self.tolerance:
+            longitude, latitude = float(longitude), float(latitude)
+            cell_x, cell_y = self._cell(longitude, latitude)
+            # tolerance is the cell size, so neighbouring cells hold every candidate
+            candidates = (o for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                          for o in self.grid.get((region, cell_x + dx, cell_y + dy), ()))
+            for candidate in candidates:
+                if abs(float(candidate['longitude']) - longitude) <= self.tolerance \
+                        and abs(float(candidate['latitude']) - latitude) <= self.tolerance:
+                    outage = candidate
+                    break
+        if outage is None:
+            return None
+        return dict(outage)
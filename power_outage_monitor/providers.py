@@ -0,0 +1,260 @@
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import shapely
+from loguru import logger
+from shapely.geometry import Point, box, shape
+from shapely.ops import unary_union
+
+import check_outage
+import location_index
+import metrics
+import sce_api
+from config import compiled, config, get_date_time
+
+def lookup_gis(site):
+    """get a site's status from CalOES's statewide layer"""
+    return check_outage.get_gis_power_status(site)
+
+def lookup_pge(site):
+    """get a site's status from PG&E's outages, matched by region and coordinates"""
+    return check_outage.get_pge_power_status(site)
+
+def lookup_sce(site):
+    """get a site's status from SCE's outages in the site's city
+
+    SCE only lists outages per city, so a city without outages means the site has power,
+    while outages in the city are reported as unknown.
+    """
+
+    address = ", ".join((site["street"], site["city"], site["state"])) + " " + (site.get("zip") or "")
+    with metrics.span("sce", "get_power_outage_sce"):
+        payload = sce_api.get_power_outage_sce(address.strip(), site["city"])
+    if payload is None or payload.get("outagesInCity"):
+        return None
+    return {"PowerStatus": "Active"}
+
+LOOKUPS = {
+    "gis": lookup_gis,
+    "pge": lookup_pge,
+    "sce": lookup_sce,
+}
+
+# utilities are authoritative in their own territory, the statewide layer lags behind them
+DEFAULT_PROVIDERS = {
+    "gis": {"enabled": True, "authoritative": False},
+    "pge": {"enabled": False, "authoritative": True},
+    "sce": {"enabled": False, "authoritative": True},
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    """lazily create the thread pool used to query the providers of a site concurrently"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = (config.get("providers") or {}).get("maxWorkers", 8)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+        return _executor
+
+def load_territory(territory):
+    """get a service territory from config, either a [min_lon, min_lat, max_lon, max_lat] bounding box
+    or the path of a GeoJSON file of its polygons"""
+    if isinstance(territory, (list, tuple)):
+        return box(*territory)
+    with open(territory) as fp:
+        geojson = json.load(fp)
+    if geojson.get("type") == "FeatureCollection":
+        return unary_union([shape(feature["geometry"]) for feature in geojson["features"]])
+    if geojson.get("type") == "Feature":
+        return shape(geojson["geometry"])
+    return shape(geojson)
+
+class Provider:
+    """Power provider queried for the sites in its service territory.
+
+    Parameters
+    ----------
+    name : str
+    lookup : callable
+        Called with a site, returns its status as a dict with PowerStatus 'Active' or 'Inactive',
+        or None if unknown.
+    territory : shapely.Geometry
+        Service territory, or None if the provider covers every site.
+    authoritative : bool
+        Whether an 'Active' answer is confident. An 'Inactive' answer always is.
+    """
+
+    def __init__(self, name, lookup, territory=None, authoritative=False):
+        self.name = name
+        self.lookup = lookup
+        self.territory = territory
+        self.authoritative = authoritative
+
+    def is_confident(self, status):
+        if not status:
+            return False
+        return status.get("PowerStatus") == "Inactive" or (self.authoritative and status.get("PowerStatus") == "Active")
+
+class ProviderRegistry:
+    """Power providers indexed by service territory, with the providers of each site computed
+    once and cached by coordinates.
+
+    Parameters
+    ----------
+    providers : list
+        Providers in order of preference, used when none of them answers confidently.
+    timeout : float
+        Seconds to wait on the providers of a site, or None to wait for all of them.
+    """
+
+    def __init__(self, providers, timeout=None):
+        self.providers = list(providers)
+        self.timeout = timeout
+        self._everywhere = [i for i, provider in enumerate(self.providers) if provider.territory is None]
+        self._territorial = [i for i, provider in enumerate(self.providers) if provider.territory is not None]
+        self._tree = shapely.STRtree([self.providers[i].territory for i in self._territorial])
+        self._routes = {}
+        self._routes_lock = threading.Lock()
+        self._precompute_lock = threading.Lock()
+        self._locations_version = None
+
+    def _route_indices(self, indices):
+        return tuple(self.providers[i] for i in sorted(set(self._everywhere) | set(indices)))
+
+    def precompute(self, points):
+        """compute the providers of many (longitude, latitude) points in one pass of the index"""
+        points = [point for point in points if point not in self._routes]
+        if not points:
+            return
+        matches = {}
+        if self._territorial:
+            point_indices, tree_indices = self._tree.query([Point(point) for point in points], predicate="intersects")
+            for point_index, tree_index in zip(point_indices, tree_indices):
+                matches.setdefault(point_index, []).append(self._territorial[tree_index])
+        routes = {point: self._route_indices(matches.get(i, ())) for i, point in enumerate(points)}
+        with self._routes_lock:
+            self._routes.update(routes)
+
+    def _precompute_sites(self):
+        """route every site of the location index whenever it changes, unless another thread is
+        already doing it"""
+        locations = location_index.get_index()
+        if locations is None or locations.version == self._locations_version:
+            return
+        if not self._precompute_lock.acquire(blocking=False):
+            return
+        try:
+            version = locations.version
+            self.precompute([point for point in map(location_index.site_point, locations.get_sites()) if point is not None])
+            self._locations_version = version
+        finally:
+            self._precompute_lock.release()
+        logger.info(f"Routed {len(self._routes)} sites to power providers.")
+
+    def route(self, site):
+        """get the providers that serve a site, in order of preference"""
+        point = location_index.site_point(site)
+        if point is None:
+            return tuple(self.providers[i] for i in self._everywhere)
+        routes = self._routes.get(point)
+        if routes is None:
+            self._precompute_sites()
+            routes = self._routes.get(point)
+            if routes is None:
+                self.precompute([point])
+                routes = self._routes[point]
+        return routes
+
+    @staticmethod
+    def _lookup(provider, site):
+        try:
+            return provider.lookup(site)
+        except Exception:
+            logger.exception(f"Failed to get power status from {provider.name}.")
+            return None
+
+    def get_status(self, site):
+        """query the providers of a site concurrently and return the first confident answer, otherwise
+        the answer of the most preferred provider that answered
+
+        Returns
+        -------
+        2-tuple
+            (provider name, status) or (None, None) if no provider answered
+        """
+
+        routes = self.route(site)
+        if not routes:
+            return None, None
+        if len(routes) == 1:
+            return routes[0].name, self._lookup(routes[0], site)
+
+        executor = _get_executor()
+        futures = {metrics.submit(executor, self._lookup, provider, site): provider for provider in routes}
+        statuses = {}
+        pending = set(futures)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while pending:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.error(f"Timed out after {self.timeout}s waiting on power providers "
+                             f"{', '.join(futures[future].name for future in pending)}.")
+                break
+            for future in done:
+                provider = futures[future]
+                status = future.result()
+                if provider.is_confident(status):
+                    return provider.name, status
+                statuses[provider.name] = status
+        for provider in routes:
+            if statuses.get(provider.name):
+                return provider.name, statuses[provider.name]
+        return None, None
+
+@compiled
+def get_registry():
+    """get the providers enabled by 'providers.{gis,pge,sce}.enabled', in the order of 'providers.order',
+    rebuilt when the config is reloaded"""
+    providers_config = config.get("providers") or {}
+    providers = []
+    for name in providers_config.get("order", list(LOOKUPS)):
+        provider_config = dict(DEFAULT_PROVIDERS[name], **(providers_config.get(name) or {}))
+        if provider_config["enabled"]:
+            territory = provider_config.get("territory")
+            providers.append(Provider(name, LOOKUPS[name], load_territory(territory) if territory else None,
+                                      provider_config["authoritative"]))
+    return ProviderRegistry(providers, timeout=providers_config.get("timeout"))
+
+def get_site_status(site):
+    """get the status of a site from the providers that serve it
+
+    Returns
+    -------
+    dict
+        Site information with the provider's outage information, in the shape of
+        check_outage.get_site_status
+
+    None
+        If no provider answered
+    """
+
+    provider, status = get_registry().get_status(site)
+    if status is None:
+        return None
+    logger.info(f"{provider.upper()} API USED")
+    payload = {
+        "SiteName": site["name"],
+        "Address": ", ".join((site["street"], site["city"], site["state"])),
+        "Longitude": site["longitude"],
+        "Latitude": site["latitude"],
+    }
+    payload.update(status)
+    payload["Time"] = get_date_time().format_now()
+    logger.info(json.dumps(payload, indent=4, sort_keys=True))
+    return payload
@@ -0,0 +1,91 @@
+import threading
+
+import metrics
+from config import config
+from snapshot import Snapshot
+
+# sensors read by check_all
+SENSOR_NAMES = ('Ping', 'Probe Health')
+
+class PrtgSnapshot(Snapshot):
+    """Statuses of every sensor named in SENSOR_NAMES, fetched with one table query per name
+    and indexed by (sensor name, device).
+
+    Parameters
+    ----------
+    prtg_api : PrtgApi
+    refresh_interval : float
+    max_staleness : float
+    """
+
+    def __init__(self, prtg_api, refresh_interval=60, max_staleness=180):
+        super().__init__("prtg", refresh_interval, max_staleness)
+        self.prtg_api = prtg_api
+        self.by_device = {}
+
+    def load(self):
+        self.index([sensor for name in SENSOR_NAMES
+                    for sensor in self.prtg_api._get_sensors_base({'filter_name': name, 'count': '*'})])
+
+    def index(self, sensors):
+        by_device = {}
+        for sensor in sensors:
+            key = (sensor['name'].lower(), sensor['device'].lower())
+            by_device.setdefault(key, []).append(sensor)
+        self.by_device = by_device
+
+    def dump(self):
+        return [sensor for sensors in self.by_device.values() for sensor in sensors]
+
+    def restore(self, state):
+        self.index(state)
+
+    def get_sensors_by_name(self, name, group=None, device=None):
+        """get sensors like PrtgApi.get_sensors_by_name, i.e. by name and device with group
+        matching by substring
+
+        Returns
+        -------
+        dict
+            The matching sensors under 'sensors', as returned by PRTG's table API
+        """
+
+        name = name.lower()
+        if device is not None:
+            sensors = self.by_device.get((name, device.lower()), [])
+        else:
+            sensors = [sensor for (sensor_name, _), matches in self.by_device.items()
+                       if sensor_name == name for sensor in matches]
+        if group:
+            group = group.lower()
+            sensors = [sensor for sensor in sensors if group in sensor['group'].lower()]
+        return {"sensors": [dict(sensor) for sensor in sensors]}
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+def start_snapshot(prtg_api):
+    """start the PRTG sensor snapshot if enabled by 'prtg.snapshot.enabled'"""
+    global _snapshot
+    snapshot_config = config['prtg'].get('snapshot') or {}
+    with _snapshot_lock:
+        if snapshot_config.get('enabled') and _snapshot is None:
+            _snapshot = PrtgSnapshot(prtg_api,
+                                     refresh_interval=snapshot_config.get('refreshInterval', 60),
+                                     max_staleness=snapshot_config.get('maxStaleness', 180))
+            _snapshot.start()
+
+def get_snapshot(fresh=True):
+    """get the sensor snapshot if it is running and, unless fresh is False, fresh. Otherwise None"""
+    if _snapshot is not None and (not fresh or _snapshot.is_fresh()):
+        return _snapshot
+    return None
+
+def get_sensors_by_name(prtg_api, name, group=None, device=None):
+    """get sensors from the snapshot if it is fresh, otherwise from PRTG"""
+    use_snapshot = _snapshot is not None and _snapshot.is_fresh()
+    metrics.cache_lookup('prtg_snapshot', use_snapshot)
+    if use_snapshot:
+        return _snapshot.get_sensors_by_name(name, group, device)
+    with metrics.span('prtg', 'get_sensors_by_name'):
+        return prtg_api.get_sensors_by_name(name, group, device)
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from config import compiled, config
+
+class RateLimited(Exception):
+    """Raised when an upstream call would wait longer than 'rateLimits.maxWait' for its rate limit.
+
+    Parameters
+    ----------
+    upstream : str
+    retry_after : float
+        Seconds until the call could go through.
+    """
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"Rate limit of {upstream} exceeded, retry after {retry_after:.0f}s.")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most burst tokens.
+
+    Callers that find the bucket empty reserve the next token and sleep until it is refilled,
+    so waiting callers go through in arrival order at the configured rate.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    burst : int
+        Capacity of the bucket, i.e. calls allowed at once after a quiet period.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """take a token, waiting for one if the bucket is empty
+
+        Parameters
+        ----------
+        timeout : float
+            Maximum seconds to wait, or None to wait as long as needed.
+
+        Returns
+        -------
+        float
+            Seconds waited
+
+        None
+            If no token would be available within timeout. No token is taken.
+        """
+
+        with self._lock:
+            self._refill()
+            wait = max(0, (1 - self._tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return None
+            # reserve the token now, so later callers queue behind this one
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def wait_time(self):
+        """seconds until a token is available"""
+        with self._lock:
+            self._refill()
+            return max(0, (1 - self._tokens) / self.rate)
+
+@compiled
+def get_buckets():
+    """get a token bucket per upstream limited by 'rateLimits.upstreams.<upstream>.{rate,burst}',
+    rebuilt when the config is reloaded"""
+    upstreams = (config.get('rateLimits') or {}).get('upstreams') or {}
+    return {upstream: TokenBucket(limit['rate'], limit.get('burst'))
+            for upstream, limit in upstreams.items() if limit and limit.get('rate')}
+
+def acquire(upstream):
+    """wait for the rate limit of an upstream, if it has one
+
+    Returns
+    -------
+    float
+        Seconds waited
+
+    Raises
+    ------
+    RateLimited
+        If the wait would be longer than 'rateLimits.maxWait' seconds (default 10)
+    """
+
+    bucket = get_buckets().get(upstream)
+    if bucket is None:
+        return 0
+    waited = bucket.acquire((config.get('rateLimits') or {}).get('maxWait', 10))
+    if waited is None:
+        raise RateLimited(upstream, bucket.wait_time())
+    return waited
@@ -1,7 +1,13 @@
 import json
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
 
 from loguru import logger
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
@@ -9,14 +15,214 @@ from selenium.webdriver.support.ui import WebDriverWait
 
 from config import config
 
-def get_power_outage_sce(address):
+URL = "https://www.sce.com/outage-center/addresslookup"
+
+# text of each row of #city-outages, in the order:
+# type, last updated, estimated restoration, statuses, reason, outage number
+CITY_OUTAGES_SCRIPT = """
+return Array.from(document.querySelectorAll('#city-outages > div')).map(function (row) {
+    function text(selector) {
+        var element = row.querySelector(selector);
+        return element ? element.innerText.trim() : '';
+    }
+    return [
+        text(':scope > div:nth-of-type(1) > span'),
+        text(':scope > div:nth-of-type(1) > div'),
+        text(':scope > div:nth-of-type(2)'),
+        text(':scope > div:nth-of-type(3)'),
+        text(':scope > div:nth-of-type(4) > div:nth-of-type(1)'),
+        text(':scope > div:nth-of-type(5) > div:nth-of-type(2)')
+    ];
+});
+"""
+
+def new_chrome():
+    """start a headless Chromium browser"""
+
+    # Using FireFox
+    # firefox_options = webdriver.FirefoxOptions()
+    # firefox_options.add_argument("--headless")
+    # driver = webdriver.Firefox(options=firefox_options)
+
+    # Using Chromium
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument("--headless")
+    return webdriver.Chrome(options=chrome_options)
+
+class BrowserPool:
+    """Bounded pool of long-lived browsers that are reused across lookups.
+
+    Browsers are started on demand up to size, health checked before each use, and
+    recycled after max_uses lookups or when they stop responding. Callers wait in line
+    when every browser is busy.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of browsers.
+    max_uses : int
+        Number of lookups before a browser is replaced.
+    factory : callable
+        Starts a new browser, i.e. a selenium webdriver.
+    """
+
+    def __init__(self, size=2, max_uses=50, factory=new_chrome):
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def is_healthy(driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            logger.exception("Failed to quit browser.")
+
+    @contextmanager
+    def browser(self, timeout=None):
+        """borrow a browser, waiting up to timeout seconds for one to be free
+
+        Raises
+        ------
+        TimeoutError
+            If no browser became free in time
+        """
+
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No browser available.")
+        try:
+            try:
+                driver, uses = self._idle.get_nowait()
+            except queue.Empty:
+                driver, uses = self.factory(), 0
+            else:
+                if not self.is_healthy(driver):
+                    logger.warning("Replacing unresponsive browser.")
+                    self._quit(driver)
+                    driver, uses = self.factory(), 0
+            try:
+                yield driver
+            except Exception:
+                if not self.is_healthy(driver):
+                    self._quit(driver)
+                    driver = None
+                raise
+            finally:
+                if driver is not None:
+                    uses += 1
+                    if uses >= self.max_uses:
+                        self._quit(driver)
+                    else:
+                        self._idle.put((driver, uses))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """quit idle browsers"""
+        while True:
+            try:
+                driver, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(driver)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool():
+    """get the shared browser pool, configured by the 'sce-api' config section"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(size=config["sce-api"].get("poolSize", 2),
+                                max_uses=config["sce-api"].get("maxUses", 50))
+        return _pool
+
+class CityOutageCache:
+    """City outages scraped from SCE, kept for ttl seconds so other addresses in the
+    same city are served without another scrape. Each entry keeps the address SCE searched
+    when the outages were scraped.
+
+    Parameters
+    ----------
+    ttl : float
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cities = {}
+
+    def get(self, city):
+        """get a copy of the cached payload of a city, or None if missing or expired"""
+        with self._lock:
+            cached = self._cities.get(city)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            return None
+        return self._copy(cached[1])
+
+    def set(self, city, payload):
+        payload = self._copy(payload)
+        with self._lock:
+            self._cities[city] = (time.monotonic(), payload)
+
+    @staticmethod
+    def _copy(payload):
+        return {key: [dict(o) for o in val] if key == "outages" else val for key, val in payload.items()}
+
+_city_cache = None
+_city_cache_lock = threading.Lock()
+
+def get_city_cache():
+    """get the shared city outage cache, configured by 'sce-api.cityCacheTtl'"""
+    global _city_cache
+    with _city_cache_lock:
+        if _city_cache is None:
+            _city_cache = CityOutageCache(config["sce-api"].get("cityCacheTtl", 300))
+        return _city_cache
+
+def city_of(address):
+    """get the city of an address formatted as '[name, ]street, city, state[ zip]'
+
+    Returns
+    -------
+    str
+        Normalized city name
+
+    None
+        If address does not have a city component
+    """
+
+    parts = [part.strip() for part in address.split(",")]
+    if len(parts) < 3 or not parts[-2]:
+        return None
+    return " ".join(parts[-2].upper().split())
+
+def get_power_outage_sce(address, city=None):
     """Scrape outages from https://www.sce.com/outage-center/addresslookup
 
+    Outages are listed per city, so results are cached by city and reused for other
+    addresses in that city until 'sce-api.cityCacheTtl' expires. Cached results keep the
+    address SCE searched for them, which may be another address in the city.
+
     Parameters
     ----------
     address : str
         The address to lookup
 
+    city : str
+        The address's city. If not provided, it is parsed from address.
+
     Returns
     -------
     payload : dict
@@ -26,73 +232,81 @@ def get_power_outage_sce(address):
         If address could not be found
     """
 
-    # Using FireFox
-    # firefox_options = webdriver.FirefoxOptions()
-    # firefox_options.add_argument("--headless")
-    # driver = webdriver.Firefox(options=firefox_options)
+    city = " ".join(city.upper().split()) if city else city_of(address)
+    city_cache = get_city_cache()
+    if city:
+        cached = city_cache.get(city)
+        if cached is not None:
+            logger.info(f"Using cached SCE outages for {city}.")
+            return cached
 
-    # Using Chromium
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome(options=chrome_options)
+    with get_browser_pool().browser(timeout=config["sce-api"].get("acquireTimeout")) as driver:
+        payload = _lookup(driver, address)
+    if payload is not None and city:
+        city_cache.set(city, payload)
+    return payload
+
+def _lookup(driver, address):
+    driver.get(config["sce-api"].get("url", URL))
 
-    url = "https://www.sce.com/outage-center/addresslookup"
-    driver.get(url)
-    
     max_wait_time = config["sce-api"]["maxWaitTime"]
 
-    try:
-        # Find address input element, input address, and press ENTER key
-        search_input = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='search']/div/div[1]/form/input")))
-        search_input.send_keys(address)
-        search_input.send_keys(Keys.RETURN)
-
-        # Check address
-        address_element = WebDriverWait(driver, max_wait_time).until(
-            EC.visibility_of_element_located((By.ID, "address-searched")))
-        if not address_element.text:
-            logger.error("Could not find address")
-            return None
+    # Find address input element, input address, and press ENTER key
+    search_input = WebDriverWait(driver, max_wait_time).until(
+            EC.visibility_of_element_located((By.XPATH, "//*[@id='search']/div/div[1]/form/input")))
+    search_input.send_keys(address)
+    search_input.send_keys(Keys.RETURN)
+
+    # Check address
+    address_element = WebDriverWait(driver, max_wait_time).until(
+        EC.visibility_of_element_located((By.ID, "address-searched")))
+    if not address_element.text:
+        logger.error("Could not find address")
+        return None
+
+    # initialize return payload
+    payload = {}    
+    payload["address"] = address_element.text
 
-        # initialize return payload
-        payload = {}    
-        payload["address"] = address_element.text
-
-        # Find total number of outages
-        outages_city_count_element = WebDriverWait(driver, max_wait_time).until(
-            EC.visibility_of_element_located((By.XPATH, "//*[@id='heading-accordion-39357-1']/div/h3/button/span[2]")))
-        payload["outagesInCity"] = int(outages_city_count_element.text[1:2])
-        if payload["outagesInCity"] == 0:
-            return payload
-        
-        # initialize outage list
-        payload["outages"] = []
-
-        # open drop-down list
-        WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='heading-accordion-39357-1']/div/h3/button"))).click()
-
-        # Find and fill outage details
-        for i in range(0, payload["outagesInCity"]):
-            payload["outages"].append({})
-            payload["outages"][i]["outageType"] = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[1]/span"))).text
-            payload["outages"][i]["lastUpdated"] = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[1]/div"))).text[len("Last Updated: "):]
-            payload["outages"][i]["estimatedRestoreTime"] = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[2]"))).text[len("Estimated Time of Restoration: "):]
-            payload["outages"][i]["reason"] = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[4]/div[1]"))).text[len("Reason: "):]
-            payload["outages"][i]["outageNumber"] = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[5]/div[2]"))).text[len("Outage #:"):]
-            statuses = WebDriverWait(driver, max_wait_time).until(
-                EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[" + str(i + 1) + "]/div[3]"))).text
-            payload["outages"][i]["outageStatus"] = find_step_in_progress(statuses)
+    # Find total number of outages
+    outages_city_count_element = WebDriverWait(driver, max_wait_time).until(
+        EC.visibility_of_element_located((By.XPATH, "//*[@id='heading-accordion-39357-1']/div/h3/button/span[2]")))
+    payload["outagesInCity"] = int(re.search(r"\d+", outages_city_count_element.text).group())
+    if payload["outagesInCity"] == 0:
         return payload
-    finally:
-        # close browser
-        driver.quit()
+
+    # open drop-down list
+    WebDriverWait(driver, max_wait_time).until(
+            EC.visibility_of_element_located((By.XPATH, "//*[@id='heading-accordion-39357-1']/div/h3/button"))).click()
+
+    # Find and fill outage details, reading every row in a single round trip
+    WebDriverWait(driver, max_wait_time).until(
+        EC.visibility_of_element_located((By.XPATH, "//*[@id='city-outages']/div[1]")))
+    payload["outages"] = []
+    for outage_type, last_updated, restore_time, statuses, reason, outage_number in _read_city_outages(driver, max_wait_time):
+        payload["outages"].append({
+            "outageType": outage_type,
+            "lastUpdated": last_updated[len("Last Updated: "):],
+            "estimatedRestoreTime": restore_time[len("Estimated Time of Restoration: "):],
+            "reason": reason[len("Reason: "):],
+            "outageNumber": outage_number[len("Outage #:"):],
+            "outageStatus": find_step_in_progress(statuses)
+        })
+    return payload
+
+def _read_city_outages(driver, max_wait_time):
+    """read the rows of #city-outages, waiting up to max_wait_time seconds for their statuses to show"""
+    rows = []
+
+    def read(driver):
+        rows[:] = driver.execute_script(CITY_OUTAGES_SCRIPT)
+        return bool(rows) and all(statuses for _, _, _, statuses, _, _ in rows)
+
+    try:
+        WebDriverWait(driver, max_wait_time).until(read)
+    except TimeoutException:
+        logger.warning("Statuses of some SCE outages did not show, reporting them as unknown.")
+    return rows
 
 def find_step_in_progress(status_str):
     """Parse all statuses for step that is in progress
@@ -106,9 +320,14 @@ def find_step_in_progress(status_str):
     -------
     str
         Current step in progress
+
+    None
+        If no step is in progress or the statuses are missing
     """
 
     status_list = status_str.splitlines()
+    if not status_list:
+        return None
     # remove "Status:" string
     status_list.pop(0)
     for i in range(1, len(status_list), 2):
@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+
+from loguru import logger
+
+import cache_backend
+from config import config
+
+class SerialCache:
+    """Persistent map of CMDB CI sys_id to the serial of its Meraki device, for CIs
+    without a serial number in ServiceNow.
+
+    Resolved serials can be written back to ServiceNow in batches by a background thread,
+    see start_write_back(). Serials whose write-back failed are retried after the others.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, which is created on first use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def _conn(self):
+        """the database connection, opened on first use"""
+        if self._db is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS serial ("
+                             "sys_id TEXT PRIMARY KEY, serial TEXT, written INTEGER DEFAULT 0, "
+                             "attempts INTEGER DEFAULT 0)")
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(serial)")]
+                if 'attempts' not in columns:
+                    # databases created before failed write-backs were counted
+                    conn.execute("ALTER TABLE serial ADD COLUMN attempts INTEGER DEFAULT 0")
+            self._db = conn
+        return self._db
+
+    def get(self, sys_id):
+        """get the resolved serial of a CI, or None if not resolved"""
+        with self._lock:
+            row = self._conn.execute("SELECT serial FROM serial WHERE sys_id = ?", (sys_id,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, sys_id, serial):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO serial (sys_id, serial, written, attempts) VALUES (?, ?, 0, 0)",
+                               (sys_id, serial))
+
+    def delete(self, sys_id):
+        """forget the serial of a CI, e.g. after its device was replaced"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM serial WHERE sys_id = ?", (sys_id,))
+
+    def pending(self, limit):
+        """get up to limit (sys_id, serial) pairs not yet written back to ServiceNow, fewest failed
+        write-backs first"""
+        with self._lock:
+            return self._conn.execute("SELECT sys_id, serial FROM serial WHERE written = 0 "
+                                      "ORDER BY attempts LIMIT ?", (limit,)).fetchall()
+
+    def mark_written(self, sys_id, serial):
+        with self._lock, self._conn:
+            # the serial may have been re-resolved while writing
+            self._conn.execute("UPDATE serial SET written = 1 WHERE sys_id = ? AND serial = ?", (sys_id, serial))
+
+    def mark_failed(self, sys_id, serial):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE serial SET attempts = attempts + 1 WHERE sys_id = ? AND serial = ?", (sys_id, serial))
+
+    def write_back(self, snow_api, batch_size=100):
+        """write a batch of resolved serials back to cmdb_ci
+
+        Returns
+        -------
+        int
+            Number of serials written
+        """
+
+        written = 0
+        for sys_id, serial in self.pending(batch_size):
+            try:
+                snow_api.set_serial_number(sys_id, serial)
+            except Exception:
+                logger.exception(f"Failed to write serial number of CI {sys_id} back to ServiceNow.")
+                self.mark_failed(sys_id, serial)
+                continue
+            self.mark_written(sys_id, serial)
+            written += 1
+        if written:
+            logger.info(f"Wrote {written} resolved serial numbers back to ServiceNow.")
+        return written
+
+    def _run(self, snow_api, interval, batch_size):
+        while not self._stop.wait(interval):
+            if not cache_backend.hold_lease('serial-write-back', interval * 3):
+                continue
+            # keep writing full batches until caught up
+            while self.write_back(snow_api, batch_size) == batch_size and not self._stop.is_set():
+                pass
+
+    def start_write_back(self, snow_api, interval=300, batch_size=100):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(snow_api, interval, batch_size),
+                                            name="serial-write-back", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """get the serial cache at 'meraki.serialCache.path' under 'cache.dir', or None if it is disabled
+    by setting the path to null"""
+    global _cache
+    cache_config = (config.get('meraki') or {}).get('serialCache') or {}
+    path = cache_config.get('path', 'meraki_serials.db')
+    if not path:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SerialCache(cache_backend.cache_path(path))
+        return _cache
+
+def start_write_back(snow_api):
+    """start writing resolved serials back to ServiceNow if enabled by 'meraki.serialCache.writeBack'"""
+    cache_config = (config.get('meraki') or {}).get('serialCache') or {}
+    cache = get_cache()
+    if cache is not None and cache_config.get('writeBack'):
+        cache.start_write_back(snow_api, interval=cache_config.get('writeBackInterval', 300),
+                               batch_size=cache_config.get('batchSize', 100))
@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import Future
+from copy import deepcopy
+
+import metrics
+from cache_backend import MemoryCache
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one call, and caches its result
+    for ttl seconds. Callers get their own copy of the result.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds a result is reused for. If 0, only concurrent calls are coalesced.
+    cache : MemoryCache or SqliteCache
+        Where results are cached. A shared backend reuses results across worker processes,
+        which requires results to be JSON-serializable. In process if not given.
+    namespace : str
+        Prefix of the cache keys.
+    """
+
+    def __init__(self, ttl=0, cache=None, namespace=''):
+        self.ttl = ttl
+        self.cache = cache if cache is not None else MemoryCache()
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, func, *args):
+        """call func(*args), unless a call for key is in flight or its result is cached"""
+        with self._lock:
+            cached = self.cache.get(self.namespace + key) if self.ttl else None
+            if self.ttl:
+                metrics.cache_lookup(self.namespace.rstrip(':') or 'singleflight', cached is not None)
+            if cached is not None:
+                return deepcopy(cached)
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return deepcopy(future.result())
+
+        try:
+            result = func(*args)
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            if self.ttl:
+                self.cache.set(self.namespace + key, result, ttl=self.ttl)
+            return deepcopy(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def invalidate(self, key):
+        self.cache.delete(self.namespace + key)
@@ -0,0 +1,148 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from loguru import logger
+
+import cache_backend
+
+class Snapshot(ABC):
+    """Base class for upstream data sets that are downloaded in bulk, kept in memory,
+    and refreshed on an interval by a background thread.
+
+    Subclasses implement load(), which downloads the data set and swaps it in. Subclasses that
+    also implement dump() and restore() share the data set through a shared cache backend, so
+    only one worker process downloads it per refresh interval.
+
+    Parameters
+    ----------
+    name : str
+        Name used in log messages and the refresher thread name.
+    refresh_interval : float
+        Seconds between background refreshes.
+    max_staleness : float
+        Seconds after the last successful refresh that the snapshot may still be used.
+    """
+
+    def __init__(self, name, refresh_interval, max_staleness):
+        self.name = name
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.updated = None
+        # incremented on every successful refresh, so consumers can skip unchanged snapshots
+        self.version = 0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @abstractmethod
+    def load(self):
+        """download the data set and swap it in"""
+
+    def dump(self):
+        """get the loaded data set as JSON-serializable state, or None if it cannot be shared"""
+        return None
+
+    def restore(self, state):
+        """swap in a data set from state returned by dump()"""
+        raise NotImplementedError
+
+    def _load_shared(self, reuse=True):
+        """load the data set, or restore the copy shared by worker processes if it is recent
+        and reuse is True
+
+        Returns
+        -------
+        float
+            Seconds since the data set was downloaded
+        """
+
+        cache = cache_backend.get_cache()
+        if not cache.shared or type(self).dump is Snapshot.dump:
+            self.load()
+            return 0
+        key = f"snapshot:{self.name}"
+        shared = cache.get(key)
+        age = time.time() - shared['updated'] if shared is not None else None
+        if not reuse or age is None or age >= self.refresh_interval:
+            if not reuse or cache_backend.hold_lease(key, self.refresh_interval):
+                try:
+                    self.load()
+                    state = self.dump()
+                    if state is not None:
+                        cache.set(key, {'updated': time.time(), 'state': state}, ttl=self.max_staleness)
+                finally:
+                    cache_backend.release_lease(key)
+                return 0
+            if age is None or age > self.max_staleness:
+                # another worker is downloading, but there is no usable shared copy yet
+                self.load()
+                return 0
+        self.restore(shared['state'])
+        return age
+
+    def refresh(self, if_due=False, reuse=True):
+        """load the data set, keeping the previous one if the download fails
+
+        Parameters
+        ----------
+        if_due : bool
+            Only refresh if the snapshot is due for a refresh once the refresh lock is held,
+            so concurrent callers on an expired snapshot trigger a single download.
+        reuse : bool
+            Restore the copy shared by worker processes instead of downloading, if it is recent.
+
+        Returns
+        -------
+        bool
+            True if refresh succeeded or was not needed
+        """
+
+        with self._refresh_lock:
+            if if_due and not self.is_due():
+                return True
+            started = time.monotonic()
+            try:
+                age = self._load_shared(reuse)
+            except Exception:
+                logger.exception(f"Failed to refresh {self.name} snapshot.")
+                return False
+            finished = time.monotonic()
+            self.updated = finished - age
+            self.version += 1
+            logger.info(f"Refreshed {self.name} snapshot in {finished - started:.2f}s.")
+            return True
+
+    def age(self):
+        """seconds since the last successful refresh, or None if never loaded"""
+        if self.updated is None:
+            return None
+        return time.monotonic() - self.updated
+
+    def is_fresh(self):
+        age = self.age()
+        return age is not None and age <= self.max_staleness
+
+    def is_due(self):
+        """whether refresh_interval has passed since the last successful refresh"""
+        age = self.age()
+        return age is None or age >= self.refresh_interval
+
+    def status(self):
+        """readiness of the snapshot, as reported by /readyz"""
+        age = self.age()
+        return {'ready': self.is_fresh(), 'age': round(age, 1) if age is not None else None, 'version': self.version}
+
+    def _run(self):
+        self.refresh()
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-snapshot", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
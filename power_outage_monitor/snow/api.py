@@ -1,8 +1,11 @@
 import pysnow
 
 class SnowApi:
-    def __init__(self, instance, username, password, limit=10000, offset=0, display_value=False):
-        self.client = pysnow.Client(instance=instance, user=username, password=password)
+    def __init__(self, instance, username, password, limit=10000, offset=0, display_value=False, host=None, use_ssl=True):
+        if host:
+            self.client = pysnow.Client(host=host, user=username, password=password, use_ssl=use_ssl)
+        else:
+            self.client = pysnow.Client(instance=instance, user=username, password=password)
         self.client.parameters.limit = limit
         self.client.parameters.offset = offset
         self.client.parameters.display_value = display_value
@@ -11,14 +14,34 @@ class SnowApi:
         location_table = self.client.resource(api_path='/table/cmn_location')
         return location_table.get(query={'name': name}).one()
 
-    def get_cis_filtered_by(self, filters):
+    def get_sites(self, updated_after=None):
+        location_table = self.client.resource(api_path='/table/cmn_location')
+        if updated_after is None:
+            return location_table.get().all()
+        query = pysnow.QueryBuilder().field('sys_updated_on').greater_than(updated_after)
+        return location_table.get(query=query).all()
+
+    def get_cis_filtered_by(self, filters, updated_after=None):
         ci_table = self.client.resource(api_path='/table/cmdb_ci')
 
+        query = self._build_query(filters)
+        if updated_after is not None:
+            if query is None:
+                query = pysnow.QueryBuilder().field('sys_updated_on').greater_than(updated_after)
+            else:
+                query.AND().field('sys_updated_on').greater_than(updated_after)
+        if query is None:
+            return ci_table.get().all()
+        response = ci_table.get(query=query)
+        return response.all()
+
+    @staticmethod
+    def _build_query(filters):
         copy_filters = filters.copy()
         try:
             first_k, first_v = copy_filters.popitem()
         except KeyError:
-            return ci_table.get().all()
+            return None
         # first query
         query = pysnow.QueryBuilder().field(first_k)
         if first_v[0]:
@@ -44,8 +67,7 @@ class SnowApi:
                     query.equals(v[i])
                 else:
                     query.is_empty()
-        response = ci_table.get(query=query)
-        return response.all()
+        return query
 
     def set_long_lat(self, sys_id, long, lat):
         update = {
@@ -55,3 +77,10 @@ class SnowApi:
         ci_table = self.client.resource(api_path='/table/cmn_location')
         location = ci_table.update(query={'sys_id': sys_id}, payload=update)
         return location
+
+    def set_serial_number(self, sys_id, serial):
+        update = {
+            'serial_number': serial
+        }
+        ci_table = self.client.resource(api_path='/table/cmdb_ci')
+        return ci_table.update(query={'sys_id': sys_id}, payload=update)
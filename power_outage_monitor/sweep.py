@@ -0,0 +1,210 @@
+import threading
+import time
+
+import shapely
+from loguru import logger
+from shapely.geometry import Point, box
+
+import cache_backend
+import check_outage
+import location_index
+from config import config
+from outage_join import search_margins
+
+def feature_fingerprint(feature, shape, edit_date_field):
+    """identify a version of a feature by its edit date, if the layer has one, and its extent"""
+    edited = feature["attributes"].get(edit_date_field) if edit_date_field else None
+    return edited, shape.bounds
+
+class OutageSweep:
+    """Periodically evaluates every site in the location index against the GIS outage snapshot,
+    and runs the full status check only for sites whose provider status changed.
+
+    Evaluation is incremental: if neither the snapshot nor the sites changed, a sweep does nothing.
+    Otherwise only sites that moved, were added, or lie near an added or removed outage feature
+    are re-evaluated.
+
+    Parameters
+    ----------
+    locations : LocationIndex
+    gis_snapshot : GisSnapshot
+    run_check : callable
+        Called with a site whose provider status changed. Its return value is kept as the
+        site's latest details.
+    interval : float
+        Seconds between sweeps.
+    """
+
+    def __init__(self, locations, gis_snapshot, run_check, interval=60):
+        self.locations = locations
+        self.gis_snapshot = gis_snapshot
+        self.run_check = run_check
+        self.interval = interval
+        self.last_sweep = None
+        # per-site state
+        self.points = {}
+        self.statuses = {}
+        self.details = {}
+        # state of the inputs at the last sweep
+        self._locations_version = None
+        self._gis_version = None
+        self._features = {}
+        self._site_ids = []
+        self._site_tree = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sync_sites(self):
+        """update site points from the location index and return the ids of sites that moved or were added"""
+        changed = set()
+        points = {}
+        for sys_id, site in self.locations.rows.items():
+            point = location_index.site_point(site)
+            if point is None:
+                continue
+            points[sys_id] = point
+            if self.points.get(sys_id) != point:
+                changed.add(sys_id)
+        for sys_id in set(self.statuses) - set(points):
+            del self.statuses[sys_id]
+            self.details.pop(sys_id, None)
+        self.points = points
+        self._site_ids = list(points)
+        self._site_tree = shapely.STRtree([Point(points[sys_id]) for sys_id in self._site_ids])
+        return changed
+
+    def _sync_features(self):
+        """update feature fingerprints from the snapshot and return the ids of sites near changed features"""
+        edit_date_field = self.gis_snapshot.edit_date_field
+        features = {object_id: feature_fingerprint(feature, shape, edit_date_field)
+                    for object_id, (feature, shape) in self.gis_snapshot.store.items() if shape is not None}
+        changed_bounds = []
+        for object_id in features.keys() | self._features.keys():
+            fingerprint, previous = features.get(object_id), self._features.get(object_id)
+            if fingerprint != previous:
+                # an edited feature affects sites near both its old and new extent
+                changed_bounds.extend(version[1] for version in (fingerprint, previous) if version is not None)
+        self._features = features
+        if not changed_bounds or self._site_tree is None:
+            return set()
+
+        # include sites within the search distance of a changed feature
+        boxes = []
+        for min_x, min_y, max_x, max_y in changed_bounds:
+            margin_x, margin_y = search_margins(self.gis_snapshot.distance, max(abs(min_y), abs(max_y)))
+            boxes.append(box(min_x - margin_x, min_y - margin_y, max_x + margin_x, max_y + margin_y))
+        _, site_indices = self._site_tree.query(boxes, predicate='intersects')
+        return {self._site_ids[i] for i in set(site_indices.tolist())}
+
+    def sweep(self):
+        """evaluate sites affected by changes since the last sweep
+
+        Returns
+        -------
+        list
+            sys_ids of sites whose provider status changed
+        """
+
+        if not self.gis_snapshot.is_fresh() or not self.locations.is_fresh():
+            logger.warning("Skipping outage sweep, outage or location data is stale.")
+            return []
+        started = time.monotonic()
+        locations_version, gis_version = self.locations.version, self.gis_snapshot.version
+
+        to_evaluate = set()
+        if locations_version != self._locations_version:
+            to_evaluate |= self._sync_sites()
+        if gis_version != self._gis_version:
+            to_evaluate |= self._sync_features()
+        self._locations_version, self._gis_version = locations_version, gis_version
+
+        changed = []
+        for sys_id in to_evaluate:
+            longitude, latitude = self.points[sys_id]
+            status = "Inactive" if self.gis_snapshot.query(longitude, latitude) else "Active"
+            previous = self.statuses.get(sys_id)
+            self.statuses[sys_id] = status
+            # the first status of a site, e.g. on the first sweep of this process, only seeds it
+            if previous is not None and previous != status:
+                changed.append(sys_id)
+
+        for sys_id in changed:
+            site = self.locations.get_site(sys_id)
+            if site is None:
+                continue
+            logger.info(f"Provider status of site '{site['name']}' is now {self.statuses[sys_id]}.")
+            try:
+                self.details[sys_id] = self.run_check(site)
+            except Exception:
+                logger.exception(f"Failed to check site '{site['name']}'.")
+
+        self.last_sweep = time.time()
+        # publish the results to every worker process
+        cache_backend.get_cache().set('sweep', self.summary())
+        if to_evaluate:
+            logger.info(f"Swept {len(to_evaluate)} sites in {time.monotonic() - started:.2f}s, {len(changed)} changed.")
+        return changed
+
+    def get_outages(self):
+        """get the latest details of sites in an outage, by site name"""
+        outages = {}
+        for sys_id, status in list(self.statuses.items()):
+            if status == "Inactive":
+                site = self.locations.get_site(sys_id)
+                if site is not None:
+                    outages[site['name']] = self.details.get(sys_id)
+        return outages
+
+    def summary(self):
+        return {"lastSweep": self.last_sweep, "outages": self.get_outages()}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # with several worker processes, only one sweeps
+            if not cache_backend.hold_lease('sweep', self.interval * 3):
+                continue
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Outage sweep failed.")
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='outage-sweep', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+_sweep = None
+_sweep_lock = threading.Lock()
+
+def start_sweep(run_check):
+    """start sweeping all sites if enabled by 'sweep.enabled'
+
+    The sweep needs the GIS snapshot and the location index, so both must be enabled.
+    """
+    global _sweep
+    sweep_config = config.get('sweep') or {}
+    if not sweep_config.get('enabled'):
+        return
+    locations = location_index.get_index(fresh=False)
+    gis_snapshot = check_outage.get_gis_snapshot()
+    if locations is None or gis_snapshot is None:
+        logger.warning("Outage sweep is enabled but needs 'gis-api.snapshot' and 'snow.locations' enabled.")
+        return
+    with _sweep_lock:
+        if _sweep is None:
+            _sweep = OutageSweep(locations, gis_snapshot, run_check, interval=sweep_config.get('interval', 60))
+            _sweep.start()
+
+def get_sweep():
+    """get the outage sweep, or None if it is not running"""
+    return _sweep
+
+def get_summary():
+    """get the time and outages of the last sweep by any worker process, or None if not enabled"""
+    if _sweep is None:
+        return None
+    return cache_backend.get_cache().get('sweep') or _sweep.summary()
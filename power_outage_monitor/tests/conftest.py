@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# modules import each other by name, as when run from the power_outage_monitor directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def update_config():
+    """replace top-level config sections for one test, e.g. update_config({'rateLimits': {...}})"""
+    from config import config
+    previous = dict(config)
+    yield config.update
+    config.swap(previous)
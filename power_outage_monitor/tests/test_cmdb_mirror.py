@@ -0,0 +1,100 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pytz")
+pytest.importorskip("loguru")
+from cmdb_mirror import SNOW_TIME_FORMAT, CmdbMirror, SnowTableMirror
+
+FILTERS = {'install_status': '1'}
+
+class FakeSnowApi:
+    """Serves cmdb_ci rows updated after a datetime, recording each request's updated_after."""
+
+    def __init__(self):
+        self.rows = {}
+        self.requests = []
+        self.now = datetime(2026, 10, 18, 8, 0, 0)
+
+    def put(self, sys_id, name, location):
+        # rows are updated a minute apart, in ServiceNow's UTC time format
+        self.now += timedelta(minutes=1)
+        self.rows[sys_id] = {'sys_id': sys_id, 'name': name, 'location': {'value': location},
+                             'sys_updated_on': self.now.strftime(SNOW_TIME_FORMAT)}
+
+    def get_cis_filtered_by(self, filters, updated_after=None):
+        assert filters == FILTERS
+        self.requests.append(updated_after)
+        return [dict(row) for row in self.rows.values() if updated_after is None
+                or datetime.strptime(row['sys_updated_on'], SNOW_TIME_FORMAT) > updated_after.replace(tzinfo=None)]
+
+@pytest.fixture
+def snow_api():
+    snow_api = FakeSnowApi()
+    snow_api.put('ci1', 'Meraki MX67 Encinitas', 'loc1')
+    snow_api.put('ci2', 'Meraki MR36 Encinitas', 'loc1')
+    snow_api.put('ci3', 'Meraki MX67 Carlsbad', 'loc2')
+    return snow_api
+
+def names(mirror, location):
+    return sorted(ci['name'] for ci in mirror.get_cis(location, 'meraki'))
+
+def test_incremental_sync_requests_rows_updated_since_watermark(snow_api):
+    mirror = CmdbMirror(snow_api, FILTERS)
+    mirror.load()
+    assert snow_api.requests == [None]
+    assert mirror.last_sync.strftime(SNOW_TIME_FORMAT) == snow_api.rows['ci3']['sys_updated_on']
+
+    watermark = mirror.last_sync
+    snow_api.put('ci2', 'Meraki MR36 Carlsbad', 'loc2')
+    snow_api.put('ci4', 'Cisco ISR Encinitas', 'loc1')
+    mirror.load()
+
+    assert snow_api.requests[1] == watermark - timedelta(seconds=mirror.overlap)
+    assert names(mirror, 'loc1') == ['Meraki MX67 Encinitas']
+    assert names(mirror, 'loc2') == ['Meraki MR36 Carlsbad', 'Meraki MX67 Carlsbad']
+    assert sorted(mirror.rows) == ['ci1', 'ci2', 'ci3', 'ci4']
+    assert mirror.last_sync.strftime(SNOW_TIME_FORMAT) == snow_api.rows['ci4']['sys_updated_on']
+
+def test_watermark_is_kept_without_updates(snow_api):
+    mirror = CmdbMirror(snow_api, FILTERS)
+    mirror.load()
+    last_sync = mirror.last_sync
+    mirror.load()
+    assert mirror.last_sync == last_sync
+    assert sorted(mirror.rows) == ['ci1', 'ci2', 'ci3']
+
+def test_full_sync_drops_deleted_rows(snow_api):
+    mirror = CmdbMirror(snow_api, FILTERS, full_sync_interval=3600)
+    mirror.load()
+    del snow_api.rows['ci1']
+    mirror.load()
+    # deletions are not visible to incremental syncs
+    assert names(mirror, 'loc1') == ['Meraki MR36 Encinitas', 'Meraki MX67 Encinitas']
+
+    mirror.last_full_sync -= 3601
+    mirror.load()
+    assert snow_api.requests[-1] is None
+    assert names(mirror, 'loc1') == ['Meraki MR36 Encinitas']
+
+def test_sync_resumes_from_dump(snow_api):
+    mirror = CmdbMirror(snow_api, FILTERS)
+    mirror.load()
+
+    restored = CmdbMirror(snow_api, FILTERS)
+    restored.restore(json.loads(json.dumps(mirror.dump())))
+    snow_api.put('ci4', 'Meraki MX67 Oceanside', 'loc3')
+    restored.load()
+
+    assert snow_api.requests[-1] == mirror.last_sync - timedelta(seconds=mirror.overlap)
+    assert names(restored, 'loc3') == ['Meraki MX67 Oceanside']
+    assert names(restored, 'loc1') == ['Meraki MR36 Encinitas', 'Meraki MX67 Encinitas']
+
+def test_mirror_without_hooks_cannot_be_created():
+    class SitesMirror(SnowTableMirror):
+        def fetch(self, updated_after):
+            return []
+
+    with pytest.raises(TypeError, match="index"):
+        SitesMirror("cmn_location")
@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("prometheus_client")
+import geocode
+
+class FakeClock:
+    """Stand-in for the time module, whose time only moves when set."""
+
+    def __init__(self):
+        self.now = 1760000000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(geocode, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = geocode.GeocodeCache(str(tmp_path / "geocode_cache.db"), negative_ttl=3600)
+    monkeypatch.setattr(geocode, "_get_cache", lambda: cache)
+    return cache
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """addresses looked up upstream, of which only '1 Main St' is found"""
+    lookups = []
+    def find_address_candidates(address):
+        lookups.append(address)
+        return (-117.29, 33.05) if address.startswith("1 Main St") else (None, None)
+    monkeypatch.setattr(geocode, "_find_address_candidates", find_address_candidates)
+    return lookups
+
+def test_missed_address_is_cached_for_negative_ttl(cache, clock):
+    cache.set("9 Nowhere Rd", None, None)
+    assert cache.get("9 nowhere rd.") == (None, None)
+    clock.now += 3600
+    assert cache.get("9 Nowhere Rd") == (None, None)
+    clock.now += 1
+    assert cache.get("9 Nowhere Rd") is None
+
+def test_found_address_does_not_expire(cache, clock):
+    cache.set("1 Main St, Encinitas, CA", -117.29, 33.05)
+    clock.now += 365 * 86400
+    assert cache.get("1 MAIN ST , ENCINITAS, CA") == (-117.29, 33.05)
+
+def test_lookup_skips_upstream_for_cached_miss(cache, clock, lookups):
+    assert geocode.get_long_lat("9 Nowhere Rd") == (None, None)
+    assert geocode.get_long_lat("9 Nowhere Rd") == (None, None)
+    assert lookups == ["9 Nowhere Rd"]
+
+    clock.now += 3601
+    assert geocode.get_long_lat("9 Nowhere Rd") == (None, None)
+    assert lookups == ["9 Nowhere Rd"] * 2
+
+def test_batch_lookup_skips_upstream_for_cached_miss(cache, clock, monkeypatch, update_config):
+    update_config({"geocode": dict(geocode.config.get("geocode") or {}, batchSize=10)})
+    batches = []
+    def geocode_addresses(addresses):
+        batches.append(list(addresses))
+        return [(-117.29, 33.05) if address.startswith("1 Main St") else (None, None) for address in addresses]
+    monkeypatch.setattr(geocode, "_geocode_addresses", geocode_addresses)
+
+    addresses = ["1 Main St", "9 Nowhere Rd", "9 NOWHERE RD."]
+    assert geocode.get_long_lats(addresses) == [(-117.29, 33.05), (None, None), (None, None)]
+    assert geocode.get_long_lats(addresses) == [(-117.29, 33.05), (None, None), (None, None)]
+    assert batches == [["1 Main St", "9 Nowhere Rd"]]
+
+    clock.now += 3601
+    geocode.get_long_lats(addresses)
+    assert batches[1:] == [["9 Nowhere Rd"]]
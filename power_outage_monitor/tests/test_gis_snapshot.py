@@ -0,0 +1,140 @@
+import json
+import re
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("shapely")
+import http_client
+from gis_snapshot import GisSnapshot
+
+URL = "https://gis.example.com/Power_Outages/FeatureServer/0/query"
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = json.dumps(content)
+
+    def raise_for_status(self):
+        pass
+
+class FakeLayer:
+    """Answers the ArcGIS layer queries made by GisSnapshot from an in-memory feature set,
+    recording the kind of each query."""
+
+    def __init__(self, page_size=2):
+        self.features = {}
+        self.page_size = page_size
+        self.queries = []
+        self.edited = 0
+
+    def put(self, object_id, x, y):
+        # edit dates are epoch ms, strictly increasing and a whole minute apart
+        self.edited += 1
+        self.features[object_id] = {
+            "attributes": {"OBJECTID": object_id, "EditDate": 1760000000000 + self.edited * 60000},
+            "geometry": {"rings": [[[x, y], [x, y + 1], [x + 1, y + 1], [x + 1, y], [x, y]]]},
+        }
+
+    def get(self, url, headers=None, params=None):
+        if not url.endswith("/query"):
+            self.queries.append("metadata")
+            return FakeResponse({"objectIdField": "OBJECTID", "editFieldsInfo": {"editDateField": "EditDate"}})
+        if params.get("returnIdsOnly") == "true":
+            self.queries.append("ids")
+            return FakeResponse({"objectIds": sorted(self.features)})
+        if "objectIds" in params:
+            self.queries.append("by_ids")
+            object_ids = [int(object_id) for object_id in params["objectIds"].split(",")]
+            return FakeResponse({"features": [self.features[i] for i in object_ids if i in self.features]})
+
+        features = [self.features[i] for i in sorted(self.features)]
+        edited_since = re.search(r"EditDate > TIMESTAMP '(.+)'", params["where"])
+        if edited_since:
+            self.queries.append("edited")
+            watermark = datetime.strptime(edited_since.group(1), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            features = [feature for feature in features
+                        if feature["attributes"]["EditDate"] > watermark.timestamp() * 1000]
+        else:
+            self.queries.append("all")
+        page = features[params["resultOffset"]:params["resultOffset"] + params["resultRecordCount"]]
+        return FakeResponse({"features": page,
+                             "exceededTransferLimit": params["resultOffset"] + len(page) < len(features)})
+
+@pytest.fixture
+def layer(monkeypatch):
+    layer = FakeLayer()
+    for object_id in (1, 2, 3):
+        layer.put(object_id, object_id * 10, 0)
+    monkeypatch.setattr(http_client, "get_session", lambda: layer)
+    return layer
+
+def make_snapshot(layer):
+    return GisSnapshot(URL, None, {"where": "1=1"}, page_size=layer.page_size, overlap=0)
+
+def object_ids_at(snapshot, *points):
+    return [[feature["attributes"]["OBJECTID"] for feature in snapshot.query(x, y)] for x, y in points]
+
+def test_first_sync_downloads_the_whole_layer(layer):
+    snapshot = make_snapshot(layer)
+    snapshot.load()
+
+    assert layer.queries == ["metadata", "all", "all"]
+    assert sorted(snapshot.store) == [1, 2, 3]
+    assert snapshot.edit_date_field == "EditDate"
+    assert snapshot.watermark == layer.features[3]["attributes"]["EditDate"]
+
+def test_incremental_sync_applies_edits_additions_and_deletions(layer):
+    snapshot = make_snapshot(layer)
+    snapshot.load()
+    layer.queries.clear()
+
+    layer.put(2, 50, 50)
+    layer.put(4, 40, 0)
+    # committed late, with an edit date before the watermark
+    layer.put(5, 70, 0)
+    layer.features[5]["attributes"]["EditDate"] = layer.features[1]["attributes"]["EditDate"]
+    del layer.features[3]
+    snapshot.load()
+
+    assert layer.queries == ["edited", "ids", "by_ids"]
+    assert sorted(snapshot.store) == [1, 2, 4, 5]
+    assert object_ids_at(snapshot, (10.5, 0.5), (20.5, 0.5), (50.5, 50.5), (30.5, 0.5), (40.5, 0.5), (70.5, 0.5)) == [
+        [1], [], [2], [], [4], [5]]
+    assert snapshot.watermark == layer.features[4]["attributes"]["EditDate"]
+
+def test_incremental_sync_without_changes_downloads_no_features(layer):
+    snapshot = make_snapshot(layer)
+    snapshot.load()
+    store = snapshot.store
+    layer.queries.clear()
+
+    snapshot.load()
+    assert layer.queries == ["edited", "ids"]
+    assert snapshot.store == store
+
+def test_full_sync_after_interval(layer):
+    snapshot = make_snapshot(layer)
+    snapshot.load()
+    layer.queries.clear()
+
+    snapshot.last_full_sync -= snapshot.full_sync_interval + 1
+    # an edit the edit date does not reflect is only picked up by a full sync
+    layer.features[1]["geometry"]["rings"][0] = [[60, 0], [60, 1], [61, 1], [61, 0], [60, 0]]
+    snapshot.load()
+
+    assert layer.queries == ["all", "all"]
+    assert object_ids_at(snapshot, (10.5, 0.5), (60.5, 0.5)) == [[], [1]]
+
+def test_sync_resumes_from_dump(layer):
+    snapshot = make_snapshot(layer)
+    snapshot.load()
+    state = json.loads(json.dumps(snapshot.dump()))
+
+    restored = make_snapshot(layer)
+    restored.restore(state)
+    layer.queries.clear()
+    layer.put(4, 40, 0)
+    restored.load()
+
+    assert layer.queries == ["edited", "ids"]
+    assert sorted(restored.store) == [1, 2, 3, 4]
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("loguru")
+import cache_backend
+import jobs
+
+NEW, RETRY = 0, 1
+
+async def hold(gate, priority, entered, release, name):
+    async with gate.admit(priority):
+        entered.append(name)
+        await release.wait()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_gate_admits_up_to_max_active_then_by_priority():
+    async def run():
+        gate = jobs.PriorityGate(max_active=1)
+        entered, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(gate, RETRY, entered, release, 'first'))]
+        await settle()
+        tasks.append(asyncio.create_task(hold(gate, RETRY, entered, release, 'retry')))
+        await settle()
+        tasks.append(asyncio.create_task(hold(gate, NEW, entered, release, 'new')))
+        await settle()
+        assert entered == ['first']
+        assert (gate.active, gate.queued) == (1, 2)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert entered == ['first', 'new', 'retry']
+        assert (gate.active, gate.queued) == (0, 0)
+    asyncio.run(run())
+
+def test_gate_sheds_lower_priority_call_when_full():
+    async def run():
+        gate = jobs.PriorityGate(max_active=1, max_queued=1, retry_after=7)
+        entered, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(gate, NEW, entered, release, 'first'))
+        await settle()
+        retry = asyncio.create_task(hold(gate, RETRY, entered, release, 'retry'))
+        await settle()
+        new = asyncio.create_task(hold(gate, NEW, entered, release, 'new'))
+        await settle()
+        with pytest.raises(jobs.QueueFull) as err:
+            await retry
+        assert err.value.retry_after == 7
+        release.set()
+        await asyncio.gather(first, new)
+        assert entered == ['first', 'new']
+    asyncio.run(run())
+
+def test_gate_rejects_call_when_full_of_same_priority():
+    async def run():
+        gate = jobs.PriorityGate(max_active=1, max_queued=1)
+        entered, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(gate, NEW, entered, release, name)) for name in ('first', 'second')]
+        await settle()
+        with pytest.raises(jobs.QueueFull):
+            await hold(gate, NEW, entered, release, 'third')
+        release.set()
+        await asyncio.gather(*tasks)
+        assert entered == ['first', 'second']
+    asyncio.run(run())
+
+def test_gate_rejects_call_after_max_wait():
+    async def run():
+        gate = jobs.PriorityGate(max_active=1, max_wait=0.01)
+        entered, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(gate, NEW, entered, release, 'first'))
+        await settle()
+        with pytest.raises(jobs.QueueFull):
+            await hold(gate, NEW, entered, release, 'second')
+        assert gate.queued == 0
+        release.set()
+        await first
+        assert (gate.active, gate.queued) == (0, 0)
+    asyncio.run(run())
+
+def test_gate_forgets_cancelled_calls():
+    async def run():
+        gate = jobs.PriorityGate(max_active=1)
+        entered, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(gate, NEW, entered, release, 'first'))
+        await settle()
+        waiting = asyncio.create_task(hold(gate, NEW, entered, release, 'cancelled'))
+        await settle()
+        waiting.cancel()
+        await settle()
+        assert gate.queued == 0
+        release.set()
+        await first
+        assert entered == ['first']
+        assert (gate.active, gate.queued) == (0, 0)
+        # the slot is free again
+        await hold(gate, NEW, entered, release, 'next')
+        assert entered == ['first', 'next']
+    asyncio.run(run())
+
+def wait_finished(queue, job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.finished is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return queue.describe(job.id)
+
+def test_job_queue_returns_existing_job_of_a_key():
+    release = threading.Event()
+    queue = jobs.JobQueue(lambda value: release.wait(5) and {'value': value}, max_workers=1)
+    job, created = queue.submit('a1', 1)
+    same, created_again = queue.submit('a1', 2)
+    assert created and not created_again
+    assert same is job
+    release.set()
+    assert wait_finished(queue, job) == {'id': job.id, 'status': 'done', 'created': job.created,
+                                         'finished': job.finished, 'details': {'value': 1}}
+    assert queue.submit('a1', 3)[0] is job
+
+def test_failed_job_key_can_be_submitted_again():
+    def check(fail):
+        if fail:
+            raise ValueError('site not found')
+        return {}
+    queue = jobs.JobQueue(check, max_workers=1)
+    failed, _ = queue.submit('a1', True)
+    assert wait_finished(queue, failed)['error'] == 'site not found'
+    retried, created = queue.submit('a1', False)
+    assert created and retried is not failed
+    assert wait_finished(queue, retried)['status'] == 'done'
+    assert queue.describe(failed.id)['status'] == 'failed'
+
+def test_job_queue_rejects_jobs_when_full():
+    release = threading.Event()
+    queue = jobs.JobQueue(lambda: release.wait(5), max_workers=1, max_queued=1)
+    running, _ = queue.submit('a1')
+    while running.status != 'running':
+        time.sleep(0.01)
+    queue.submit('a2')
+    with pytest.raises(jobs.QueueFull):
+        queue.submit('a3')
+    release.set()
+
+def test_finished_jobs_expire_after_ttl():
+    queue = jobs.JobQueue(lambda: {}, max_workers=1, ttl=0.05)
+    job, _ = queue.submit('a1')
+    wait_finished(queue, job)
+    time.sleep(0.1)
+    assert queue.submit('a1')[0] is not job
+    assert queue.get(job.id) is None
+
+def test_jobs_are_described_from_the_shared_cache():
+    cache = cache_backend.MemoryCache()
+    queue = jobs.JobQueue(lambda: {'Power_ProviderStatus': 'Up'}, max_workers=1, cache=cache)
+    job, _ = queue.submit('a1')
+    wait_finished(queue, job)
+    other_worker = jobs.JobQueue(lambda: {}, cache=cache)
+    assert other_worker.describe(job.id) == queue.describe(job.id)
+    assert 'finished' not in jobs.Job('a2', ()).to_dict()
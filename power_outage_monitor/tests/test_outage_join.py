@@ -0,0 +1,78 @@
+import math
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("shapely")
+from gis_snapshot import GisSnapshot
+from outage_join import OutageIndex
+
+def ring(rng, longitude, latitude, radius, vertices):
+    """clockwise ring of a random star-shaped polygon, as ArcGIS lists exterior rings"""
+    angles = [-2 * math.pi * (k + rng.uniform(0, 0.5)) / vertices for k in range(vertices)]
+    points = [[longitude + math.cos(angle) * radius * rng.uniform(0.5, 1),
+               latitude + math.sin(angle) * radius * rng.uniform(0.5, 1)] for angle in angles]
+    return points + points[:1]
+
+def outage_features(rng, count):
+    features = []
+    for i in range(count):
+        longitude, latitude = rng.uniform(-124, -114.5), rng.uniform(32.6, 41.9)
+        rings = [ring(rng, longitude, latitude, rng.uniform(0.02, 0.2), rng.randint(5, 12))]
+        if i % 4 == 0:
+            # a hole around the center, counter-clockwise
+            rings.append(ring(rng, longitude, latitude, 0.005, 5)[::-1])
+        features.append({"attributes": {"OBJECTID": i + 1}, "geometry": {"rings": rings}})
+    return features
+
+def points_near_edges(rng, features, distance, count):
+    """points at about distance meters from a random vertex of the outages, in random directions"""
+    points = []
+    for _ in range(count):
+        coords = rng.choice(rng.choice(features)["geometry"]["rings"])
+        longitude, latitude = rng.choice(coords)
+        meters = distance * rng.uniform(0.95, 1.05)
+        angle = rng.uniform(0, 2 * math.pi)
+        points.append((longitude + meters * math.cos(angle) / (111195 * math.cos(math.radians(latitude))),
+                       latitude + meters * math.sin(angle) / 111195))
+    return points
+
+def make_snapshot(features, distance):
+    params = {"distance": distance, "units": "esriSRUnit_Meter"} if distance else {}
+    snapshot = GisSnapshot("https://gis.example.com/query", None, params)
+    snapshot.index(features)
+    return snapshot
+
+@pytest.mark.parametrize("distance", [0, 500, 2000])
+def test_join_matches_point_queries(distance):
+    rng = random.Random(distance)
+    features = outage_features(rng, 200)
+    snapshot = make_snapshot(features, distance)
+    points = points_near_edges(rng, features, distance or 1000, 3000)
+    points += [(rng.uniform(-124, -114.5), rng.uniform(32.6, 41.9)) for _ in range(1000)]
+
+    joined = snapshot.join([point[0] for point in points], [point[1] for point in points])
+    for point, match in zip(points, joined):
+        queried = snapshot.query(*point)
+        assert match == (queried[0] if queried else None), point
+
+def test_join_returns_first_matching_shape():
+    features = [
+        {"attributes": {"OBJECTID": 1}, "geometry": {"rings": [[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]]]}},
+        {"attributes": {"OBJECTID": 2}, "geometry": {"rings": [[[1, 1], [1, 3], [3, 3], [3, 1], [1, 1]]]}},
+    ]
+    snapshot = make_snapshot(features, 0)
+    joined = snapshot.join([1.5, 2.5, 5], [1.5, 2.5, 5])
+    assert [match and match["attributes"]["OBJECTID"] for match in joined] == [1, 2, None]
+
+def test_join_handles_holes_and_empty_index():
+    features = [{"attributes": {"OBJECTID": 1}, "geometry": {"rings": [
+        [[0, 0], [0, 4], [4, 4], [4, 0], [0, 0]],
+        [[1, 1], [3, 1], [3, 3], [1, 3], [1, 1]],
+    ]}}]
+    snapshot = make_snapshot(features, 0)
+    joined = snapshot.join([0.5, 2], [0.5, 2])
+    assert joined[0]["attributes"]["OBJECTID"] == 1
+    assert joined[1] is None
+    assert OutageIndex([]).join([0.5], [0.5]).tolist() == [-1]
@@ -0,0 +1,120 @@
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("loguru")
+from opsgenie.outbox import Outbox
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def http_error(status_code):
+    return requests.HTTPError(f"{status_code} error", response=FakeResponse(status_code))
+
+class FakeOpsgenieApi:
+    """Records the updates sent, raising the queued errors of details and tags updates first."""
+
+    def __init__(self, errors=(), tags_errors=()):
+        self.errors = {'details': list(errors), 'tags': list(tags_errors)}
+        self.sent = []
+
+    def _send(self, kind, alert_id, payload):
+        if self.errors[kind]:
+            raise self.errors[kind].pop(0)
+        self.sent.append((kind, alert_id, payload))
+        return 202
+
+    def add_alert_tags(self, id, **payload):
+        return self._send('tags', id, payload)
+
+    def add_alert_details(self, id, **payload):
+        return self._send('details', id, payload)
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    def make(opsgenie_api, **kwargs):
+        return Outbox(opsgenie_api, str(tmp_path / "outbox.db"), coalesce_delay=0, **kwargs)
+    return make
+
+def test_updates_of_an_alert_are_coalesced(make_outbox):
+    opsgenie_api = FakeOpsgenieApi()
+    outbox = make_outbox(opsgenie_api)
+    outbox.add_alert_tags('a1', ['Power_Down'], note='first')
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down', 'Cisco_MerakiStatus': 'Up'})
+    outbox.add_alert_tags('a1', ['Power_Down', 'Site_Down'])
+    outbox.add_alert_details('a1', {'Cisco_MerakiStatus': 'Down'}, note='second')
+    outbox.deliver('a1')
+
+    assert opsgenie_api.sent == [
+        ('tags', 'a1', {'tags': ['Power_Down', 'Site_Down'], 'user': None, 'source': None, 'note': 'first'}),
+        ('details', 'a1', {'details': {'Power_ProviderStatus': 'Down', 'Cisco_MerakiStatus': 'Down'},
+                           'user': None, 'source': None, 'note': 'second'}),
+    ]
+    assert outbox.status('a1')['status'] == 'delivered'
+    assert outbox.status('a1')['attempts'] == 1
+
+def test_failed_delivery_is_retried_with_backoff(make_outbox):
+    opsgenie_api = FakeOpsgenieApi([http_error(503)])
+    outbox = make_outbox(opsgenie_api)
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down'})
+    outbox.deliver('a1')
+
+    status = outbox.status('a1')
+    assert status['status'] == 'retrying'
+    assert status['attempts'] == 1
+    assert outbox._ready() == []
+
+    outbox.deliver('a1')
+    assert outbox.status('a1')['status'] == 'delivered'
+    assert [kind for kind, _, _ in opsgenie_api.sent] == ['details']
+
+def test_delivered_tags_are_not_sent_again(make_outbox):
+    opsgenie_api = FakeOpsgenieApi(errors=[http_error(502)])
+    outbox = make_outbox(opsgenie_api)
+    outbox.add_alert_tags('a1', ['Power_Down'])
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down'})
+    outbox.deliver('a1')
+    assert outbox.status('a1')['status'] == 'retrying'
+
+    outbox.deliver('a1')
+    assert [kind for kind, _, _ in opsgenie_api.sent] == ['tags', 'details']
+
+@pytest.mark.parametrize("error", [requests.ConnectionError("refused"), ValueError("bad payload")])
+def test_delivery_fails_after_max_attempts(make_outbox, error):
+    opsgenie_api = FakeOpsgenieApi([error] * 3)
+    outbox = make_outbox(opsgenie_api, max_attempts=3)
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down'})
+    for attempts in (1, 2):
+        outbox.deliver('a1')
+        assert outbox.status('a1')['status'] == 'retrying'
+        assert outbox.status('a1')['attempts'] == attempts
+    outbox.deliver('a1')
+
+    status = outbox.status('a1')
+    assert status['status'] == 'failed'
+    assert status['attempts'] == 3
+    assert outbox._ready() == []
+
+def test_rejected_delivery_is_not_retried(make_outbox):
+    opsgenie_api = FakeOpsgenieApi([http_error(400)])
+    outbox = make_outbox(opsgenie_api)
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down'})
+    outbox.deliver('a1')
+
+    assert outbox.status('a1')['status'] == 'failed'
+    assert outbox.status('a1')['attempts'] == 1
+
+def test_updates_queued_after_failure_are_sent(make_outbox):
+    opsgenie_api = FakeOpsgenieApi([http_error(400)])
+    outbox = make_outbox(opsgenie_api)
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Down'})
+    outbox.deliver('a1')
+    outbox.add_alert_details('a1', {'Power_ProviderStatus': 'Up'})
+
+    assert outbox._ready() == ['a1']
+    outbox.deliver('a1')
+    assert opsgenie_api.sent == [('details', 'a1', {'details': {'Power_ProviderStatus': 'Up'},
+                                                    'user': None, 'source': None, 'note': None})]
+    assert outbox.status('a1')['status'] == 'delivered'
+    assert outbox.status('a1')['attempts'] == 1
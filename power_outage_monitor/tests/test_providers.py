@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+pytest.importorskip("shapely")
+providers = pytest.importorskip("providers")
+from shapely.geometry import box
+
+from providers import Provider, ProviderRegistry
+
+# around Encinitas, in SCE's bounding box only, and around Fresno, in PG&E's only
+ENCINITAS = {"name": "Encinitas", "longitude": "-117.29", "latitude": "33.05"}
+FRESNO = {"name": "Fresno", "longitude": "-119.79", "latitude": "36.74"}
+SCE_TERRITORY = box(-119.5, 33.0, -114.5, 35.5)
+PGE_TERRITORY = box(-124.5, 35.0, -118.0, 42.0)
+
+def answer(status):
+    return lambda site: status
+
+def make_registry(gis=None, pge=None, sce=None, timeout=None):
+    return ProviderRegistry([
+        Provider("pge", pge or answer(None), PGE_TERRITORY, authoritative=True),
+        Provider("sce", sce or answer(None), SCE_TERRITORY, authoritative=True),
+        Provider("gis", gis or answer(None)),
+    ], timeout=timeout)
+
+def names(routes):
+    return [provider.name for provider in routes]
+
+def test_sites_are_routed_by_territory():
+    registry = make_registry()
+    assert names(registry.route(ENCINITAS)) == ["sce", "gis"]
+    assert names(registry.route(FRESNO)) == ["pge", "gis"]
+    # in both bounding boxes
+    assert names(registry.route({"longitude": -118.5, "latitude": 35.2})) == ["pge", "sce", "gis"]
+    assert names(registry.route({"longitude": -75.0, "latitude": 40.0})) == ["gis"]
+    assert names(registry.route({"name": "No coordinates", "longitude": None})) == ["gis"]
+
+def test_routes_are_computed_once_per_point():
+    registry = make_registry()
+    registry.precompute([(-117.29, 33.05)])
+    routes = registry.route(ENCINITAS)
+    assert registry.route(dict(ENCINITAS, name="Encinitas 2")) is routes
+
+def test_confident_answer_is_returned_first():
+    release = threading.Event()
+    def slow_gis(site):
+        release.wait(5)
+        return {"PowerStatus": "Active"}
+    registry = make_registry(gis=slow_gis, sce=answer({"PowerStatus": "Active", "Source": "sce"}))
+    try:
+        assert registry.get_status(ENCINITAS) == ("sce", {"PowerStatus": "Active", "Source": "sce"})
+    finally:
+        release.set()
+
+def test_outage_from_a_non_authoritative_provider_is_confident():
+    registry = make_registry(gis=answer({"PowerStatus": "Inactive"}), sce=answer(None))
+    assert registry.get_status(ENCINITAS) == ("gis", {"PowerStatus": "Inactive"})
+
+def test_unconfident_answers_fall_back_to_preference():
+    def failing_sce(site):
+        raise ValueError("SCE is down")
+    registry = make_registry(gis=answer({"PowerStatus": "Active"}), sce=failing_sce)
+    assert registry.get_status(ENCINITAS) == ("gis", {"PowerStatus": "Active"})
+    assert make_registry().get_status(ENCINITAS) == (None, None)
+
+def test_slow_providers_are_abandoned_after_timeout():
+    release = threading.Event()
+    def slow_sce(site):
+        release.wait(5)
+        return {"PowerStatus": "Inactive"}
+    registry = make_registry(gis=answer({"PowerStatus": "Active"}), sce=slow_sce, timeout=0.1)
+    try:
+        assert registry.get_status(ENCINITAS) == ("gis", {"PowerStatus": "Active"})
+    finally:
+        release.set()
+
+def test_registry_follows_config(update_config):
+    update_config({"providers": {"order": ["sce", "gis"], "sce": {"enabled": True, "territory": [-119.5, 33.0, -114.5, 35.5]},
+                                 "timeout": 10}})
+    registry = providers.get_registry()
+    assert names(registry.route(ENCINITAS)) == ["sce", "gis"]
+    assert names(registry.route(FRESNO)) == ["gis"]
+    assert registry.timeout == 10
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+pytest.importorskip("loguru")
+import ratelimit
+
+def test_bucket_allows_burst_then_paces_calls():
+    bucket = ratelimit.TokenBucket(rate=20, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire(timeout=0) is None
+    started = time.monotonic()
+    waited = bucket.acquire()
+    assert 0 < waited <= 0.05
+    assert time.monotonic() - started >= waited * 0.9
+
+def test_bucket_refills_up_to_burst():
+    bucket = ratelimit.TokenBucket(rate=100, burst=1)
+    bucket.acquire()
+    time.sleep(0.05)
+    assert bucket.wait_time() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire(timeout=0) is None
+
+def test_acquire_raises_when_wait_exceeds_max_wait(update_config):
+    update_config({'rateLimits': {'maxWait': 0.01, 'upstreams': {'opsgenie': {'rate': 1, 'burst': 1}}}})
+    assert ratelimit.acquire('opsgenie') == 0
+    with pytest.raises(ratelimit.RateLimited) as err:
+        ratelimit.acquire('opsgenie')
+    assert err.value.upstream == 'opsgenie'
+    assert 0.5 < err.value.retry_after <= 1
+
+def test_upstreams_without_limit_are_not_paced(update_config):
+    update_config({'rateLimits': {'upstreams': {'opsgenie': {'rate': 1}}}})
+    for _ in range(5):
+        assert ratelimit.acquire('gis') == 0
+
+def test_buckets_are_rebuilt_on_reload(update_config):
+    update_config({'rateLimits': {'maxWait': 0, 'upstreams': {'gis': {'rate': 1, 'burst': 1}}}})
+    ratelimit.acquire('gis')
+    update_config({'rateLimits': {'maxWait': 0, 'upstreams': {'gis': {'rate': 1, 'burst': 5}}}})
+    assert ratelimit.get_buckets()['gis'].burst == 5
+    assert ratelimit.acquire('gis') == 0
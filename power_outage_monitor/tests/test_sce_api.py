@@ -0,0 +1,160 @@
+import pathlib
+
+import pytest
+
+sce_api = pytest.importorskip("sce_api")
+from selenium.common.exceptions import WebDriverException
+
+from config import config
+
+PAGE = pathlib.Path(__file__).parent / "fixtures" / "sce_addresslookup.html"
+
+class FakeDriver:
+    """Stand-in for a webdriver that only answers health checks."""
+
+    def __init__(self):
+        self.crashed = False
+        self.quit_called = False
+
+    def execute_script(self, script):
+        if self.crashed:
+            raise WebDriverException("chrome not reachable")
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+class FakeFactory:
+    def __init__(self):
+        self.drivers = []
+
+    def __call__(self):
+        driver = FakeDriver()
+        self.drivers.append(driver)
+        return driver
+
+@pytest.fixture
+def sce_config(update_config):
+    update_config({"sce-api": {"url": PAGE.as_uri(), "maxWaitTime": 10, "poolSize": 1, "cityCacheTtl": 300}})
+    return config["sce-api"]
+
+@pytest.fixture
+def chrome():
+    """factory of headless browsers, skipping the test if none can be started"""
+    try:
+        sce_api.new_chrome().quit()
+    except WebDriverException as err:
+        pytest.skip(f"Cannot start a headless browser: {err.msg}")
+    return sce_api.new_chrome
+
+def test_pool_reuses_browser():
+    factory = FakeFactory()
+    pool = sce_api.BrowserPool(size=1, max_uses=5, factory=factory)
+    for _ in range(3):
+        with pool.browser() as driver:
+            assert driver is factory.drivers[0]
+    assert len(factory.drivers) == 1
+
+def test_pool_recycles_browser_after_max_uses():
+    factory = FakeFactory()
+    pool = sce_api.BrowserPool(size=1, max_uses=2, factory=factory)
+    used = []
+    for _ in range(3):
+        with pool.browser() as driver:
+            used.append(driver)
+    assert used[0] is used[1]
+    assert used[0].quit_called
+    assert used[2] is factory.drivers[1]
+    assert not used[2].quit_called
+
+def test_pool_evicts_unhealthy_browser():
+    factory = FakeFactory()
+    pool = sce_api.BrowserPool(size=1, max_uses=5, factory=factory)
+    with pool.browser() as driver:
+        pass
+    driver.crashed = True
+    with pool.browser() as replacement:
+        assert replacement is not driver
+    assert driver.quit_called
+
+def test_pool_drops_browser_that_crashes_during_lookup():
+    factory = FakeFactory()
+    pool = sce_api.BrowserPool(size=1, max_uses=5, factory=factory)
+    with pytest.raises(WebDriverException):
+        with pool.browser() as driver:
+            driver.crashed = True
+            driver.execute_script("return 1")
+    assert driver.quit_called
+    with pool.browser() as replacement:
+        assert replacement is not driver
+
+def test_pool_times_out_when_every_browser_is_busy():
+    pool = sce_api.BrowserPool(size=1, max_uses=5, factory=FakeFactory())
+    with pool.browser():
+        with pytest.raises(TimeoutError):
+            with pool.browser(timeout=0.01):
+                pass
+
+def test_find_step_in_progress():
+    statuses = "Status:\nStep 1:Outage reported\nCompleted\nStep 2:Crew assigned\nIn Progress"
+    assert sce_api.find_step_in_progress(statuses) == "Crew assigned"
+    assert sce_api.find_step_in_progress("Status:\nStep 1:Outage reported\nCompleted") is None
+
+def test_find_step_in_progress_without_statuses():
+    assert sce_api.find_step_in_progress("") is None
+
+class RenderingDriver:
+    """Stand-in for a webdriver whose city outage rows get their statuses after some reads."""
+
+    def __init__(self, reads_without_statuses):
+        self.reads_without_statuses = reads_without_statuses
+
+    def execute_script(self, script):
+        statuses = "Status:\nStep 1:Outage reported\nIn Progress"
+        if self.reads_without_statuses:
+            self.reads_without_statuses -= 1
+            statuses = ""
+        return [["Repair Outage", "Last Updated: now", "", statuses, "", ""]]
+
+def test_city_outages_wait_for_statuses():
+    rows = sce_api._read_city_outages(RenderingDriver(reads_without_statuses=1), max_wait_time=5)
+    assert sce_api.find_step_in_progress(rows[0][3]) == "Outage reported"
+
+def test_city_outages_without_statuses_are_unknown():
+    rows = sce_api._read_city_outages(RenderingDriver(reads_without_statuses=100), max_wait_time=0.1)
+    assert sce_api.find_step_in_progress(rows[0][3]) is None
+
+def test_city_cache_keeps_searched_address(monkeypatch):
+    city_cache = sce_api.CityOutageCache(ttl=300)
+    monkeypatch.setattr(sce_api, "_city_cache", city_cache)
+    payload = {"address": "450 QUAIL GARDENS DR, ENCINITAS, CA 92024", "outagesInCity": 1,
+               "outages": [{"outageNumber": "1234567"}]}
+    city_cache.set("ENCINITAS", payload)
+    payload["outages"][0]["outageNumber"] = "changed"
+
+    cached = sce_api.get_power_outage_sce("1 Main St, Encinitas, CA")
+    assert cached == {"address": "450 QUAIL GARDENS DR, ENCINITAS, CA 92024", "outagesInCity": 1,
+                      "outages": [{"outageNumber": "1234567"}]}
+
+def test_lookup_through_pool(sce_config, chrome, monkeypatch):
+    pool = sce_api.BrowserPool(size=1, max_uses=1, factory=chrome)
+    monkeypatch.setattr(sce_api, "_pool", pool)
+    monkeypatch.setattr(sce_api, "_city_cache", sce_api.CityOutageCache(sce_config["cityCacheTtl"]))
+    try:
+        payload = sce_api.get_power_outage_sce("450 Quail Gardens Dr, Encinitas, CA 92024")
+    finally:
+        pool.close()
+
+    assert payload["address"] == "450 QUAIL GARDENS DR, ENCINITAS, CA 92024"
+    assert payload["outagesInCity"] == 2
+    assert payload["outages"][0] == {
+        "outageType": "Repair Outage",
+        "lastUpdated": "10/18/2026 08:15 AM",
+        "estimatedRestoreTime": "10/18/2026 02:00 PM",
+        "reason": "Equipment failure",
+        "outageNumber": "1234567",
+        "outageStatus": "Crew assigned",
+    }
+    assert payload["outages"][1]["outageStatus"] == "Outage reported"
+    # the browser was recycled after its only use
+    assert pool._idle.empty()
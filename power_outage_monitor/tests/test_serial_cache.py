@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("loguru")
+import serial_cache
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(serial_cache, "_cache", None)
+
+def test_database_is_created_on_first_use_under_cache_dir(tmp_path, update_config, no_cache):
+    update_config({"cache": {"dir": str(tmp_path / "cache")}, "meraki": {"serialCache": {"path": "serials.db"}}})
+    cache = serial_cache.get_cache()
+    assert not (tmp_path / "cache" / "serials.db").exists()
+
+    assert cache.get("ci1") is None
+    assert (tmp_path / "cache" / "serials.db").exists()
+    cache.set("ci1", "Q2XX-1234-ABCD")
+    assert cache.get("ci1") == "Q2XX-1234-ABCD"
+
+def test_cache_can_be_disabled(update_config, no_cache):
+    update_config({"meraki": {"serialCache": {"path": None}}})
+    assert serial_cache.get_cache() is None
+
+class FakeSnowApi:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.serials = {}
+
+    def set_serial_number(self, sys_id, serial):
+        if sys_id in self.failing:
+            raise ValueError("ServiceNow is down")
+        self.serials[sys_id] = serial
+
+def test_failed_write_backs_are_retried_last(tmp_path):
+    cache = serial_cache.SerialCache(str(tmp_path / "serials.db"))
+    cache.set("ci1", "Q2XX-0001")
+    cache.set("ci2", "Q2XX-0002")
+    snow_api = FakeSnowApi(failing={"ci1"})
+    assert cache.write_back(snow_api, batch_size=10) == 1
+    assert snow_api.serials == {"ci2": "Q2XX-0002"}
+
+    cache.set("ci3", "Q2XX-0003")
+    assert cache.pending(10) == [("ci3", "Q2XX-0003"), ("ci1", "Q2XX-0001")]
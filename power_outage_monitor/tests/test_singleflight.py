@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+from singleflight import SingleFlight
+
+class SlowLookup:
+    """Counts its calls, which block until released."""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, address):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return {'address': address, **(self.result or {})}
+
+def call_concurrently(flight, lookup, count):
+    results, errors = [], []
+    def call():
+        try:
+            results.append(flight.do('a1', lookup, '1 Main St'))
+        except Exception as err:
+            errors.append(err)
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    threads[0].start()
+    lookup.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # release the leader's call once every follower waits on it
+    future = flight._in_flight['a1']
+    while len(future._condition._waiters) != count - 1:
+        time.sleep(0.001)
+    lookup.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    lookup = SlowLookup({'outages': []})
+    results, errors = call_concurrently(flight, lookup, 5)
+    assert lookup.calls == 1
+    assert not errors
+    assert results == [{'address': '1 Main St', 'outages': []}] * 5
+    # callers get their own copies
+    results[0]['outages'].append('changed')
+    assert results[1]['outages'] == []
+    assert flight._in_flight == {}
+
+def test_exception_reaches_every_caller():
+    flight = SingleFlight(ttl=60)
+    lookup = SlowLookup(error=ValueError('address not found'))
+    results, errors = call_concurrently(flight, lookup, 3)
+    assert lookup.calls == 1
+    assert not results
+    assert [str(err) for err in errors] == ['address not found'] * 3
+    # failures are not cached
+    lookup.error = None
+    assert flight.do('a1', lookup, '1 Main St') == {'address': '1 Main St'}
+    assert lookup.calls == 2
+
+def test_results_are_cached_for_ttl():
+    flight = SingleFlight(ttl=60, namespace='sce:')
+    lookup = SlowLookup({'outages': []})
+    lookup.release.set()
+    first = flight.do('a1', lookup, '1 Main St')
+    first['outages'].append('changed')
+    assert flight.do('a1', lookup, '1 Main St') == {'address': '1 Main St', 'outages': []}
+    assert lookup.calls == 1
+    assert flight.cache.get('sce:a1') == {'address': '1 Main St', 'outages': []}
+
+    flight.invalidate('a1')
+    flight.do('a1', lookup, '1 Main St')
+    assert lookup.calls == 2
+
+def test_results_are_not_cached_without_ttl():
+    flight = SingleFlight()
+    lookup = SlowLookup()
+    lookup.release.set()
+    flight.do('a1', lookup, '1 Main St')
+    flight.do('a1', lookup, '1 Main St')
+    assert lookup.calls == 2
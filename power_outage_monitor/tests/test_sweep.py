@@ -0,0 +1,84 @@
+import pytest
+
+pytest.importorskip("shapely")
+sweep = pytest.importorskip("sweep")
+from gis_snapshot import GisSnapshot
+
+class FakeLocations:
+    """Stand-in for the location index, always fresh."""
+
+    def __init__(self, sites):
+        self.rows = {site['sys_id']: site for site in sites}
+        self.version = 1
+
+    def is_fresh(self):
+        return True
+
+    def get_site(self, sys_id):
+        return dict(self.rows[sys_id])
+
+def square(object_id, x, y, edited):
+    return {"attributes": {"OBJECTID": object_id, "EditDate": edited},
+            "geometry": {"rings": [[[x, y], [x, y + 1], [x + 1, y + 1], [x + 1, y], [x, y]]]}}
+
+class CountingSnapshot(GisSnapshot):
+    """GIS snapshot indexed directly, counting point queries."""
+
+    def __init__(self):
+        super().__init__("https://gis.example.com/query", None, {"distance": 500, "units": "esriSRUnit_Meter"},
+                         edit_date_field="EditDate")
+        self.queries = 0
+
+    def is_fresh(self):
+        return True
+
+    def index(self, features):
+        super().index(features)
+        self.version += 1
+
+    def query(self, longitude, latitude):
+        self.queries += 1
+        return super().query(longitude, latitude)
+
+@pytest.fixture
+def outage_sweep():
+    locations = FakeLocations([
+        {'sys_id': 's1', 'name': 'Encinitas', 'longitude': '0.5', 'latitude': '0.5'},
+        {'sys_id': 's2', 'name': 'Carlsbad', 'longitude': '10.5', 'latitude': '0.5'},
+        {'sys_id': 's3', 'name': 'Oceanside', 'longitude': '20.5', 'latitude': '0.5'},
+    ])
+    snapshot = CountingSnapshot()
+    snapshot.index([square(1, 0, 0, 1000), square(2, 30, 0, 1000)])
+    checked = []
+    def run_check(site):
+        checked.append(site['name'])
+        return {'SiteName': site['name']}
+    outage_sweep = sweep.OutageSweep(locations, snapshot, run_check)
+    outage_sweep.checked = checked
+    # the first sweep only seeds the statuses
+    assert outage_sweep.sweep() == []
+    assert outage_sweep.statuses == {'s1': 'Inactive', 's2': 'Active', 's3': 'Active'}
+    snapshot.queries = 0
+    return outage_sweep
+
+def test_unchanged_features_are_not_evaluated(outage_sweep):
+    snapshot = outage_sweep.gis_snapshot
+    snapshot.index([square(1, 0, 0, 1000), square(2, 30, 0, 1000)])
+    assert outage_sweep.sweep() == []
+    assert snapshot.queries == 0
+
+def test_edited_feature_reevaluates_sites_near_old_and_new_extent(outage_sweep):
+    snapshot = outage_sweep.gis_snapshot
+    # the outage moves from Encinitas to Carlsbad
+    snapshot.index([square(1, 10, 0, 2000), square(2, 30, 0, 1000)])
+    assert sorted(outage_sweep.sweep()) == ['s1', 's2']
+    assert snapshot.queries == 2
+    assert sorted(outage_sweep.checked) == ['Carlsbad', 'Encinitas']
+    assert outage_sweep.get_outages() == {'Carlsbad': {'SiteName': 'Carlsbad'}}
+
+def test_added_and_removed_features_reevaluate_nearby_sites(outage_sweep):
+    snapshot = outage_sweep.gis_snapshot
+    snapshot.index([square(2, 30, 0, 1000), square(3, 20, 0, 2000)])
+    assert sorted(outage_sweep.sweep()) == ['s1', 's3']
+    assert snapshot.queries == 2
+    assert sorted(outage_sweep.get_outages()) == ['Oceanside']